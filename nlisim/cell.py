@@ -1,5 +1,5 @@
-from collections import defaultdict
-from typing import Any, Dict, Iterable, Iterator, List, Set, Type, Union, cast
+import itertools
+from typing import Any, Iterable, Iterator, List, Optional, Tuple, Type, Union, cast
 
 import attr
 from h5py import Group
@@ -7,9 +7,14 @@ import numpy as np
 
 from nlisim.coordinates import Point, Voxel
 from nlisim.grid import RectangularGrid
+from nlisim.random import rg
 from nlisim.state import State, get_class_path
 
 MAX_CELL_LIST_SIZE = 1000000
+MIN_CELL_LIST_CAPACITY = 16
+
+# offsets (dz, dy, dx) to the voxels of a 3x3x3 Moore neighborhood
+_MOORE_OFFSETS = np.array(list(itertools.product((-1, 0, 1), repeat=3)), dtype=np.intp)
 
 # the way numpy types single records is strange...
 CellType = Any
@@ -127,14 +132,24 @@ class CellList(object):
     This class represents a pythonic interface to the data contained in a
     CellData array.  Because the CellData class is a low-level object, it does
     not allow dynamically appending new elements.  Objects of this class get
-    around this limitation by pre-allocating a large block of memory that is
-    transparently available.  User-facing properties are sliced to make it
-    appear as if the extra data is not there.
+    around this limitation by over-allocating a block of memory that is
+    transparently available.  The block grows geometrically as cells are added
+    (so appending is amortized constant time) and never exceeds `max_cells`
+    records.  User-facing properties are sliced to make it appear as if the
+    extra data is not there.
 
     Subclassed types are expected to set the `CellDataClass` attribute to
     a subclass of `CellData`.  This provides information about the underlying
     low-level array.
 
+    The list also maintains an index of the cells contained in each voxel of
+    the grid.  The index is stored in compressed sparse row form: cell indices
+    are ordered by the flattened index of the voxel containing them, and an
+    offsets array gives the range of cells belonging to each voxel.  Appending
+    or moving cells only records the new voxel of each cell; the entries of
+    those cells are patched into the compressed arrays the next time the index
+    is queried, which rebuilds them only after compaction or large changes.
+
     Parameters
     ------
     grid : `simulation.grid.RectangularGrid`
@@ -153,8 +168,13 @@ class CellList(object):
     max_cells: int = attr.ib(default=MAX_CELL_LIST_SIZE)
     _cell_data: CellData = attr.ib()
     _ncells: int = attr.ib(init=False)
-    _voxel_index: Dict[Voxel, Set[int]] = attr.ib(init=False, factory=lambda: defaultdict(set))
-    _reverse_voxel_index: List[Voxel] = attr.ib(init=False, factory=list)
+    _cell_voxels: np.ndarray = attr.ib(init=False)
+    _voxel_offsets: np.ndarray = attr.ib(init=False)
+    _voxel_cells: np.ndarray = attr.ib(init=False)
+    _voxel_index_stale: bool = attr.ib(init=False, default=True)
+    # the voxel of each cell in the compressed arrays, and cells moved since
+    _indexed_voxels: np.ndarray = attr.ib(init=False)
+    _moved_cells: List[np.ndarray] = attr.ib(init=False, factory=list)
 
     @_cell_data.default
     def __set_default_cells(self) -> CellData:
@@ -163,8 +183,13 @@ class CellList(object):
     def __attrs_post_init__(self):
         cells = self._cell_data
 
+        if len(cells) > self.max_cells:
+            raise Exception('Not enough free space in cell tree')
+
+        capacity = self._capacity_for(len(cells))
         object.__setattr__(self, '_ncells', len(cells))
-        object.__setattr__(self, '_cell_data', self.CellDataClass(self.max_cells))
+        object.__setattr__(self, '_cell_data', self.CellDataClass(capacity))
+        object.__setattr__(self, '_cell_voxels', np.empty(capacity, dtype=np.intp))
 
         if len(cells) > 0:
             self._cell_data[: len(cells)] = cells
@@ -194,8 +219,17 @@ class CellList(object):
         return self._cell_data[: self._ncells]
 
     @property
-    def voxel_index(self):
-        return self._reverse_voxel_index
+    def capacity(self) -> int:
+        """Return the number of cells that fit in the currently allocated storage."""
+        return len(self._cell_data)
+
+    @property
+    def voxel_index(self) -> np.ndarray:
+        """Return the flattened index of the voxel containing each cell.
+
+        Cells located outside of the grid are assigned the index `-1`.
+        """
+        return self._cell_voxels[: self._ncells]
 
     @classmethod
     def create_from_seed(cls, grid: RectangularGrid, **kwargs) -> 'CellList':
@@ -209,7 +243,7 @@ class CellList(object):
 
         return cls(grid=grid, cell_data=cell_data)
 
-    def alive(self, sample: Iterable = None) -> np.ndarray:
+    def alive(self, sample: Optional[Iterable[int]] = None) -> np.ndarray:
         """Get a list of indices containing cells that are alive.
 
         This method will filter out cells that are dead according to the
@@ -253,22 +287,77 @@ class CellList(object):
         mask = (cell_data[sample_indices]['dead'] == False).nonzero()[0]  # noqa: E712
         return sample_indices[mask]
 
+    def reserve(self, size: int) -> None:
+        """Ensure the underlying storage can hold at least `size` cells.
+
+        The storage is grown geometrically, so calling this method for every
+        appended cell costs amortized constant time.  Records previously
+        returned by indexing into the list refer to the old storage after the
+        list is reallocated.
+        """
+        if size > self.max_cells:
+            raise Exception('Not enough free space in cell tree')
+        if size > self.capacity:
+            self._resize(max(size, self._capacity_for(2 * self.capacity)))
+
+    def shrink_to_fit(self) -> None:
+        """Release storage that is not needed to hold the current cells."""
+        capacity = self._capacity_for(self._ncells)
+        if capacity < self.capacity:
+            self._resize(capacity)
+
+    def compact(self) -> np.ndarray:
+        """Remove dead cells from the list.
+
+        Living cells keep their relative order.  The returned array maps the old
+        index of every cell to its new index, or to -1 if the cell was removed,
+        so that modules storing cell indices can rewrite them.  Storage is
+        released when the list falls below a quarter of its capacity.
+        """
+        alive = self.alive()
+        index_map = np.full(self._ncells, -1, dtype=np.intp)
+        index_map[alive] = np.arange(len(alive))
+        if len(alive) == self._ncells:
+            return index_map
+
+        count = len(alive)
+        self._cell_data[:count] = self._cell_data[alive]
+        self._cell_voxels[:count] = self._cell_voxels[alive]
+        object.__setattr__(self, '_ncells', count)
+        object.__setattr__(self, '_voxel_index_stale', True)
+        if count < self.capacity // 4:
+            self.shrink_to_fit()
+        return index_map
+
     def append(self, cell: CellType) -> None:
         """Append a new cell the the list."""
-        if len(self) >= self.max_cells:
-            raise Exception('Not enough free space in cell tree')
+        self.reserve(self._ncells + 1)
 
         index = self._ncells
         object.__setattr__(self, '_ncells', self._ncells + 1)
         self._cell_data[index] = cell
-        voxel = self.grid.get_voxel(cell['point'])
-        self._voxel_index[voxel].add(index)
-        self._reverse_voxel_index.append(voxel)
+        self._cell_voxels[index] = self._flatten_voxel(self.grid.get_voxel(cell['point']))
+
+    def extend(self, cells: Iterable[CellType]) -> None:
+        """Extend the cell list by multiple cells.
 
-    def extend(self, cells: Iterable[CellData]) -> None:
-        """Extend the cell list by multiple cells."""
-        for cell in cells:
-            self.append(cell)
+        The records are copied into the underlying storage with a single slice
+        assignment and their voxels are computed with one vectorized lookup.
+        """
+        if not isinstance(cells, np.ndarray):
+            cells = list(cells)
+        cell_data = np.asarray(cells, dtype=self._cell_data.dtype).reshape(-1)
+        count = len(cell_data)
+        if count == 0:
+            return
+
+        start = self._ncells
+        self.reserve(start + count)
+        object.__setattr__(self, '_ncells', start + count)
+        self._cell_data[start : start + count] = cell_data
+        self._cell_voxels[start : start + count] = self._flatten_voxels(
+            self.grid.get_voxels(cell_data['point'])
+        )
 
     def save(self, group: Group, name: str, metadata: dict) -> Group:
         """Save the cell list.
@@ -306,13 +395,132 @@ class CellList(object):
 
     def get_cells_in_voxel(self, voxel: Voxel) -> np.ndarray:
         """Return a list of cell indices contained in a given voxel."""
-        return np.asarray(sorted((self._voxel_index[voxel])))
+        key = self._flatten_voxel(voxel)
+        if key < 0:
+            return np.empty(0, dtype=np.intp)
+
+        offsets = self._get_voxel_offsets()
+        return self._voxel_cells[offsets[key] : offsets[key + 1]]
+
+    def get_cells_in_voxels(self, voxels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the cell indices contained in each of an array of voxels.
+
+        The voxels are given as an `(N, 3)` array in the same `(z, y, x)` order used by
+        `simulation.coordinates.Voxel`.  This method returns a tuple `(cells, counts)`
+        where `cells` is the concatenation of the (sorted) cell indices contained in each
+        voxel and `counts` is the number of cells in each voxel.  The voxel each cell was
+        found in can be recovered with `np.repeat(np.arange(N), counts)`.  Invalid voxels
+        contain no cells.
+        """
+        keys = self._flatten_voxels(voxels)
+        offsets = self._get_voxel_offsets()
+
+        valid = keys >= 0
+        starts = np.where(valid, offsets[np.maximum(keys, 0)], 0)
+        counts = np.where(valid, offsets[np.maximum(keys, 0) + 1] - starts, 0)
+
+        # gather the contiguous ranges [starts[i], starts[i] + counts[i]) in one call
+        total = counts.sum()
+        range_starts = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return self._voxel_cells[range_starts + np.arange(total)], counts
+
+    def voxel_counts(self, sample: Optional[Iterable[int]] = None) -> np.ndarray:
+        """Return a gridded array containing the number of cells in each voxel.
+
+        As with `alive`, an optional boolean mask or index array restricts the
+        count to a subset of the cells.  Dead cells are counted unless they are
+        filtered out by the sample.
+        """
+        if sample is None:
+            counts = np.diff(self._get_voxel_offsets())
+        else:
+            sample_indices = np.asarray(sample)
+            if sample_indices.dtype == 'b1':
+                if sample_indices.shape != self.cell_data.shape:
+                    raise ValueError('Expected boolean mask the same size as the cell list')
+                sample_indices = sample_indices.nonzero()[0]
+            keys = self.voxel_index[sample_indices]
+            counts = np.bincount(keys[keys >= 0], minlength=len(self.grid))
+
+        return counts.reshape(self.grid.shape)
+
+    def neighborhood_counts(
+        self, radius: int, sample: Optional[Iterable[int]] = None
+    ) -> np.ndarray:
+        """Return a gridded array counting the cells in the Moore neighborhood of each voxel.
+
+        The neighborhood of a voxel is the cube of voxels within `radius` of
+        it along every axis.  The optional sample is interpreted as in
+        `voxel_counts`.  Evaluate the result at `cells.grid_indices(...)` to get
+        the neighborhood counts around the cells of another list.
+        """
+        return self.grid.box_sum(self.voxel_counts(sample), radius)
+
+    def grid_indices(self, sample: Optional[Iterable[int]] = None) -> Tuple[np.ndarray, ...]:
+        """Return a tuple of index arrays locating the voxels containing the cells.
+
+        The tuple can be used to directly index gridded variables.  The optional
+        sample is interpreted as in `voxel_counts`, and cells outside of the grid
+        are omitted.
+        """
+        keys = self.voxel_index
+        if sample is not None:
+            keys = keys[np.asarray(sample)]
+        return np.unravel_index(keys[keys >= 0], self.grid.shape)
 
     def get_neighboring_cells(self, cell: CellData) -> np.ndarray:
         """Return a list of cells indices in the same voxel."""
         return self.get_cells_in_voxel(self.grid.get_voxel(cell['point']))
 
-    def update_voxel_index(self, indices: Iterable = None):
+    def move_up_gradient(
+        self, indices: Iterable, signal: np.ndarray, threshold: float, passable: np.ndarray
+    ) -> None:
+        """Move cells to the neighboring voxel with the strongest signal.
+
+        Every cell in `indices` moves one step within the 3x3x3 block of voxels
+        centered on its current voxel (staying put is one of the options).
+        Among the voxels inside the grid where `passable` is true, the cell
+        moves to the one with the largest `signal` value at or above
+        `threshold`, choosing uniformly at random between ties.  When no such
+        voxel exists, the cell moves to a uniformly random passable voxel.  The
+        cell keeps its offset from the center of its voxel, and the voxel index
+        is updated for all moved cells at once.
+        """
+        indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+        if len(indices) == 0:
+            return
+
+        grid = self.grid
+        voxels = grid.get_voxels(self.cell_data['point'][indices])
+        neighbors = voxels[:, np.newaxis, :] + _MOORE_OFFSETS  # shape (cells, 27, 3)
+
+        # padding the gridded arrays makes every neighbor of a voxel in the grid addressable
+        padded = tuple((neighbors + 1).transpose(2, 0, 1))
+        candidates = np.pad(passable, 1, constant_values=False)[padded]
+        values = np.pad(signal, 1)[padded]
+
+        if not candidates.any(axis=1).all():
+            raise AssertionError(
+                'This cell has no valid voxel to move to, including the one that it is in!'
+            )
+
+        # prefer the strongest signal above the threshold and fall back to any passable voxel
+        attracted = candidates & (values >= threshold)
+        strongest = np.where(attracted, values, -np.inf)
+        attracted &= strongest == strongest.max(axis=1, keepdims=True)
+        choices = np.where(attracted.any(axis=1, keepdims=True), attracted, candidates)
+
+        # the largest uniform random key selects uniformly among the remaining choices
+        keys = np.where(choices, rg.random(choices.shape), -1.0)
+        targets = neighbors[np.arange(len(indices)), keys.argmax(axis=1)]
+
+        # the jump happens at the voxel level, so shift the point by the change in voxel center
+        points = np.asarray(self.cell_data['point'])
+        for axis, centers in enumerate((grid.z, grid.y, grid.x)):
+            points[indices, axis] += centers[targets[:, axis]] - centers[voxels[:, axis]]
+        self.update_voxel_index(indices)
+
+    def update_voxel_index(self, indices: Optional[Iterable[int]] = None):
         """Update the embedded voxel index.
 
         This method will update the voxel indices for a given list of cells,
@@ -322,28 +530,134 @@ class CellList(object):
         voxel.
         """
         if indices is None:
-            self._voxel_index.clear()
-            self._reverse_voxel_index.clear()
             self._compute_voxel_index()
             return
 
-        for index in indices:
-            cell = self[index]
-            old_voxel = self._reverse_voxel_index[index]
-            new_voxel = self.grid.get_voxel(cell['point'])
-            if old_voxel != new_voxel:
-                self._voxel_index[old_voxel].remove(index)
-                self._voxel_index[new_voxel].add(index)
-                self._reverse_voxel_index[index] = new_voxel
+        indices = np.asarray(indices, dtype=np.intp).reshape(-1)
+        keys = self._flatten_voxels(self.grid.get_voxels(self.cell_data['point'][indices]))
+        moved = self._cell_voxels[indices] != keys
+        if moved.any():
+            self._cell_voxels[indices] = keys
+            self._moved_cells.append(indices[moved])
+
+    def _capacity_for(self, size: int) -> int:
+        return min(max(size, MIN_CELL_LIST_CAPACITY), self.max_cells)
+
+    def _resize(self, capacity: int) -> None:
+        cell_data = self.CellDataClass(capacity)
+        cell_data[: self._ncells] = self.cell_data
+        cell_voxels = np.empty(capacity, dtype=np.intp)
+        cell_voxels[: self._ncells] = self.voxel_index
+        object.__setattr__(self, '_cell_data', cell_data)
+        object.__setattr__(self, '_cell_voxels', cell_voxels)
+
+    def _flatten_voxel(self, voxel: Voxel) -> int:
+        # plain integer arithmetic is much faster than numpy for a single voxel
+        z, y, x = np.asarray(voxel).ravel().tolist()
+        nz, ny, nx = self.grid.shape
+        if not (0 <= z < nz and 0 <= y < ny and 0 <= x < nx):
+            return -1
+        return (z * ny + y) * nx + x
+
+    def _flatten_voxels(self, voxels: np.ndarray) -> np.ndarray:
+        voxels = np.asarray(voxels).reshape(-1, 3)
+        valid = ((voxels >= 0) & (voxels < self.grid.shape)).all(axis=1)
+        keys = np.full(len(voxels), -1, dtype=np.intp)
+        keys[valid] = np.ravel_multi_index(tuple(voxels[valid].T), self.grid.shape)
+        return keys
+
+    def _get_voxel_offsets(self) -> np.ndarray:
+        """Return the offsets of the voxel index, bringing the index up to date first."""
+        if self._voxel_index_stale:
+            self._build_voxel_index()
+        elif self._moved_cells or self._ncells > len(self._indexed_voxels):
+            self._patch_voxel_index()
+        return self._voxel_offsets
+
+    def _build_voxel_index(self) -> None:
+        """Sort the cells by voxel into compressed sparse row arrays.
+
+        The offsets are the cumulative cell counts of the voxels.  Cells are
+        ordered with a stable sort of their voxel keys, which numpy performs as
+        a radix sort for keys of 16 bits.  On grids of at most 65536 voxels the
+        cost is thus linear in the number of cells and voxels, on larger grids
+        the sort costs O(N log N) for N cells.
+        """
+        keys = self.voxel_index
+        inside = (keys >= 0).nonzero()[0]
+        counts = np.bincount(keys[inside], minlength=len(self.grid))
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.intp)
+        np.cumsum(counts, out=offsets[1:])
+        sort_keys = keys[inside]
+        if len(self.grid) <= 1 << 16:
+            sort_keys = sort_keys.astype(np.uint16)
+        voxel_cells = inside[np.argsort(sort_keys, kind='stable')]
+        voxel_cells.flags['WRITEABLE'] = False
+
+        object.__setattr__(self, '_voxel_offsets', offsets)
+        object.__setattr__(self, '_voxel_cells', voxel_cells)
+        object.__setattr__(self, '_indexed_voxels', keys.copy())
+        object.__setattr__(self, '_voxel_index_stale', False)
+        self._moved_cells.clear()
+
+    def _patch_voxel_index(self) -> None:
+        """Move the entries of the cells moved or appended since the index was built.
+
+        Entries are ordered by voxel and then by cell, so the entries removed
+        and inserted are located by binary search.  Each patch shifts the
+        arrays once, costing O(N + V + k log N) for N cells, V voxels and k
+        changed cells without sorting the cells again.  When many cells changed
+        the index is rebuilt instead.
+        """
+        indexed = self._indexed_voxels
+        moved = np.unique(np.concatenate(self._moved_cells or [np.empty(0, dtype=np.intp)]))
+        moved = moved[moved < len(indexed)]
+        moved = moved[indexed[moved] != self._cell_voxels[moved]]
+        added = np.concatenate([moved, np.arange(len(indexed), self._ncells)])
+        if len(moved) + len(added) > len(self._voxel_cells) // 8 + 16:
+            self._build_voxel_index()
+            return
+
+        removed = moved[indexed[moved] >= 0]
+        removed_keys = indexed[removed]
+        added_keys = self._cell_voxels[added]
+        added, added_keys = added[added_keys >= 0], added_keys[added_keys >= 0]
+
+        # (voxel, cell) pairs as single integers increasing along the index
+        stride = self._ncells
+        voxel_cells = self._voxel_cells
+        entries = indexed[voxel_cells] * stride + voxel_cells
+        positions = np.searchsorted(entries, removed_keys * stride + removed)
+        voxel_cells = np.delete(voxel_cells, positions)
+        entries = np.delete(entries, positions)
+
+        new_entries = added_keys * stride + added
+        order = np.argsort(new_entries)
+        voxel_cells = np.insert(
+            voxel_cells, np.searchsorted(entries, new_entries[order]), added[order]
+        )
+        voxel_cells.flags['WRITEABLE'] = False
+
+        changes = np.zeros(len(self._voxel_offsets), dtype=np.intp)
+        np.add.at(changes, removed_keys + 1, -1)
+        np.add.at(changes, added_keys + 1, 1)
+        offsets = self._voxel_offsets + np.cumsum(changes)
+
+        indexed = np.concatenate([indexed, self._cell_voxels[len(indexed) : self._ncells]])
+        indexed[moved] = self._cell_voxels[moved]
+        object.__setattr__(self, '_voxel_offsets', offsets)
+        object.__setattr__(self, '_voxel_cells', voxel_cells)
+        object.__setattr__(self, '_indexed_voxels', indexed)
+        self._moved_cells.clear()
 
     def _compute_voxel_index(self):
-        """Generate a dictionary mapping voxel index to cell index.
+        """Compute the voxel containing each cell.
 
-        This index exists to maintain efficient (sub-linear) access to cells contained
-        in a single voxel.  This method is called automatically on initialization.
+        The voxel index exists to maintain efficient (constant time) access to cells
+        contained in a single voxel.  This method is called automatically on
+        initialization.
         """
-        for cell_index in range(len(self)):
-            cell = self[cell_index]
-            voxel = self.grid.get_voxel(cell['point'])
-            self._voxel_index[voxel].add(cell_index)
-            self._reverse_voxel_index.append(voxel)
+        voxels = self.grid.get_voxels(self.cell_data['point'])
+        self._cell_voxels[: self._ncells] = self._flatten_voxels(voxels)
+        object.__setattr__(self, '_voxel_index_stale', True)
@@ -1,6 +1,7 @@
+import json
 from pathlib import Path
 import shutil
-from typing import Tuple
+from typing import Optional, Tuple
 
 import click
 import click_pathlib
@@ -70,5 +71,82 @@ def postprocess(obj, postprocess_dir: Path) -> None:
     process_output(state_files, postprocess_dir)
 
 
+@main.group('benchmark', help='Benchmark parts of the simulation')
+def benchmark() -> None:
+    pass
+
+
+@benchmark.command('diffusion', help='Compare the throughput of the diffusion backends')
+@click.option(
+    '--repeat',
+    type=click.IntRange(min=1),
+    default=10,
+    help='Number of diffusion steps timed per backend',
+    show_default=True,
+)
+@click.option(
+    '--backend',
+    'backends',
+    multiple=True,
+    help='Backend to benchmark. May be specified multiple times. Defaults to all backends.',
+)
+@click.option(
+    '--diffusivity',
+    type=click.FLOAT,
+    default=None,
+    help='Diffusion coefficient. Defaults to the rate of a full box average.',
+)
+@click.pass_obj
+def benchmark_diffusion(obj, repeat: int, backends: Tuple[str], diffusivity: float) -> None:
+    # Don't import the benchmark module unless it's needed for this command
+    from nlisim.benchmark import benchmark_diffusion
+    from nlisim.diffusion import DIFFUSION_BACKENDS
+
+    for name in backends:
+        if name not in DIFFUSION_BACKENDS:
+            raise click.BadParameter(f'Unknown diffusion backend {name}', param_hint='--backend')
+
+    rows = benchmark_diffusion(
+        obj['config'], backends=backends or None, repeat=repeat, diffusivity=diffusivity
+    )
+    click.echo(f'{"backend":<12}{"ms/step":>12}{"Mvoxel/s":>12}{"rel. error":>12}')
+    for row in rows:
+        click.echo(
+            f'{row["backend"]:<12}{row["seconds"] * 1e3:>12.3f}'
+            f'{row["voxels_per_second"] / 1e6:>12.2f}{row["relative_error"]:>12.2e}'
+        )
+
+
+@main.command('profile', help='Summarize the profile written by a simulation run')
+@click.argument('profile_file', type=InputFilePath)
+@click.option(
+    '--depth',
+    type=click.IntRange(min=0),
+    default=None,
+    help='Maximum nesting depth of the phases shown.',
+)
+def profile(profile_file: Path, depth: Optional[int]) -> None:
+    # Don't import the profiling module unless it's needed for this command
+    from nlisim.profiling import summarize
+
+    with open(profile_file) as f:
+        data = json.load(f)
+
+    click.echo(f'wall time: {data["wall_time"]:.3f} s')
+    memory = data.get('memory', False)
+    header = f'{"phase":<40}{"calls":>10}{"total s":>12}{"ms/call":>12}{"% wall":>10}'
+    click.echo(header + (f'{"peak MiB":>12}' if memory else ''))
+    for row in summarize(data):
+        if depth is not None and row['depth'] > depth:
+            continue
+        line = (
+            f'{"  " * row["depth"] + row["name"]:<40}{row["calls"]:>10}{row["seconds"]:>12.3f}'
+            f'{row["seconds_per_call"] * 1e3:>12.3f}{row["fraction"] * 100:>10.1f}'
+        )
+        if memory:
+            line += f'{(row["peak_bytes"] or 0) / 2 ** 20:>12.2f}'
+        click.echo(line)
+
+
 if __name__ == '__main__':
     main()
@@ -24,7 +24,7 @@ for details.
 """
 from functools import reduce
 from itertools import product
-from typing import Iterable, Iterator, List, Tuple
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 import attr
 from h5py import File as H5File
@@ -106,6 +106,37 @@ class RectangularGrid(object):
     yv: np.ndarray
     zv: np.ndarray
 
+    # lookup tables for the constant time `get_voxels` path, only set for uniform grids
+    _spacing: Optional[np.ndarray] = attr.ib(init=False, default=None, eq=False)
+    _vertex_table: Optional[np.ndarray] = attr.ib(init=False, default=None, eq=False)
+    _table_offsets: Optional[np.ndarray] = attr.ib(init=False, default=None, eq=False)
+
+    def __attrs_post_init__(self):
+        vertices = (self.zv, self.yv, self.xv)
+        spacing = [self._get_uniform_spacing(v) for v in vertices]
+        if any(s is None for s in spacing):
+            return
+
+        # Row `axis` of the table contains [-inf, v[0], ..., v[n], inf, ...] so that
+        # entries `k` and `k + 1` are the left and right edges of voxel `k - 1`.
+        table = np.full((3, max(len(v) for v in vertices) + 2), np.inf)
+        for axis, v in enumerate(vertices):
+            table[axis, 0] = -np.inf
+            table[axis, 1 : len(v) + 1] = v
+
+        self._spacing = np.asarray(spacing)
+        self._vertex_table = table.ravel()
+        self._table_offsets = np.arange(3) * table.shape[1]
+
+    @classmethod
+    def _get_uniform_spacing(cls, vertices: np.ndarray) -> Optional[float]:
+        if len(vertices) < 2:
+            return None
+        spacing = (vertices[-1] - vertices[0]) / (len(vertices) - 1)
+        if spacing > 0 and np.allclose(np.diff(vertices), spacing, rtol=1e-9, atol=0):
+            return float(spacing)
+        return None
+
     @classmethod
     def _make_coordinate_arrays(cls, size: int, spacing: float) -> Tuple[np.ndarray, np.ndarray]:
         vertex = np.arange(size + 1) * spacing
@@ -124,6 +155,37 @@ class RectangularGrid(object):
         z, zv = cls._make_coordinate_arrays(nz, dz)
         return cls(x=x, y=y, z=z, xv=xv, yv=yv, zv=zv)
 
+    def coarsen(self) -> 'RectangularGrid':
+        """Return a grid merging pairs of adjacent voxels along each axis.
+
+        Axes containing a single voxel are left unchanged.  When an axis has an
+        odd number of voxels, its last coarse voxel covers only the last fine
+        voxel, so the coarse grid spans the same domain.
+        """
+        coordinates = []
+        for vertex in (self.zv, self.yv, self.xv):
+            if len(vertex) > 2:
+                vertex = np.append(vertex[:-1:2], vertex[-1])
+            cell = (vertex[:-1] + vertex[1:]) / 2
+            vertex.flags['WRITEABLE'] = False
+            cell.flags['WRITEABLE'] = False
+            coordinates.append((cell, vertex))
+        (z, zv), (y, yv), (x, xv) = coordinates
+        return RectangularGrid(x=x, y=y, z=z, xv=xv, yv=yv, zv=zv)
+
+    def coarse_indices(self) -> np.ndarray:
+        """Return the flattened index in `self.coarsen()` of the voxel containing each voxel."""
+        factors = [2 if size > 1 else 1 for size in self.shape]
+        coarse_shape = tuple(
+            (size + factor - 1) // factor for size, factor in zip(self.shape, factors)
+        )
+        indices = np.meshgrid(
+            *(np.arange(size) // factor for size, factor in zip(self.shape, factors)),
+            indexing='ij',
+            copy=False,
+        )
+        return np.ravel_multi_index(indices, coarse_shape)
+
     @property
     def meshgrid(self) -> List[np.ndarray]:
         """Return the coordinate grid representation.
@@ -181,13 +243,6 @@ class RectangularGrid(object):
             kwargs[dim] = file[dim][:]
         return cls(**kwargs)
 
-    @classmethod
-    def _find_dimension_index(cls, vertices: np.ndarray, coordinate: float) -> int:
-        indices = (vertices >= coordinate).nonzero()[0]
-        if len(indices) == 0:
-            return -1
-        return indices[0] - 1
-
     def get_flattened_index(self, voxel: Voxel) -> int:
         """Return the flattened index of a voxel inside the grid.
 
@@ -212,16 +267,72 @@ class RectangularGrid(object):
         the `is_valid_voxel` method to determine if the voxel is valid.
         """
         # For some reason, extracting fields from a recordarray results in a
-        # transposed point object (shape (1,3) rather than (3,)).  This code
-        # ensures the representation is as expected.
-        point = point.ravel().view(Point)
-        assert len(point) == 3, 'This method does not handle arrays of points'
-
-        ix = self._find_dimension_index(self.xv, point.x)
-        iy = self._find_dimension_index(self.yv, point.y)
-        iz = self._find_dimension_index(self.zv, point.z)
+        # transposed point object (shape (1,3) rather than (3,)).  Reshaping
+        # handles both representations.
+        iz, iy, ix = self.get_voxels(np.reshape(point, (1, 3)))[0]
         return Voxel(x=ix, y=iy, z=iz)
 
+    def get_voxels(self, points: np.ndarray) -> np.ndarray:
+        """Return the voxels containing an array of points.
+
+        The points are given as an `(N, 3)` array in `(z, y, x)` order (e.g. the
+        `point` field of a `simulation.cell.CellData` array).  The return value is
+        an `(N, 3)` integer array of voxel indices in the same order.  As with
+        `get_voxel`, coordinates outside of the grid are mapped to `-1`.  Uniform
+        axes are computed with constant time arithmetic, other axes fall back to a
+        binary search over the vertex coordinates.
+        """
+        points = np.asarray(points, dtype=np.float64)
+        if points.ndim != 2 or points.shape[1] != 3:
+            raise ValueError('Expected an array of points with shape (N, 3)')
+
+        shape = self.shape
+        table = self._vertex_table
+        if self._spacing is None or table is None or self._table_offsets is None:
+            voxels = np.empty(points.shape, dtype=np.intp)
+            for axis, vertices in enumerate((self.zv, self.yv, self.xv)):
+                voxels[:, axis] = np.searchsorted(vertices, points[:, axis], side='left') - 1
+        else:
+            # k = voxel index + 1, clamped to [0, n + 1] with NaN's mapped to n + 1
+            scaled = np.ceil((points - table.take(self._table_offsets + 1)) / self._spacing)
+            np.fmin(scaled, np.add(shape, 1), out=scaled)
+            np.maximum(scaled, 0, out=scaled)
+            k = scaled.astype(np.intp)
+
+            # correct floating point rounding for points lying on a vertex
+            k += self._table_offsets
+            k -= points <= table.take(k)
+            k += points > table.take(k + 1)
+            voxels = k - self._table_offsets - 1
+            np.maximum(voxels, -1, out=voxels)
+
+        voxels[voxels >= shape] = -1
+        return voxels
+
+    def box_sum(self, values: np.ndarray, radius: int) -> np.ndarray:
+        """Sum a gridded array over the cube of voxels within `radius` of each voxel.
+
+        Each output voxel contains the sum of the input over its (2r+1)^3 Moore
+        neighborhood.  Voxels outside of the grid contribute nothing.  The sum
+        is computed as a separable filter using cumulative sums along each
+        axis, so the cost does not depend on the radius.
+        """
+        if values.shape != self.shape:
+            raise ValueError('Expected an array with the same shape as the grid')
+
+        result = np.asarray(values)
+        for axis, size in enumerate(self.shape):
+            # prepend a zero so that cumulative[i] is the sum of the first i entries
+            padding = [(0, 0)] * result.ndim
+            padding[axis] = (1, 0)
+            cumulative = np.pad(np.cumsum(result, axis=axis), padding)
+
+            index = np.arange(size)
+            upper = np.minimum(index + radius + 1, size)
+            lower = np.maximum(index - radius, 0)
+            result = cumulative.take(upper, axis=axis) - cumulative.take(lower, axis=axis)
+        return result
+
     def get_voxel_center(self, voxel: Voxel) -> Point:
         """Get the coordinates of the center point of a voxel."""
         return Point(x=self.x[voxel.x], y=self.y[voxel.y], z=self.z[voxel.z])
@@ -0,0 +1,220 @@
+from typing import Iterable, Optional, Tuple, cast
+
+import attr
+from h5py import Group
+import numpy as np
+
+from nlisim.cell import CellList
+from nlisim.state import State
+
+_HOST_SHIFT = 32
+_PATHOGEN_MASK = (1 << _HOST_SHIFT) - 1
+
+
+def _empty_keys() -> np.ndarray:
+    return np.empty(0, dtype=np.int64)
+
+
+@attr.s(kw_only=True, repr=False)
+class InternalizationTable(object):
+    """A relational store recording which pathogens are contained in which host cells.
+
+    Each entry is a `(host, pathogen)` pair of cell indices.  The pairs are
+    kept sorted by host and then by pathogen in a single array of 64 bit keys,
+    so the pathogens of a host form a contiguous range and all bulk operations
+    reduce to sorting and searching over flat arrays.  Compared to storing a
+    fixed size phagosome inside of every cell record, the memory used is
+    proportional to the number of internalized pathogens.  Because the pairs
+    are sorted, the pathogens of a host are listed in increasing index rather
+    than in the order they were added.
+    """
+
+    _keys: np.ndarray = attr.ib(factory=_empty_keys)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return f'InternalizationTable[{len(self)}]'
+
+    @property
+    def hosts(self) -> np.ndarray:
+        """Return the host index of every pair."""
+        return (self._keys >> _HOST_SHIFT).astype(np.intp)
+
+    @property
+    def pathogens(self) -> np.ndarray:
+        """Return the pathogen index of every pair."""
+        return (self._keys & _PATHOGEN_MASK).astype(np.intp)
+
+    def count(self, host: int) -> int:
+        """Return the number of pathogens contained in a host."""
+        start, stop = self._host_range(host)
+        return stop - start
+
+    def counts(self, num_hosts: int) -> np.ndarray:
+        """Return the number of pathogens contained in each of `num_hosts` hosts."""
+        return np.bincount(self.hosts, minlength=num_hosts)[:num_hosts]
+
+    def pathogens_of(self, host: int) -> np.ndarray:
+        """Return the pathogens contained in a host."""
+        start, stop = self._host_range(host)
+        return (self._keys[start:stop] & _PATHOGEN_MASK).astype(np.intp)
+
+    def hosts_of(self, pathogens: Iterable) -> np.ndarray:
+        """Return the unique hosts containing any of the given pathogens.
+
+        The pathogens can be given as an index array or as a boolean mask over
+        the pathogen cell list.
+        """
+        return np.unique(self.hosts[self._pathogen_mask(pathogens)])
+
+    def contains(self, host: int, pathogen: int) -> bool:
+        """Return whether the host contains the pathogen."""
+        key = self._key(host, pathogen)
+        index = np.searchsorted(self._keys, key)
+        return bool(index < len(self._keys) and self._keys[index] == key)
+
+    def add(self, host: int, pathogen: int, max_size: Optional[int] = None) -> bool:
+        """Add a pathogen to a host.
+
+        Returns `False` without modifying the table if the pair already exists
+        or the host already contains `max_size` pathogens.  Every call copies
+        the table, so use `add_pairs` to add many pairs.
+        """
+        if max_size is not None and self.count(host) >= max_size:
+            return False
+
+        key = self._key(host, pathogen)
+        index = np.searchsorted(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            return False
+
+        self._keys = np.insert(self._keys, index, key)
+        return True
+
+    def add_pairs(self, hosts: Iterable, pathogens: Iterable) -> None:
+        """Add many `(host, pathogen)` pairs at once, ignoring existing pairs.
+
+        The new pairs are sorted and merged into the table with a single copy.
+        """
+        keys = np.unique(self._key(np.asarray(hosts), np.asarray(pathogens)).reshape(-1))
+        index = np.searchsorted(self._keys, keys)
+        new = index == len(self._keys)
+        new[~new] = self._keys[index[~new]] != keys[~new]
+        self._keys = np.insert(self._keys, index[new], keys[new])
+
+    def remove(self, host: int, pathogen: int) -> bool:
+        """Remove a pathogen from a host, returning whether it was present."""
+        key = self._key(host, pathogen)
+        index = np.searchsorted(self._keys, key)
+        if index < len(self._keys) and self._keys[index] == key:
+            self._keys = np.delete(self._keys, index)
+            return True
+        return False
+
+    def remove_pairs(self, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Remove the pairs selected by a boolean mask over the table.
+
+        Returns the hosts and pathogens of the removed pairs.
+        """
+        mask = np.asarray(mask, dtype=bool)
+        removed = self._keys[mask]
+        self._keys = self._keys[~mask]
+        return (
+            (removed >> _HOST_SHIFT).astype(np.intp),
+            (removed & _PATHOGEN_MASK).astype(np.intp),
+        )
+
+    def remove_pathogens(self, pathogens: Iterable) -> np.ndarray:
+        """Remove the given pathogens from every host, returning the affected hosts."""
+        hosts, _ = self.remove_pairs(self._pathogen_mask(pathogens))
+        return np.unique(hosts)
+
+    def clear(self, hosts: Iterable) -> np.ndarray:
+        """Remove every pathogen from the given hosts, returning the released pathogens."""
+        hosts = np.asarray(hosts, dtype=np.intp).reshape(-1)
+        _, pathogens = self.remove_pairs(np.isin(self.hosts, hosts))
+        return pathogens
+
+    def remap(
+        self, host_map: Optional[np.ndarray] = None, pathogen_map: Optional[np.ndarray] = None
+    ) -> None:
+        """Rewrite the stored indices after a cell list is compacted.
+
+        The maps are the arrays returned by `CellList.compact`.  Pairs whose
+        host or pathogen was removed are dropped from the table.
+        """
+        hosts = self.hosts
+        pathogens = self.pathogens
+        if host_map is not None:
+            hosts = host_map[hosts]
+        if pathogen_map is not None:
+            pathogens = pathogen_map[pathogens]
+
+        keep = (hosts >= 0) & (pathogens >= 0)
+        self._keys = np.sort(self._key(hosts[keep], pathogens[keep]))
+
+    def save(self, group: Group, name: str) -> Group:
+        """Save the table as a pair of index datasets inside a new HDF5 group."""
+        table_group = group.create_group(name)
+        table_group.create_dataset(name='hosts', data=self.hosts.astype(np.int32))
+        table_group.create_dataset(name='pathogens', data=self.pathogens.astype(np.int32))
+        return table_group
+
+    @classmethod
+    def load(cls, group: Group, name: str) -> 'InternalizationTable':
+        """Load a table saved by `InternalizationTable.save`."""
+        table = cls()
+        table.add_pairs(group[name]['hosts'][:], group[name]['pathogens'][:])
+        return table
+
+    def _host_range(self, host: int) -> Tuple[int, int]:
+        start, stop = np.searchsorted(
+            self._keys, [self._key(host, 0), self._key(host + 1, 0)]
+        ).tolist()
+        return start, stop
+
+    def _pathogen_mask(self, pathogens: Iterable) -> np.ndarray:
+        pathogens = np.asarray(pathogens)
+        if pathogens.dtype == 'b1':
+            return pathogens[self.pathogens]
+        return np.isin(self.pathogens, pathogens)
+
+    @classmethod
+    def _key(cls, host, pathogen):
+        return (np.asarray(host, dtype=np.int64) << _HOST_SHIFT) | np.asarray(
+            pathogen, dtype=np.int64
+        )
+
+
+@attr.s(kw_only=True, frozen=True, repr=False)
+class PhagosomeCellList(CellList):
+    """A cell list whose cells can internalize cells from another list.
+
+    The internalized cells are recorded in the `phagosome` table as pairs of
+    host indices into this list and pathogen indices into the other list.
+    """
+
+    phagosome: InternalizationTable = attr.ib(factory=InternalizationTable)
+
+    def compact(self) -> np.ndarray:
+        index_map = super().compact()
+        self.phagosome.remap(host_map=index_map)
+        return index_map
+
+    def save(self, group: Group, name: str, metadata: dict) -> Group:
+        composite_group = super().save(group, name, metadata)
+        self.phagosome.save(composite_group, 'phagosome')
+        return composite_group
+
+    @classmethod
+    def load(
+        cls, global_state: State, group: Group, name: str, metadata: dict
+    ) -> 'PhagosomeCellList':
+        cell_list = cast(PhagosomeCellList, super().load(global_state, group, name, metadata))
+        if 'phagosome' in group[name]:
+            object.__setattr__(
+                cell_list, 'phagosome', InternalizationTable.load(group[name], 'phagosome')
+            )
+        return cell_list
@@ -1,9 +1,13 @@
+from functools import lru_cache
 from importlib import import_module
-from typing import Any, Dict, Optional, Type, Union
+import os
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Type, Union
 
 import attr
-from h5py import Dataset, Group
+from h5py import Dataset, ExternalLink, File as H5File, Group
 import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
 
 from nlisim.config import SimulationConfig
 from nlisim.state import State
@@ -19,28 +23,60 @@ class ModuleState(object):
     This class contains serialization support for basic types (float, int, str,
     bool) and numpy arrays of those types.  Modules containing more complicated
     state must override the serialization mechanism with custom behavior.
+    Attributes with `transient` set in their metadata, such as scratch buffers,
+    are not saved and are recreated from their defaults when loading.
+    Attributes with `static` set in their metadata can be saved separately with
+    `save_static` and referenced from the saved state through external links,
+    which are loaded as a `StaticArray` read on first use.
     """
 
     global_state: 'State'
 
-    def save_state(self, group: Group) -> None:
-        """Save the module state into an HDF5 group."""
+    def save_state(self, group: Group, static_file: Optional[str] = None) -> None:
+        """Save the module state into an HDF5 group.
+
+        With `static_file`, static attributes are not saved but linked to the
+        group of the same name in that file, relative to the saved file.
+        """
         for field in attr.fields(type(self)):
             name = field.name
-            if name == 'global_state':
+            metadata = field.metadata or {}
+            if name == 'global_state' or metadata.get('transient'):
+                continue
+            if metadata.get('static') and static_file is not None:
+                group[name] = ExternalLink(static_file, f'{group.name}/{name}')
                 continue
             value = getattr(self, name)
             self.save_attribute(group, name, value, field.metadata)
 
+    def save_static(self, group: Group) -> None:
+        """Save the static attributes of the module state into an HDF5 group."""
+        for field in attr.fields(type(self)):
+            if (field.metadata or {}).get('static'):
+                self.save_attribute(group, field.name, getattr(self, field.name), field.metadata)
+
+    def freeze_static(self) -> None:
+        """Make the static arrays of the module state read-only."""
+        for field in attr.fields(type(self)):
+            value = getattr(self, field.name)
+            if (field.metadata or {}).get('static') and isinstance(value, np.ndarray):
+                value.flags.writeable = False
+
     @classmethod
     def load_state(cls, global_state: 'State', group: Group) -> 'ModuleState':
         """Load this module's state from an HDF5 group."""
         kwargs: Dict[str, Any] = {'global_state': global_state}
         for field in attr.fields(cls):
             name = field.name
-            if name == 'global_state':
-                continue
             metadata = field.metadata or {}
+            if name == 'global_state' or metadata.get('transient'):
+                continue
+
+            link = group.get(name, getlink=True)
+            if metadata.get('static') and isinstance(link, ExternalLink):
+                static_path = Path(group.file.filename).parent / link.filename
+                kwargs[name] = StaticArray(str(static_path.resolve()), link.path)
+                continue
 
             group_object = group.get(name, None)
             if group_object is None:
@@ -66,7 +102,23 @@ class ModuleState(object):
 
             else:
                 kwargs[name] = cls.load_attribute(global_state, group, name, metadata)
-        return cls(**kwargs)
+
+        static = {name for name, value in kwargs.items() if isinstance(value, StaticArray)}
+        if not static:
+            return cls(**kwargs)
+
+        # static arrays were validated before being saved and stay unread until used
+        run_validators = attr.get_run_validators()
+        attr.set_run_validators(False)
+        try:
+            module_state = cls(**kwargs)
+        finally:
+            attr.set_run_validators(run_validators)
+        if run_validators:
+            for field in attr.fields(cls):
+                if field.validator is not None and field.name not in static:
+                    field.validator(module_state, field, getattr(module_state, field.name))
+        return module_state
 
     @classmethod
     def save_attribute(
@@ -74,6 +126,8 @@ class ModuleState(object):
     ) -> Union[Dataset, Group]:
         """Save an attribute into an HDF5 group."""
         metadata = metadata or {}
+        if isinstance(value, StaticArray):
+            value = value.load()
         if isinstance(value, (float, int, str, bool, np.ndarray)):
             return cls.save_simple_type(group, name, value, metadata)
         elif hasattr(value, 'save'):
@@ -118,6 +172,73 @@ class ModuleState(object):
         return value
 
 
+class StaticArray(NDArrayOperatorsMixin):
+    """A read-only array of a static variable that is read from its file on first use.
+
+    Indexing, arithmetic, comparisons and numpy functions load the dataset
+    and apply to the loaded array, as does any other ndarray attribute.  The
+    loaded array is shared by all snapshots linking to the same file.
+    """
+
+    def __init__(self, filename: str, path: str):
+        self.filename = filename
+        self.path = path
+        self._value: Optional[np.ndarray] = None
+
+    def load(self) -> np.ndarray:
+        """Read the dataset, once, and return it as a read-only array."""
+        if self._value is None:
+            self._value = _read_static(self.filename, os.stat(self.filename).st_mtime_ns, self.path)
+        return self._value
+
+    @property
+    def loaded(self) -> bool:
+        """Return whether the dataset has been read."""
+        return self._value is not None
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        value = self.load()
+        return value if dtype is None else value.astype(dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = tuple(x.load() if isinstance(x, StaticArray) else x for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def __getitem__(self, index):
+        return self.load()[index]
+
+    def __len__(self) -> int:
+        return len(self.load())
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __repr__(self):
+        return f'StaticArray({self.filename!r}, {self.path!r})'
+
+
+@lru_cache(maxsize=32)
+def _read_static(static_path: str, mtime: int, path: str) -> np.ndarray:
+    # the key includes the modification time so that a rewritten file is read again
+    with H5File(static_path, 'r') as hf:
+        value = hf[path][:]
+    value.flags.writeable = False
+    return value
+
+
+def _overlap(first: Optional[Tuple[str, ...]], second: Optional[Tuple[str, ...]]) -> bool:
+    if first is None:
+        return second is None or len(second) > 0
+    if second is None:
+        return len(first) > 0
+    return not set(first).isdisjoint(second)
+
+
 class ModuleModel(object):
     name: str = ''
     """A unique name for this module used for namespacing"""
@@ -125,6 +246,16 @@ class ModuleModel(object):
     StateClass: Type[ModuleState] = ModuleState
     """Container for extra state required by this module."""
 
+    reads: Optional[Tuple[str, ...]] = None
+    """Names of the module states and shared resources read by `advance`, `None` for all."""
+
+    writes: Optional[Tuple[str, ...]] = None
+    """Names of the module states and shared resources modified by `advance`, `None` for all.
+
+    Each module draws from its own random number generator while it is
+    advanced (see `nlisim.random`), so the generator is not a shared resource.
+    """
+
     def __init__(self, config: SimulationConfig):
         if not config.has_section(self.section):
             config.add_section(self.section)
@@ -143,6 +274,14 @@ class ModuleModel(object):
         )
         return float(self.config['time_step'])
 
+    def conflicts(self, other: 'ModuleModel') -> bool:
+        """Return whether this module and another could race when advanced concurrently."""
+        return (
+            _overlap(self.writes, other.writes)
+            or _overlap(self.writes, other.reads)
+            or _overlap(self.reads, other.writes)
+        )
+
     @property
     def section(self):
         """Return the section in the configuration object used by this module."""
@@ -166,6 +305,15 @@ class ModuleModel(object):
         """Run after the last time step."""
         return state
 
+    def remap_cell_indices(self, state: State, index_maps: Dict[str, np.ndarray]) -> None:
+        """Run after dead cells are removed from the cell lists.
+
+        `index_maps` maps `<module name>.<attribute name>` to an array taking the
+        old index of each cell to its new index, or -1 if the cell was removed.
+        Modules storing indices into another module's cell list must rewrite
+        them here.
+        """
+
     def summary_stats(self, state: State) -> Dict[str, Any]:
         """Run to provide informative statistics based on the module's current state.
 
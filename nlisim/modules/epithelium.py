@@ -1,16 +1,18 @@
 from enum import IntEnum
 import itertools
-from random import shuffle
+from typing import Dict, List
 
 import attr
 import numpy as np
 
-from nlisim.cell import CellData, CellList
-from nlisim.coordinates import Point, Voxel
+from nlisim.cell import CellData
+from nlisim.coordinates import Voxel
 from nlisim.grid import RectangularGrid
+from nlisim.internalization import PhagosomeCellList
 from nlisim.module import ModuleModel, ModuleState
 from nlisim.modules.fungus import FungusCellData, FungusCellList
 from nlisim.modules.geometry import TissueTypes
+from nlisim.profiling import phase
 from nlisim.random import rg
 from nlisim.state import State
 
@@ -34,7 +36,6 @@ class EpitheliumCellData(CellData):
         ('status', 'u1'),
         ('iron_pool', 'f8'),
         ('iteration', 'i4'),
-        ('phagosome', (np.int32, (MAX_CONIDIA))),
     ]
 
     dtype = np.dtype(CellData.FIELDS + PHAGOCYTE_FIELDS, align=True)  # type: ignore
@@ -48,68 +49,44 @@ class EpitheliumCellData(CellData):
         **kwargs,
     ) -> np.record:
         iteration = 0
-        phagosome = np.empty(MAX_PHAGOSOME_LENGTH)
-        phagosome.fill(-1)
         return CellData.create_cell_tuple(**kwargs) + (
             status,
             iron_pool,
             iteration,
-            phagosome,
         )
 
 
 @attr.s(kw_only=True, frozen=True, repr=False)
-class EpitheliumCellList(CellList):
+class EpitheliumCellList(PhagosomeCellList):
     CellDataClass = EpitheliumCellData
 
     def len_phagosome(self, index):
-        cell = self[index]
-        return len(np.argwhere(cell['phagosome'] != -1))
+        return self.phagosome.count(index)
 
     def append_to_phagosome(self, index, pathogen_index, max_size):
-        cell = self[index]
-        index_to_append = EpitheliumCellList.len_phagosome(self, index)
-        if (
-            index_to_append < MAX_PHAGOSOME_LENGTH
-            and index_to_append < max_size
-            and pathogen_index not in cell['phagosome']
-        ):
-            cell['phagosome'][index_to_append] = pathogen_index
-            return True
-        else:
-            return False
+        return self.phagosome.add(index, pathogen_index, min(max_size, MAX_PHAGOSOME_LENGTH))
 
     def remove_from_phagosome(self, index, pathogen_index):
-        phagosome = self[index]['phagosome']
-        if pathogen_index in phagosome:
-            itemindex = np.argwhere(phagosome == pathogen_index)[0][0]
-            size = EpitheliumCellList.len_phagosome(self, index)
-            if itemindex == size - 1:
-                # full phagosome
-                phagosome[itemindex] = -1
-                return True
-            else:
-                phagosome[itemindex:-1] = phagosome[itemindex + 1 :]
-                phagosome[-1] = -1
-                return True
-        else:
-            return False
+        return self.phagosome.remove(index, pathogen_index)
 
     def clear_all_phagosome(self, index, fungus: FungusCellList):
-        for i in range(0, self.len_phagosome(index)):
-            f_index = self[index]['phagosome'][i]
-            fungus[f_index]['internalized'] = False
-        self[index]['phagosome'].fill(-1)
+        released = self.phagosome.clear([index])
+        fungus.cell_data['internalized'][released] = False
 
     def internalize_conidia(self, e_det, max_spores, p_in, grid, spores: FungusCellList):
+        # the new pairs are merged into the phagosome table once at the end
+        max_spores = min(max_spores, MAX_PHAGOSOME_LENGTH)
+        hosts: List[int] = []
+        pathogens: List[int] = []
+        voxels = grid.get_voxels(self.cell_data['point'])
         for i in self.alive():
-            cell = self[i]
-            vox = grid.get_voxel(cell['point'])
+            vox = Voxel.from_array(voxels[i])
+            count = self.len_phagosome(i)
 
             # Moore neighborhood, but order partially randomized. Closest to furthest order, but
             # the order of any set of points of equal distance is random
             neighborhood = list(itertools.product(tuple(range(-1 * e_det, e_det + 1)), repeat=3))
-            shuffle(neighborhood)
+            rg.shuffle(neighborhood)
             neighborhood = sorted(neighborhood, key=lambda v: v[0] ** 2 + v[1] ** 2 + v[2] ** 2)
 
             for dx, dy, dz in neighborhood:
@@ -117,86 +94,54 @@ class EpitheliumCellList(CellList):
                 yj = vox.y + dy
                 xk = vox.x + dx
                 if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    index_arr = spores.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi))
+                    index_arr = spores.alive(spores.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi)))
                     for index in index_arr:
                         if (
                             spores[index]['form'] == FungusCellData.Form.CONIDIA
                             and not spores[index]['internalized']
                             and p_in > rg.random()
+                            and count < max_spores
                         ):
                             spores[index]['internalized'] = True
-                            if self.append_to_phagosome(i, index, max_spores):
-                                spores[index]['mobile'] = False
-                            else:
-                                spores[index]['internalized'] = False
+                            spores[index]['mobile'] = False
+                            hosts.append(i)
+                            pathogens.append(index)
+                            count += 1
+        self.phagosome.add_pairs(hosts, pathogens)
 
     def remove_dead_fungus(self, spores, grid):
-        for epi_index in self.alive():
-            for ii in range(0, self.len_phagosome(epi_index)):
-                index = self[epi_index]['phagosome'][ii]
-                if spores[index]['dead']:
-                    self.remove_from_phagosome(epi_index, index)
+        hosts, pathogens = self.phagosome.hosts, self.phagosome.pathogens
+        living = ~self.cell_data['dead'][hosts]
+        self.phagosome.remove_pairs(living & spores.cell_data['dead'][pathogens])
 
     def cytokine_update(self, s_det, h_det, cyto_rate, m_cyto, n_cyto, fungus, grid):
-        for i in self.alive():
-            vox = grid.get_voxel(self[i]['point'])
-
-            # spores
-            spore_count = 0
-
-            # Moore neighborhood
-            neighborhood = tuple(itertools.product(tuple(range(-1 * s_det, s_det + 1)), repeat=3))
-
-            for dx, dy, dz in neighborhood:
-                zi = vox.z + dz
-                yj = vox.y + dy
-                xk = vox.x + dx
-                if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    index_arr = fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi))
-                    for index in index_arr:
-                        if fungus[index]['form'] == FungusCellData.Form.CONIDIA and fungus[index][
-                            'status'
-                        ] in [
-                            FungusCellData.Status.SWOLLEN,
-                            FungusCellData.Status.GERMINATED,
-                        ]:
-                            spore_count += 1
-
-            # hyphae_count
-            hyphae_count = 0
-
-            # Moore neighborhood
-            neighborhood = tuple(itertools.product(tuple(range(-1 * h_det, h_det + 1)), repeat=3))
-
-            for dx, dy, dz in neighborhood:
-                zi = vox.z + dz
-                yj = vox.y + dy
-                xk = vox.x + dx
-                if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    index_arr = fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi))
-                    for index in index_arr:
-                        if fungus[index]['form'] == FungusCellData.Form.HYPHAE:
-                            hyphae_count += 1
+        cells = fungus.cell_data
+        spores = (cells['form'] == FungusCellData.Form.CONIDIA) & np.isin(
+            cells['status'], [FungusCellData.Status.SWOLLEN, FungusCellData.Status.GERMINATED]
+        )
+        spore_count = fungus.neighborhood_counts(s_det, fungus.alive(spores))
+        hyphae_count = fungus.neighborhood_counts(
+            h_det, fungus.alive(cells['form'] == FungusCellData.Form.HYPHAE)
+        )
 
-            m_cyto[vox.z, vox.y, vox.x] += cyto_rate * spore_count
-            n_cyto[vox.z, vox.y, vox.x] += cyto_rate * (spore_count + hyphae_count)
+        # add once for every cell in a voxel
+        voxels = self.grid_indices(self.alive())
+        np.add.at(m_cyto, voxels, cyto_rate * spore_count[voxels])
+        np.add.at(n_cyto, voxels, cyto_rate * (spore_count[voxels] + hyphae_count[voxels]))
 
     def damage(self, kill, t, health, fungus):
-        for i in self.alive():
-            cell = self[i]
-            for ii in range(0, self.len_phagosome(i)):
-                index = cell['phagosome'][ii]
-                fungus[index]['health'] = fungus[index]['health'] - (health * (t / kill))
+        hosts, pathogens = self.phagosome.hosts, self.phagosome.pathogens
+        living = ~self.cell_data['dead'][hosts]
+        np.subtract.at(fungus.cell_data['health'], pathogens[living], health * (t / kill))
 
     def die_by_germination(self, spores):
-        for index in self.alive():
-            e_cell = self[index]
-            for ii in range(0, self.len_phagosome(index)):
-                spore_index = e_cell['phagosome'][ii]
-                if spores[spore_index]['status'] == FungusCellData.Status.GERMINATED:
-                    e_cell['dead'] = True
-                    self.clear_all_phagosome(index, spores)
-                    break
+        hosts, pathogens = self.phagosome.hosts, self.phagosome.pathogens
+        germinated = spores.cell_data['status'][pathogens] == FungusCellData.Status.GERMINATED
+        dying = np.unique(hosts[germinated & ~self.cell_data['dead'][hosts]])
+
+        self.cell_data['dead'][dying] = True
+        released = self.phagosome.clear(dying)
+        spores.cell_data['internalized'][released] = False
 
 
 def cell_list_factory(self: 'EpitheliumState'):
@@ -218,6 +163,8 @@ class EpitheliumState(ModuleState):
 
 class Epithelium(ModuleModel):
     name = 'epithelium'
+    reads = ('geometry',)
+    writes = ('epithelium', 'fungus', 'molecules')
 
     StateClass = EpitheliumState
 
@@ -238,18 +185,11 @@ class Epithelium(ModuleModel):
 
         indices = np.argwhere(tissue == TissueTypes.EPITHELIUM.value)
 
-        for i in range(0, len(indices)):
-            x = grid.x[indices[i][2]]
-            y = grid.y[indices[i][1]]
-            z = grid.z[indices[i][0]]
-
-            point = Point(x=x, y=y, z=z)
-
-            epithelium.cells.append(
-                EpitheliumCellData.create_cell(
-                    point=point,
-                )
-            )
+        cells = EpitheliumCellData([EpitheliumCellData.create_cell()] * len(indices))
+        cells['point'] = np.stack(
+            [grid.z[indices[:, 0]], grid.y[indices[:, 1]], grid.x[indices[:, 2]]], axis=1
+        )
+        epithelium.cells.extend(cells)
 
         return state
 
@@ -265,22 +205,29 @@ class Epithelium(ModuleModel):
         m_cyto = state.molecules.grid['m_cyto']
         n_cyto = state.molecules.grid['n_cyto']
 
-        # internalize
         if len(spores.alive(spores.cell_data['form'] == FungusCellData.Form.CONIDIA)) > 0:
-            cells.internalize_conidia(
-                epi.s_det, epi.max_conidia_in_phag, epi.p_internalization, grid, spores
-            )
+            with phase('internalize_conidia'):
+                cells.internalize_conidia(
+                    epi.s_det, epi.max_conidia_in_phag, epi.p_internalization, grid, spores
+                )
 
         # remove killed spores from phagosome
-        cells.remove_dead_fungus(spores, grid)
+        with phase('remove_dead_fungus'):
+            cells.remove_dead_fungus(spores, grid)
 
-        # produce cytokines
-        cells.cytokine_update(epi.s_det, epi.h_det, epi.cyto_rate, m_cyto, n_cyto, spores, grid)
+        with phase('produce_cytokines'):
+            cells.cytokine_update(epi.s_det, epi.h_det, epi.cyto_rate, m_cyto, n_cyto, spores, grid)
 
         # damage internalized spores
-        cells.damage(epi.e_kill, epi.time_e, health, spores)
+        with phase('damage'):
+            cells.damage(epi.e_kill, epi.time_e, health, spores)
 
         # kill epithelium with germinated spore in its phagosome
         cells.die_by_germination(spores)
 
         return state
+
+    def remap_cell_indices(self, state: State, index_maps: Dict[str, np.ndarray]) -> None:
+        fungus_map = index_maps.get('fungus.cells')
+        if fungus_map is not None:
+            state.epithelium.cells.phagosome.remap(pathogen_map=fungus_map)
@@ -8,6 +8,7 @@ from nlisim.cell import CellData, CellList
 from nlisim.coordinates import Point, Voxel
 from nlisim.module import ModuleModel, ModuleState
 from nlisim.modules.geometry import TissueTypes
+from nlisim.profiling import phase
 from nlisim.random import rg
 from nlisim.state import State
 
@@ -73,7 +74,7 @@ class FungusCellList(CellList):
         for vox_index in np.argwhere(iron > iron_min):
             vox = Voxel(x=vox_index[2], y=vox_index[1], z=vox_index[0])
 
-            cells_here = self.get_cells_in_voxel(vox)
+            cells_here = self.alive(self.get_cells_in_voxel(vox))
 
             indices = []
             for index in cells_here:
@@ -170,6 +171,9 @@ class FungusCellList(CellList):
             children['point'] = cells['point'][conidia_indices] + growth
             self.spawn_hypahael_cell(children)
 
+            # spawning may have reallocated the underlying storage
+            cells = self.cell_data
+
         # grow hyphae
         if len(hyphae_indices) != 0:
             cells['status'][hyphae_indices] = FungusCellData.Status.GROWN
@@ -220,22 +224,26 @@ class FungusCellList(CellList):
             cells['form'] != FungusCellData.Form.HYPHAE,
         )
 
-        internalized_indices = (cells['internalized'][indices]).nonzero()[0]
-        not_internalized_indices = (np.invert(cells['internalized'][indices])).nonzero()[0]
+        internalized_indices = indices[cells['internalized'][indices]]
+        not_internalized_indices = indices[np.invert(cells['internalized'][indices])]
 
-        internalized_rest_indices = np.logical_and(
-            cells['status'][internalized_indices] == FungusCellData.Status.RESTING,
-            cells['iteration'][internalized_indices] >= rest_time,
-        ).nonzero()[0]
+        internalized_rest_indices = internalized_indices[
+            np.logical_and(
+                cells['status'][internalized_indices] == FungusCellData.Status.RESTING,
+                cells['iteration'][internalized_indices] >= rest_time,
+            )
+        ]
 
-        internalized_swollen_indices = np.logical_and(
-            cells['status'][internalized_indices] == FungusCellData.Status.SWOLLEN,
-            cells['iteration'][internalized_indices] >= swell_time,
-        ).nonzero()[0]
+        internalized_swollen_indices = internalized_indices[
+            np.logical_and(
+                cells['status'][internalized_indices] == FungusCellData.Status.SWOLLEN,
+                cells['iteration'][internalized_indices] >= swell_time,
+            )
+        ]
 
         # internal fungus with REST status
         swall_mask = rg.random(len(internalized_rest_indices)) < p_internal_swell
-        internalized_rest_indices = swall_mask.nonzero()[0]
+        internalized_rest_indices = internalized_rest_indices[swall_mask]
 
         cells['status'][internalized_rest_indices] = FungusCellData.Status.SWOLLEN
         cells['iteration'][internalized_rest_indices] = 0
@@ -244,14 +252,18 @@ class FungusCellList(CellList):
         cells['status'][internalized_swollen_indices] = FungusCellData.Status.GERMINATED
         cells['iteration'][internalized_swollen_indices] = 0
 
-        rest_indices = np.logical_and(
-            cells['status'][not_internalized_indices] == FungusCellData.Status.RESTING,
-            cells['iteration'][not_internalized_indices] >= rest_time,
-        ).nonzero()[0]
-        swollen_indices = np.logical_and(
-            cells['status'][not_internalized_indices] == FungusCellData.Status.SWOLLEN,
-            cells['iteration'][not_internalized_indices] >= swell_time,
-        ).nonzero()[0]
+        rest_indices = not_internalized_indices[
+            np.logical_and(
+                cells['status'][not_internalized_indices] == FungusCellData.Status.RESTING,
+                cells['iteration'][not_internalized_indices] >= rest_time,
+            )
+        ]
+        swollen_indices = not_internalized_indices[
+            np.logical_and(
+                cells['status'][not_internalized_indices] == FungusCellData.Status.SWOLLEN,
+                cells['iteration'][not_internalized_indices] >= swell_time,
+            )
+        ]
 
         # free fungus with REST status
         cells['status'][rest_indices] = FungusCellData.Status.SWOLLEN
@@ -285,6 +297,8 @@ class FungusState(ModuleState):
 
 class Fungus(ModuleModel):
     name = 'fungus'
+    reads = ('geometry',)
+    writes = ('fungus', 'molecules')
     StateClass = FungusState
 
     def initialize(self, state: State):
@@ -318,11 +332,14 @@ class Fungus(ModuleModel):
 
         cells.kill()  # clear dead cell
         cells.age()
-        cells.change_status(self.p_internal_swell, self.rest_time, self.swell_time)
+        with phase('change_status'):
+            cells.change_status(self.p_internal_swell, self.rest_time, self.swell_time)
         if hasattr(state, 'molecules'):
             iron = state.molecules.grid['iron']
-            cells.iron_uptake(iron, self.iron_max, self.iron_min, self.iron_absorb)
-        cells.grow_hyphae(self.iron_min_grow, self.grow_time, self.p_branch, self.spacing)
+            with phase('iron_uptake'):
+                cells.iron_uptake(iron, self.iron_max, self.iron_min, self.iron_absorb)
+        with phase('grow_hyphae'):
+            cells.grow_hyphae(self.iron_min_grow, self.grow_time, self.p_branch, self.spacing)
 
         return state
 
@@ -7,7 +7,7 @@ import numpy as np
 
 from nlisim.module import ModuleModel, ModuleState
 from nlisim.state import State, grid_variable
-from nlisim.validation import ValidationError
+from nlisim.validation import ValidationError, sampled
 
 
 # I am not quite sure if we should put the definition of the lung tissue types here
@@ -28,11 +28,11 @@ class TissueTypes(Enum):
 
 @attr.s(kw_only=True, repr=False)
 class GeometryState(ModuleState):
-    lung_tissue = grid_variable(np.dtype('int'))
+    lung_tissue = grid_variable(np.dtype('int'), static=True)
 
     @lung_tissue.validator
     def _validate_lung_tissue(self, attribute: attr.Attribute, value: np.ndarray) -> None:
-        if not TissueTypes.validate(value):
+        if not TissueTypes.validate(sampled(value)):
             raise ValidationError('input illegal')
 
     def __repr__(self):
@@ -41,6 +41,8 @@ class GeometryState(ModuleState):
 
 class Geometry(ModuleModel):
     name = 'geometry'
+    reads = ()
+    writes = ('geometry',)
     StateClass = GeometryState
 
     def initialize(self, state: State):
@@ -1,16 +1,17 @@
 import itertools
-from random import choice, shuffle
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 import attr
 import numpy as np
 
-from nlisim.cell import CellData, CellList
+from nlisim.cell import CellData
 from nlisim.coordinates import Point, Voxel
 from nlisim.grid import RectangularGrid
+from nlisim.internalization import PhagosomeCellList
 from nlisim.module import ModuleModel, ModuleState
 from nlisim.modules.fungus import FungusCellData, FungusCellList
 from nlisim.modules.geometry import TissueTypes
+from nlisim.profiling import phase
 from nlisim.random import rg
 from nlisim.state import State
 
@@ -22,7 +23,6 @@ np.warnings.filterwarnings('error', category=np.VisibleDeprecationWarning)
 class MacrophageCellData(CellData):
     MACROPHAGE_FIELDS = [
         ('iteration', 'i4'),
-        ('phagosome', (np.int32, (MAX_CONIDIA))),
     ]
 
     dtype = np.dtype(CellData.FIELDS + MACROPHAGE_FIELDS, align=True)  # type: ignore
@@ -33,56 +33,25 @@ class MacrophageCellData(CellData):
         **kwargs,
     ) -> np.record:
         iteration = 0
-        phagosome = np.empty(MAX_CONIDIA)
-        phagosome.fill(-1)
-        return CellData.create_cell_tuple(**kwargs) + (
-            iteration,
-            phagosome,
-        )
+        return CellData.create_cell_tuple(**kwargs) + (iteration,)
 
 
 @attr.s(kw_only=True, frozen=True, repr=False)
-class MacrophageCellList(CellList):
+class MacrophageCellList(PhagosomeCellList):
     CellDataClass = MacrophageCellData
 
     def len_phagosome(self, index):
-        cell = self[index]
-        return len(np.argwhere(cell['phagosome'] != -1))
+        return self.phagosome.count(index)
 
     def append_to_phagosome(self, index, pathogen_index, max_size):
-        cell = self[index]
-        index_to_append = MacrophageCellList.len_phagosome(self, index)
-        if (
-            index_to_append < MAX_CONIDIA
-            and index_to_append < max_size
-            and pathogen_index not in cell['phagosome']
-        ):
-            cell['phagosome'][index_to_append] = pathogen_index
-            return True
-        else:
-            return False
+        return self.phagosome.add(index, pathogen_index, min(max_size, MAX_CONIDIA))
 
     def remove_from_phagosome(self, index, pathogen_index):
-        phagosome = self[index]['phagosome']
-        if pathogen_index in phagosome:
-            itemindex = np.argwhere(phagosome == pathogen_index)[0][0]
-            size = MacrophageCellList.len_phagosome(self, index)
-            if itemindex == size - 1:
-                # full phagosome
-                phagosome[itemindex] = -1
-                return True
-            else:
-                phagosome[itemindex:-1] = phagosome[itemindex + 1 :]
-                phagosome[-1] = -1
-                return True
-        else:
-            return False
+        return self.phagosome.remove(index, pathogen_index)
 
     def clear_all_phagosome(self, index, fungus: FungusCellList):
-        for i in range(0, self.len_phagosome(index)):
-            index = self[index]['phagosome'][i]
-            fungus[index]['internalized'] = False
-        self[index]['phagosome'].fill(-1)
+        released = self.phagosome.clear([index])
+        fungus.cell_data['internalized'][released] = False
 
     def recruit_new(self, rec_rate_ph, rec_r, p_rec_r, tissue, grid, cyto):
         num_reps = rec_rate_ph  # maximum number of macrophages recruited per time step
@@ -112,103 +81,44 @@ class MacrophageCellList(CellList):
                 self.append(MacrophageCellData.create_cell(point=point))
 
     def absorb_cytokines(self, m_abs, cyto, grid):
-        for index in self.alive():
-            vox = grid.get_voxel(self[index]['point'])
-            x = vox.x
-            y = vox.y
-            z = vox.z
-            cyto[z, y, x] = (1 - m_abs) * cyto[z, y, x]
-
-    def produce_cytokines(self, m_det, m_n, grid, fungus: FungusCellList, cyto):
-        for i in self.alive():
-            vox = grid.get_voxel(self[i]['point'])
+        voxels = grid.get_voxels(self.cell_data['point'][self.alive()])
+        voxels = voxels[(voxels >= 0).all(axis=1)]
 
-            hyphae_count = 0
+        # multiply once for every cell in a voxel
+        np.multiply.at(cyto, tuple(voxels.T), 1 - m_abs)
 
-            # Moore neighborhood
-            neighborhood = tuple(itertools.product(tuple(range(-1 * m_det, m_det + 1)), repeat=3))
-
-            for dx, dy, dz in neighborhood:
-                zi = vox.z + dz
-                yj = vox.y + dy
-                xk = vox.x + dx
-                if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    index_arr = fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi))
-                    for index in index_arr:
-                        if fungus[index]['form'] == FungusCellData.Form.HYPHAE:
-                            hyphae_count += 1
+    def produce_cytokines(self, m_det, m_n, grid, fungus: FungusCellList, cyto):
+        hyphae_count = fungus.neighborhood_counts(
+            m_det, fungus.alive(fungus.cell_data['form'] == FungusCellData.Form.HYPHAE)
+        )
 
-            cyto[vox.z, vox.y, vox.x] = cyto[vox.z, vox.y, vox.x] + m_n * hyphae_count
+        # add once for every cell in a voxel
+        voxels = self.grid_indices(self.alive())
+        np.add.at(cyto, voxels, m_n * hyphae_count[voxels])
 
     def move(self, rec_r, grid, cyto, tissue, fungus: FungusCellList):
-        for cell_index in self.alive():
-            cell = self[cell_index]
-            cell_voxel = grid.get_voxel(cell['point'])
-
-            valid_voxel_offsets = []
-            above_threshold_voxel_offsets = []
-
-            # iterate over nearby voxels, recording the cytokine levels
-            for dx, dy, dz in itertools.product((-1, 0, 1), repeat=3):
-                zi = cell_voxel.z + dz
-                yj = cell_voxel.y + dy
-                xk = cell_voxel.x + dx
-                if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    if tissue[zi, yj, xk] != TissueTypes.AIR.value:
-                        valid_voxel_offsets.append((dx, dy, dz))
-                        if cyto[zi, yj, xk] >= rec_r:
-                            above_threshold_voxel_offsets.append((cyto[zi, yj, xk], (dx, dy, dz)))
-
-            # pick a target for the move
-            if len(above_threshold_voxel_offsets) > 0:
-                # shuffle + sort (with _only_ 0-key, not lexicographic as tuples) ensures
-                # randomization when there are equal top cytokine levels
-                # note that numpy's shuffle will complain about ragged arrays
-                shuffle(above_threshold_voxel_offsets)
-                above_threshold_voxel_offsets = sorted(
-                    above_threshold_voxel_offsets, key=lambda x: x[0], reverse=True
-                )
-                _, target_voxel_offset = above_threshold_voxel_offsets[0]
-            elif len(valid_voxel_offsets) > 0:
-                target_voxel_offset = choice(valid_voxel_offsets)
-            else:
-                raise AssertionError(
-                    'This cell has no valid voxel to move to, including the one that it is in!'
-                )
-
-            # Some nonsense here, b/c jump is happening at the voxel level, not the point level
-            starting_cell_point = Point(x=cell['point'][2], y=cell['point'][1], z=cell['point'][0])
-            starting_cell_voxel = grid.get_voxel(starting_cell_point)
-            ending_cell_voxel = grid.get_voxel(
-                Point(
-                    x=grid.x[cell_voxel.x + target_voxel_offset[0]],
-                    y=grid.y[cell_voxel.y + target_voxel_offset[1]],
-                    z=grid.z[cell_voxel.z + target_voxel_offset[2]],
-                )
-            )
-            ending_cell_point = (
-                starting_cell_point
-                + grid.get_voxel_center(ending_cell_voxel)
-                - grid.get_voxel_center(starting_cell_voxel)
-            )
-
-            cell['point'] = ending_cell_point
-            self.update_voxel_index([cell_index])
+        self.move_up_gradient(self.alive(), cyto, rec_r, tissue != TissueTypes.AIR.value)
 
-            for i in range(0, self.len_phagosome(cell_index)):
-                f_index = cell['phagosome'][i]
-                fungus[f_index]['point'] = ending_cell_point
-                fungus.update_voxel_index([f_index])
+        # internalized conidia move along with their host
+        hosts, pathogens = self.phagosome.hosts, self.phagosome.pathogens
+        moved = ~self.cell_data['dead'][hosts]
+        fungus.cell_data['point'][pathogens[moved]] = self.cell_data['point'][hosts[moved]]
+        fungus.update_voxel_index(pathogens[moved])
 
     def internalize_conidia(self, m_det, max_spores, p_in, grid, fungus: FungusCellList):
+        # the new pairs are merged into the phagosome table once at the end
+        max_spores = min(max_spores, MAX_CONIDIA)
+        hosts: List[int] = []
+        pathogens: List[int] = []
+        voxels = grid.get_voxels(self.cell_data['point'])
         for i in self.alive():
-            cell = self[i]
-            vox = grid.get_voxel(cell['point'])
+            vox = Voxel.from_array(voxels[i])
+            count = self.len_phagosome(i)
 
             # Moore neighborhood, but order partially randomized. Closest to furthest order, but
             # the order of any set of points of equal distance is random
             neighborhood = list(itertools.product(tuple(range(-1 * m_det, m_det + 1)), repeat=3))
-            shuffle(neighborhood)
+            rg.shuffle(neighborhood)
             neighborhood = sorted(neighborhood, key=lambda v: v[0] ** 2 + v[1] ** 2 + v[2] ** 2)
 
             for dx, dy, dz in neighborhood:
@@ -216,7 +126,7 @@ class MacrophageCellList(CellList):
                 yj = vox.y + dy
                 xk = vox.x + dx
                 if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    index_arr = fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi))
+                    index_arr = fungus.alive(fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi)))
                     for index in index_arr:
                         if (
                             fungus[index]['form'] == FungusCellData.Form.CONIDIA
@@ -224,16 +134,17 @@ class MacrophageCellList(CellList):
                             and p_in > rg.random()
                         ):
                             fungus[index]['internalized'] = True
-                            self.append_to_phagosome(i, index, max_spores)
+                            if count < max_spores:
+                                hosts.append(i)
+                                pathogens.append(index)
+                                count += 1
+        self.phagosome.add_pairs(hosts, pathogens)
 
     def damage_conidia(self, kill, t, health, fungus):
-        for i in self.alive():
-            cell = self[i]
-            for ii in range(0, self.len_phagosome(i)):
-                index = cell['phagosome'][ii]
-                fungus[index]['health'] = fungus[index]['health'] - (health * (t / kill))
-                if fungus[index]['dead']:
-                    self.remove_from_phagosome(i, index)
+        hosts, pathogens = self.phagosome.hosts, self.phagosome.pathogens
+        living = ~self.cell_data['dead'][hosts]
+        np.subtract.at(fungus.cell_data['health'], pathogens[living], health * (t / kill))
+        self.phagosome.remove_pairs(living & fungus.cell_data['dead'][pathogens])
 
     def remove_if_sporeless(self, val):
         living = self.alive()
@@ -268,6 +179,8 @@ class MacrophageState(ModuleState):
 
 class Macrophage(ModuleModel):
     name = 'macrophage'
+    reads = ('geometry',)
+    writes = ('macrophage', 'fungus', 'molecules')
     StateClass = MacrophageState
 
     def initialize(self, state: State):
@@ -299,44 +212,48 @@ class Macrophage(ModuleModel):
         fungus: FungusCellList = state.fungus.cells
         health = state.fungus.health
 
-        # recruit new
-        m_cells.recruit_new(
-            macrophage.rec_rate_ph, macrophage.rec_r, macrophage.p_rec_r, tissue, grid, cyto
-        )
+        with phase('recruit_new'):
+            m_cells.recruit_new(
+                macrophage.rec_rate_ph, macrophage.rec_r, macrophage.p_rec_r, tissue, grid, cyto
+            )
 
-        # absorb cytokines
-        m_cells.absorb_cytokines(macrophage.m_abs, cyto, grid)
+        with phase('absorb_cytokines'):
+            m_cells.absorb_cytokines(macrophage.m_abs, cyto, grid)
 
-        # produce cytokines
-        m_cells.produce_cytokines(macrophage.m_det, macrophage.m_n, grid, fungus, n_cyto)
+        with phase('produce_cytokines'):
+            m_cells.produce_cytokines(macrophage.m_det, macrophage.m_n, grid, fungus, n_cyto)
 
-        # move
-        m_cells.move(macrophage.rec_r, grid, cyto, tissue, fungus)
+        with phase('move'):
+            m_cells.move(macrophage.rec_r, grid, cyto, tissue, fungus)
 
-        # internalize
-        m_cells.internalize_conidia(
-            macrophage.m_det,
-            macrophage.max_conidia_in_phag,
-            macrophage.p_internalization,
-            grid,
-            fungus,
-        )
+        with phase('internalize_conidia'):
+            m_cells.internalize_conidia(
+                macrophage.m_det,
+                macrophage.max_conidia_in_phag,
+                macrophage.p_internalization,
+                grid,
+                fungus,
+            )
 
-        # damage conidia
-        m_cells.damage_conidia(macrophage.kill, macrophage.time_m, health, fungus)
+        with phase('damage_conidia'):
+            m_cells.damage_conidia(macrophage.kill, macrophage.time_m, health, fungus)
 
         if len(fungus.alive(fungus.cell_data['form'] == FungusCellData.Form.CONIDIA)) == 0:
-            m_cells.remove_if_sporeless(macrophage.rm)
+            with phase('remove_if_sporeless'):
+                m_cells.remove_if_sporeless(macrophage.rm)
 
         return state
 
+    def remap_cell_indices(self, state: State, index_maps: Dict[str, np.ndarray]) -> None:
+        fungus_map = index_maps.get('fungus.cells')
+        if fungus_map is not None:
+            state.macrophage.cells.phagosome.remap(pathogen_map=fungus_map)
+
     def summary_stats(self, state: State) -> Dict[str, Any]:
         macrophage: MacrophageState = state.macrophage
 
-        num_phagosome: int = 0
-        for cell_index in macrophage.cells.alive():
-            cell: MacrophageCellData = macrophage.cells[cell_index]
-            num_phagosome += np.sum(cell['phagosome'] >= 0)
+        cells = macrophage.cells
+        num_phagosome = np.count_nonzero(~cells.cell_data['dead'][cells.phagosome.hosts])
 
         return {
             'count': len(macrophage.cells.alive()),
@@ -1,22 +1,43 @@
+from itertools import groupby
 import json
-from typing import Any, Dict
+from math import ceil
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import attr
 import numpy as np
 from scipy.ndimage import convolve
 
+from nlisim.config import SimulationConfig
+
 # from nlisim.coordinates import Voxel
+from nlisim.diffusion import (
+    ActiveTiles,
+    BoxDiffusion,
+    DiffusionBackend,
+    ImplicitDiffusion,
+    get_diffusion_backend,
+)
+
 # from nlisim.grid import RectangularGrid
 from nlisim.module import ModuleModel, ModuleState
 from nlisim.modules.geometry import GeometryState, TissueTypes
 from nlisim.molecule import MoleculeGrid, MoleculeTypes
-from nlisim.state import State
+from nlisim.parallel import SlabPool, split_blocks
+from nlisim.profiling import phase
+from nlisim.state import State, scratch_variable
+
+# sources and decay rates are given per sub-step of this many sub-steps per time step
+DEFAULT_SUBSTEPS = 3
 
 
 def molecule_grid_factory(self: 'MoleculesState'):
     return MoleculeGrid(grid=self.global_state.grid)
 
 
+def substeps_factory() -> np.ndarray:
+    return np.zeros(0, dtype=int)
+
+
 @attr.s(kw_only=True, repr=False)
 class MoleculesState(ModuleState):
     grid: MoleculeGrid = attr.ib(default=attr.Factory(molecule_grid_factory, takes_self=True))
@@ -25,11 +46,64 @@ class MoleculesState(ModuleState):
     cyto_evap_n: float
     iron_max: float
 
+    # diffusion sub-steps taken during the last time step for each of `grid.types`
+    substeps: np.ndarray = attr.ib(factory=substeps_factory)
+
+    # scratch buffers shared by all molecules while diffusing, with one plane for
+    # each molecule diffused together
+    work: np.ndarray = scratch_variable(np.dtype('f4'), planes=1)
+    result: np.ndarray = scratch_variable(np.dtype('f4'), planes=1)
+
+    def scratch(self, planes: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the scratch buffers for diffusing `planes` molecules together."""
+        if len(self.work) < planes:
+            shape = (planes,) + self.work.shape[1:]
+            self.work = np.zeros(shape, dtype=self.work.dtype)
+            self.result = np.zeros(shape, dtype=self.result.dtype)
+        return self.work[:planes], self.result[:planes]
+
 
 class Molecules(ModuleModel):
     name = 'molecules'
+    reads = ('geometry',)
+    writes = ('molecules',)
     StateClass = MoleculesState
 
+    def __init__(self, config: SimulationConfig):
+        super().__init__(config)
+
+        # map each molecule to the name of its diffusion backend and its diffusivity
+        self.diffusion: Dict[str, Tuple[str, Optional[float]]] = {}
+        for molecule in json.loads(self.config.get('molecules', '[]')):
+            backend = molecule.get('diffusion', BoxDiffusion.name)
+            get_diffusion_backend(backend)
+            diffusivity = molecule.get('diffusivity')
+            if diffusivity is not None:
+                diffusivity = float(diffusivity)
+            self.diffusion[molecule['name']] = (backend, diffusivity)
+
+        # the number of diffusion sub-steps per time step, None chooses it for each
+        # molecule from the stability limit of explicit backends
+        substeps = self.config.get('substeps', fallback=str(DEFAULT_SUBSTEPS)).strip()
+        self.substeps: Optional[int] = None if substeps == 'auto' else int(substeps)
+        if self.substeps is not None and self.substeps < 1:
+            raise ValueError('The number of diffusion sub-steps must be positive')
+        self.max_substeps = self.config.getint('max_substeps', fallback=10)
+        self._substep_plans: Dict[str, Tuple[int, str]] = {}
+
+        # explicit backends only update tiles holding concentrations above the tolerance
+        self.tile_size = self.config.getint('tile_size', fallback=0)
+        self.tile_tolerance = self.config.getfloat('tile_tolerance', fallback=0.0)
+
+        # backends and tiles are constructed on first use because they depend on the geometry
+        self._backends: Dict[str, DiffusionBackend] = {}
+        self._tiles: Optional[ActiveTiles] = None
+        self._tissue_mask: Optional[np.ndarray] = None
+        self.diffusion_stats: Dict[str, Dict[str, Any]] = {}
+
+        # grid kernels run concurrently over slabs of the z axis
+        self.pool = SlabPool(config.getint('simulation', 'threads', fallback=1))
+
     def initialize(self, state: State):
         molecules: MoleculesState = state.molecules
         geometry: GeometryState = state.geometry
@@ -100,26 +174,189 @@ class Molecules(ModuleModel):
         # self.degrade(molecules.grid['n_cyto'], molecules.cyto_evap_n)
         # self.diffuse(molecules.grid['n_cyto'], state.grid, state.geometry.lung_tissue)
 
-        for _ in range(3):
-            molecules.grid.incr()
-            self.convolution_diffusion(
-                molecules.grid['iron'], state.geometry.lung_tissue, molecules.iron_max
-            )
+        thresholds = {'iron': molecules.iron_max}
+        evaps = {'m_cyto': molecules.cyto_evap_m, 'n_cyto': molecules.cyto_evap_n}
 
-            self.degrade(molecules.grid['m_cyto'], molecules.cyto_evap_m)
-            self.convolution_diffusion(molecules.grid['m_cyto'], state.geometry.lung_tissue)
+        for (count, _, _), group in groupby(
+            molecules.grid.types, key=lambda name: self.diffusion_group(state, name)
+        ):
+            names = list(group)
+            threshold = np.array([thresholds.get(name, np.inf) for name in names])
+            evap = np.array([evaps.get(name, 0.0) for name in names])
 
-            self.degrade(molecules.grid['n_cyto'], molecules.cyto_evap_n)
-            self.convolution_diffusion(molecules.grid['n_cyto'], state.geometry.lung_tissue)
+            # keep the source and decay per time step independent of the sub-step count
+            scale = DEFAULT_SUBSTEPS / count
+            if scale != 1:
+                evap = 1 - (1 - evap) ** scale
 
+            with phase('diffuse'):
+                for _ in range(count):
+                    self.diffuse(state, names, self.time_step / count, threshold, evap, scale)
+
+        molecules.substeps = np.array(
+            [self.substep_plan(state, name)[0] for name in molecules.grid.types], dtype=int
+        )
         return state
 
+    def substep_plan(self, state: State, name: str) -> Tuple[int, str]:
+        """Return the number of diffusion sub-steps per time step and the backend for a molecule.
+
+        With `substeps = auto`, explicit backends take the fewest sub-steps that
+        satisfy their stability limit `3 * diffusivity * dt <= dx ** 2`.  When that
+        exceeds `max_substeps` the molecule is diffused implicitly in a single
+        step instead.  Implicit backends always take a single step.  Molecules
+        without a diffusivity diffuse at a rate tied to the sub-step length, so
+        they keep the default number of sub-steps.
+        """
+        if name not in self._substep_plans:
+            backend_name, diffusivity = self.diffusion.get(name, (BoxDiffusion.name, None))
+            count = self.substeps
+            if count is None:
+                if diffusivity is None:
+                    count = DEFAULT_SUBSTEPS
+                elif get_diffusion_backend(backend_name).radius is None:
+                    count = 1
+                else:
+                    spacing = min(float(state.grid.delta(axis).min()) for axis in range(3))
+                    count = max(1, ceil(3 * diffusivity * self.time_step / spacing ** 2))
+                    if count > self.max_substeps:
+                        count = 1
+                        backend_name = ImplicitDiffusion.name
+            self._substep_plans[name] = (count, backend_name)
+        return self._substep_plans[name]
+
+    def diffusion_group(self, state: State, name: str) -> Tuple[int, str, Optional[float]]:
+        """Return the sub-step count, backend and diffusivity of a molecule.
+
+        Consecutive molecules of `grid.types` agreeing on all three are diffused
+        together in a single batched call.
+        """
+        count, backend_name = self.substep_plan(state, name)
+        _, diffusivity = self.diffusion.get(name, (BoxDiffusion.name, None))
+        return count, backend_name, diffusivity
+
+    def diffusion_backend(self, state: State, name: str) -> DiffusionBackend:
+        """Return the diffusion backend used for a molecule."""
+        _, backend_name = self.substep_plan(state, name)
+        if backend_name not in self._backends:
+            mask = state.geometry.lung_tissue != TissueTypes.AIR.value
+            self._backends[backend_name] = get_diffusion_backend(backend_name)(state.grid, mask)
+        return self._backends[backend_name]
+
+    def active_tiles(self, state: State) -> Optional[ActiveTiles]:
+        """Return the tiling of the grid used by explicit backends, if enabled."""
+        if self._tiles is None and self.tile_size > 0:
+            mask = state.geometry.lung_tissue != TissueTypes.AIR.value
+            self._tiles = ActiveTiles(mask, self.tile_size)
+        return self._tiles
+
+    def tissue_mask(self, state: State) -> np.ndarray:
+        """Return a cached array equal to one in tissue and zero in air."""
+        if self._tissue_mask is None:
+            tissue = state.geometry.lung_tissue != TissueTypes.AIR.value
+            self._tissue_mask = tissue.astype(np.dtype('f4'))
+        return self._tissue_mask
+
+    def diffuse(
+        self,
+        state: State,
+        names: Sequence[str],
+        dt: float,
+        threshold: Optional[Union[Sequence[float], np.ndarray]] = None,
+        evap: Optional[Union[Sequence[float], np.ndarray]] = None,
+        source_scale: float = 1.0,
+    ) -> None:
+        """Add sources to, decay, diffuse, mask and clip molecules in one step.
+
+        The molecules must be consecutive in `grid.types` and share a backend and
+        a diffusivity.  They are processed together as a single stack of shape
+        `(len(names), nz, ny, nx)`, with `threshold` and `evap` giving the clip
+        value and decay rate of each molecule.  Intermediate values are kept in
+        the scratch buffers of the module state, so no full size arrays are
+        allocated.  Backends with a finite stencil only update the tiles where
+        any of the molecules is above `tile_tolerance` or has a source, together
+        with their neighbors.
+        """
+        molecules: MoleculesState = state.molecules
+        stack = molecules.grid.concentrations.stack(names)
+        sources = molecules.grid.sources.stack(names)
+        work, result = molecules.scratch(len(names))
+        mask = self.tissue_mask(state)
+        _, _, diffusivity = self.diffusion_group(state, names[0])
+        backend = self.diffusion_backend(state, names[0])
+        tiles = self.active_tiles(state)
+
+        # per molecule factors broadcast over the grid
+        decay = None
+        if evap is not None and np.any(evap):
+            decay = (1 - np.asarray(evap, dtype=float)).astype(stack.dtype)[:, None, None, None]
+        clip = None
+        if threshold is not None and np.any(np.isfinite(threshold)):
+            clip = np.asarray(threshold, dtype=stack.dtype)[:, None, None, None]
+
+        shape = stack.shape[1:]
+        everything = slice(None)
+        if backend.radius is None:
+            # global solvers work on the whole grid at once
+            updates = [tuple(slice(0, size) for size in shape)]
+            clears: List[Tuple[slice, ...]] = []
+            slabs = [slice(0, shape[0])]
+            radius = 0
+        else:
+            if tiles is None:
+                updates, clears = [tuple(slice(0, size) for size in shape)], []
+            else:
+                updates, clears = tiles.blocks(stack, self.tile_tolerance, sources, work)
+            slabs = self.pool.slabs(shape[0], backend.radius)
+            radius = backend.radius
+
+        def halo_of(block: Tuple[slice, ...]) -> Tuple[slice, ...]:
+            return tuple(
+                slice(max(b.start - radius, 0), min(b.stop + radius, size))
+                for b, size in zip(block, shape)
+            )
+
+        def prepare(slab: slice) -> None:
+            # every halo is read before any block is written back
+            for halo in split_blocks([halo_of(block) for block in updates], slab):
+                index = (everything,) + halo
+                values = work[index]
+                if source_scale != 1:
+                    np.multiply(sources[index], source_scale, out=values)
+                    np.add(values, stack[index], out=values)
+                else:
+                    np.add(stack[index], sources[index], out=values)
+                if decay is not None:
+                    np.multiply(values, decay, out=values)
+
+        def update(slab: slice) -> None:
+            for block in split_blocks(updates, slab):
+                halo = (everything,) + halo_of(block)
+                backend.diffuse(work[halo], diffusivity, dt, out=result[halo])
+                index = (everything,) + block
+                values = stack[index]
+                np.multiply(result[index], mask[block], out=values)
+                if clip is not None:
+                    np.minimum(values, clip, out=values)
+
+        # halos of slabs share voxels of the result buffer with the neighboring
+        # slabs, so alternate slabs are updated in two rounds
+        self.pool.map(prepare, slabs)
+        self.pool.map(update, slabs[::2])
+        self.pool.map(update, slabs[1::2])
+
+        for block in clears:
+            stack[(everything,) + block] = 0
+
+        stats = backend.stats()
+        for name in names:
+            self.diffusion_stats[name] = stats
+
     @classmethod
     def convolution_diffusion(cls, molecule: np.ndarray, tissue: np.ndarray, threshold=None):
         if len(molecule.shape) != 3:
             raise ValueError(f'Expecting a 3d array. Got dim = {len(molecule.shape)}')
-        weights = np.full((3, 3, 3), 1 / 27)
-        molecule[:] = convolve(molecule, weights, mode='constant')
+        molecule[:] = convolve(molecule, BoxDiffusion.weights, mode='constant')
 
         molecule[(tissue == TissueTypes.AIR.value)] = 0
 
@@ -210,18 +447,21 @@ class Molecules(ModuleModel):
     def summary_stats(self, state: State) -> Dict[str, Any]:
         molecules: MoleculesState = state.molecules
 
-        m_cyto = molecules.grid['m_cyto']
-        n_cyto = molecules.grid['n_cyto']
-        iron = molecules.grid['iron']
-
-        return {
-            'm_cyto_max': float(np.max(m_cyto)),
-            'm_cyto_min': float(np.min(m_cyto)),
-            'm_cyto_mean': float(np.mean(m_cyto)),
-            'n_cyto_max': float(np.max(n_cyto)),
-            'n_cyto_min': float(np.min(n_cyto)),
-            'n_cyto_mean': float(np.mean(n_cyto)),
-            'iron_max': float(np.max(iron)),
-            'iron_min': float(np.min(iron)),
-            'iron_mean': float(np.mean(iron)),
-        }
+        def reduce(name: str) -> Dict[str, float]:
+            molecule = molecules.grid[name]
+            return {
+                f'{name}_max': float(np.max(molecule)),
+                f'{name}_min': float(np.min(molecule)),
+                f'{name}_mean': float(np.mean(molecule)),
+            }
+
+        # each molecule is reduced whole so the results do not depend on the threads
+        stats: Dict[str, Any] = {}
+        for reduced in self.pool.map(reduce, ['m_cyto', 'n_cyto', 'iron']):
+            stats.update(reduced)
+        for name, count in zip(molecules.grid.types, molecules.substeps):
+            stats[f'{name}_substeps'] = int(count)
+        for name, diffusion_stats in self.diffusion_stats.items():
+            for key, value in diffusion_stats.items():
+                stats[f'{name}_diffusion_{key}'] = value
+        return stats
@@ -1,6 +1,5 @@
 from enum import IntEnum
 import itertools
-from random import choice, shuffle
 from typing import Any, Dict
 
 import attr
@@ -12,6 +11,7 @@ from nlisim.grid import RectangularGrid
 from nlisim.module import ModuleModel, ModuleState
 from nlisim.modules.fungus import FungusCellData, FungusCellList
 from nlisim.modules.geometry import TissueTypes
+from nlisim.profiling import phase
 from nlisim.random import rg
 from nlisim.state import State
 
@@ -79,102 +79,41 @@ class NeutrophilCellList(CellList):
             )
 
     def absorb_cytokines(self, n_absorb, cyto, grid):
-        for index in self.alive():
-            vox = grid.get_voxel(self[index]['point'])
-            x = vox.x
-            y = vox.y
-            z = vox.z
-            cyto[z, y, x] = (1 - n_absorb) * cyto[z, y, x]
+        voxels = grid.get_voxels(self.cell_data['point'][self.alive()])
+        voxels = voxels[(voxels >= 0).all(axis=1)]
 
-    def produce_cytokines(self, n_det, n_n, grid, fungus: FungusCellList, cyto):
-        for i in self.alive():
-            vox = grid.get_voxel(self[i]['point'])
-
-            hyphae_count = 0
+        # multiply once for every cell in a voxel
+        np.multiply.at(cyto, tuple(voxels.T), 1 - n_absorb)
 
-            # Moore neighborhood
-            neighborhood = tuple(itertools.product(tuple(range(-1 * n_det, n_det + 1)), repeat=3))
-
-            for dx, dy, dz in neighborhood:
-                zi = vox.z + dz
-                yj = vox.y + dy
-                xk = vox.x + dx
-                if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    index_arr = fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi))
-                    for index in index_arr:
-                        if fungus[index]['form'] == FungusCellData.Form.HYPHAE:
-                            hyphae_count += 1
+    def produce_cytokines(self, n_det, n_n, grid, fungus: FungusCellList, cyto):
+        hyphae_count = fungus.neighborhood_counts(
+            n_det, fungus.alive(fungus.cell_data['form'] == FungusCellData.Form.HYPHAE)
+        )
 
-            cyto[vox.z, vox.y, vox.x] = cyto[vox.z, vox.y, vox.x] + (n_n * hyphae_count)
+        # add once for every cell in a voxel
+        voxels = self.grid_indices(self.alive())
+        np.add.at(cyto, voxels, n_n * hyphae_count[voxels])
 
     def move(self, rec_r, grid, cyto, tissue):
-        for cell_index in self.alive(
-            self.cell_data['status'] == NeutrophilCellData.Status.NONGRANULATING
-        ):
-            # TODO: Algorithm S3.17 says "if degranulating nearby hyphae, do not move" but do
-            #  we have the "nearby hyphae" part of this condition?
-            cell = self[cell_index]
-            cell_voxel = grid.get_voxel(cell['point'])
-
-            valid_voxel_offsets = []
-            above_threshold_voxel_offsets = []
-
-            # iterate over nearby voxels, recording the cytokine levels
-            for dx, dy, dz in itertools.product((-1, 0, 1), repeat=3):
-                zi = cell_voxel.z + dz
-                yj = cell_voxel.y + dy
-                xk = cell_voxel.x + dx
-                if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    if tissue[zi, yj, xk] != TissueTypes.AIR.value:
-                        valid_voxel_offsets.append((dx, dy, dz))
-                        if cyto[zi, yj, xk] >= rec_r:
-                            above_threshold_voxel_offsets.append((cyto[zi, yj, xk], (dx, dy, dz)))
-
-            # pick a target for the move
-            if len(above_threshold_voxel_offsets) > 0:
-                # shuffle + sort (with _only_ 0-key, not lexicographic as tuples) ensures
-                # randomization when there are equal top cytokine levels
-                # note that numpy's shuffle will complain about ragged arrays
-                shuffle(above_threshold_voxel_offsets)
-                above_threshold_voxel_offsets = sorted(
-                    above_threshold_voxel_offsets, key=lambda x: x[0], reverse=True
-                )
-                _, target_voxel_offset = above_threshold_voxel_offsets[0]
-            elif len(valid_voxel_offsets) > 0:
-                target_voxel_offset = choice(valid_voxel_offsets)
-            else:
-                raise AssertionError(
-                    'This cell has no valid voxel to move to, including the one that it is in!'
-                )
-
-            # Some nonsense here, b/c jump is happening at the voxel level, not the point level
-            starting_cell_point = Point(x=cell['point'][2], y=cell['point'][1], z=cell['point'][0])
-            starting_cell_voxel = grid.get_voxel(starting_cell_point)
-            ending_cell_voxel = grid.get_voxel(
-                Point(
-                    x=grid.x[cell_voxel.x + target_voxel_offset[0]],
-                    y=grid.y[cell_voxel.y + target_voxel_offset[1]],
-                    z=grid.z[cell_voxel.z + target_voxel_offset[2]],
-                )
-            )
-            ending_cell_point = (
-                starting_cell_point
-                + grid.get_voxel_center(ending_cell_voxel)
-                - grid.get_voxel_center(starting_cell_voxel)
-            )
-
-            cell['point'] = ending_cell_point
-            self.update_voxel_index([cell_index])
+        # TODO: Algorithm S3.17 says "if degranulating nearby hyphae, do not move" but do
+        #  we have the "nearby hyphae" part of this condition?
+        self.move_up_gradient(
+            self.alive(self.cell_data['status'] == NeutrophilCellData.Status.NONGRANULATING),
+            cyto,
+            rec_r,
+            tissue != TissueTypes.AIR.value,
+        )
 
     def damage_hyphae(self, n_det, n_kill, time, health, grid, fungus: FungusCellList, iron):
+        voxels = grid.get_voxels(self.cell_data['point'])
         for i in self.alive(self.cell_data['granule_count'] > 0):
             cell = self[i]
-            vox = grid.get_voxel(cell['point'])
+            vox = Voxel.from_array(voxels[i])
 
             # Moore neighborhood, but order partially randomized. Closest to furthest order, but
             # the order of any set of points of equal distance is random
             neighborhood = list(itertools.product(tuple(range(-1 * n_det, n_det + 1)), repeat=3))
-            shuffle(neighborhood)
+            rg.shuffle(neighborhood)
             neighborhood = sorted(neighborhood, key=lambda v: v[0] ** 2 + v[1] ** 2 + v[2] ** 2)
 
             for dx, dy, dz in neighborhood:
@@ -182,7 +121,7 @@ class NeutrophilCellList(CellList):
                 yj = vox.y + dy
                 xk = vox.x + dx
                 if grid.is_valid_voxel(Voxel(x=xk, y=yj, z=zi)):
-                    index_arr = fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi))
+                    index_arr = fungus.alive(fungus.get_cells_in_voxel(Voxel(x=xk, y=yj, z=zi)))
                     if len(index_arr) > 0:
                         iron[zi, yj, xk] = 0
                     for index in index_arr:
@@ -230,6 +169,8 @@ class NeutrophilState(ModuleState):
 
 class Neutrophil(ModuleModel):
     name = 'neutrophil'
+    reads = ('geometry',)
+    writes = ('neutrophil', 'fungus', 'molecules')
 
     StateClass = NeutrophilState
 
@@ -263,30 +204,31 @@ class Neutrophil(ModuleModel):
         cyto = state.molecules.grid['n_cyto']
         iron = state.molecules.grid['iron']
 
-        # recruit new
-        n_cells.recruit_new(
-            neutrophil.rec_rate_ph,
-            neutrophil.rec_r,
-            neutrophil.granule_count,
-            neutrophil.neutropenic,
-            previous_time,
-            grid,
-            tissue,
-            cyto,
-        )
+        with phase('recruit_new'):
+            n_cells.recruit_new(
+                neutrophil.rec_rate_ph,
+                neutrophil.rec_r,
+                neutrophil.granule_count,
+                neutrophil.neutropenic,
+                previous_time,
+                grid,
+                tissue,
+                cyto,
+            )
 
-        # absorb cytokines
-        n_cells.absorb_cytokines(neutrophil.n_absorb, cyto, grid)
+        with phase('absorb_cytokines'):
+            n_cells.absorb_cytokines(neutrophil.n_absorb, cyto, grid)
 
-        # produce cytokines
-        n_cells.produce_cytokines(neutrophil.n_det, neutrophil.n_n, grid, fungus, cyto)
+        with phase('produce_cytokines'):
+            n_cells.produce_cytokines(neutrophil.n_det, neutrophil.n_n, grid, fungus, cyto)
 
-        # move
-        n_cells.move(neutrophil.rec_r, grid, cyto, tissue)
+        with phase('move'):
+            n_cells.move(neutrophil.rec_r, grid, cyto, tissue)
 
-        n_cells.damage_hyphae(
-            neutrophil.n_det, neutrophil.n_kill, neutrophil.time_n, health, grid, fungus, iron
-        )
+        with phase('damage_hyphae'):
+            n_cells.damage_hyphae(
+                neutrophil.n_det, neutrophil.n_kill, neutrophil.time_n, health, grid, fungus, iron
+            )
 
         # update granule == 0 status
         n_cells.update()
@@ -1,13 +1,13 @@
 from enum import IntEnum
 import math
-import random
 
 import attr
 import numpy as np
 
-from nlisim.cell import CellData, CellList
+from nlisim.cell import CellData
 from nlisim.coordinates import Point, Voxel
 from nlisim.grid import RectangularGrid
+from nlisim.internalization import PhagosomeCellList
 from nlisim.modules.geometry import TissueTypes
 from nlisim.random import rg
 
@@ -40,7 +40,6 @@ class PhagocyteCellData(CellData):
         ('state', 'u1'),
         ('iron_pool', 'f8'),
         ('iteration', 'i4'),
-        ('phagosome', (np.int32, (MAX_CONIDIA))),
     ]
 
     dtype = np.dtype(CellData.FIELDS + PHAGOCYTE_FIELDS, align=True)  # type: ignore
@@ -56,19 +55,16 @@ class PhagocyteCellData(CellData):
     ) -> np.record:
 
         iteration = 0
-        phagosome = np.empty(MAX_PHAGOSOME_LENGTH)
-        phagosome.fill(-1)
         return CellData.create_cell_tuple(**kwargs) + (
             status,
             state,
             iron_pool,
             iteration,
-            phagosome,
         )
 
 
 @attr.s(kw_only=True, frozen=True, repr=False)
-class PhagocyteCellList(CellList):
+class PhagocyteCellList(PhagosomeCellList):
     CellDataClass = PhagocyteCellData
 
     def is_moveable(self, grid: RectangularGrid):
@@ -79,36 +75,16 @@ class PhagocyteCellList(CellList):
         )
 
     def len_phagosome(self, index):
-        cell = self[index]
-        return len(np.argwhere(cell['phagosome'] != -1))
+        return self.phagosome.count(index)
 
     def append_to_phagosome(self, index, pathogen_index, max_size):
-        cell = self[index]
-        index_to_append = PhagocyteCellList.len_phagosome(self, index)
-        if index_to_append < MAX_PHAGOSOME_LENGTH and index_to_append < max_size:
-            cell['phagosome'][index_to_append] = pathogen_index
-            return True
-        else:
-            return False
+        return self.phagosome.add(index, pathogen_index, min(max_size, MAX_PHAGOSOME_LENGTH))
 
     def remove_from_phagosome(self, index, pathogen_index):
-        phagosome = self[index]['phagosome']
-        if pathogen_index in phagosome:
-            itemindex = np.argwhere(phagosome == pathogen_index)[0][0]
-            size = PhagocyteCellList.len_phagosome(self, index)
-            if itemindex == size - 1:
-                # full phagosome
-                phagosome[itemindex] = -1
-                return True
-            else:
-                phagosome[itemindex:-1] = phagosome[itemindex + 1 :]
-                phagosome[-1] = -1
-                return True
-        else:
-            return False
+        return self.phagosome.remove(index, pathogen_index)
 
     def clear_all_phagosome(self, index):
-        self[index]['phagosome'].fill(-1)
+        self.phagosome.clear([index])
 
     def recruit(self, rate, molecule, grid: RectangularGrid):
         # TODO - add recruitment
@@ -179,13 +155,13 @@ class PhagocyteCellList(CellList):
                 cum_p += p[i]
                 if prob <= cum_p:
                     cell['point'] = Point(
-                        x=random.uniform(
+                        x=rg.uniform(
                             grid.xv[vox.x + vox_list[i][0]], grid.xv[vox.x + vox_list[i][0] + 1]
                         ),
-                        y=random.uniform(
+                        y=rg.uniform(
                             grid.yv[vox.y + vox_list[i][1]], grid.yv[vox.y + vox_list[i][1] + 1]
                         ),
-                        z=random.uniform(
+                        z=rg.uniform(
                             grid.zv[vox.z + vox_list[i][2]], grid.zv[vox.z + vox_list[i][2] + 1]
                         ),
                     )
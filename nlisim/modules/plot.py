@@ -19,6 +19,8 @@ class PlotState(ModuleState):
 
 class Plot(ModuleModel):
     name = 'plot'
+    reads = ('fungus', 'macrophage', 'neutrophil')
+    writes = ('plot',)
     StateClass = PlotState
 
     def advance(self, state: State, previous_time: float):
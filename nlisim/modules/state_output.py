@@ -20,6 +20,8 @@ class StateOutput(ModuleModel):
     """
 
     name = 'state_output'
+    # saving compacts the cell lists of every module
+    writes = None
 
     StateClass = StateOutputState
 
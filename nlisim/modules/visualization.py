@@ -18,6 +18,7 @@ from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData, vtkStructur
 from vtkmodules.vtkIOLegacy import vtkPolyDataWriter, vtkStructuredPointsWriter
 
 from nlisim.cell import CellList
+from nlisim.config import SimulationConfig
 from nlisim.module import ModuleModel, ModuleState
 from nlisim.postprocess import generate_summary_stats
 from nlisim.state import State
@@ -43,9 +44,18 @@ class VisualizationState(ModuleState):
 
 class Visualization(ModuleModel):
     name = 'visualization'
+    writes = ('visualization',)
 
     StateClass = VisualizationState
 
+    def __init__(self, config: SimulationConfig):
+        super().__init__(config)
+
+        # the summary statistics written to csv files read every module
+        if not self.config.getboolean('csv_output', fallback=False):
+            variables = json.loads(self.config.get('visual_variables', fallback='[]'))
+            self.reads = tuple(sorted({variable['module'] for variable in variables}))
+
     @classmethod
     def write_poly_data(cls, var, filename: str, attr_names: str) -> None:
         vol = vtkPolyData()
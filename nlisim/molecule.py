@@ -1,5 +1,5 @@
 from enum import Enum, unique
-from typing import List
+from typing import List, Sequence, Tuple
 
 import attr
 from h5py import Group
@@ -34,54 +34,89 @@ class MoleculeTypes(Enum):
     n_cyto = 18
 
 
+@attr.s(auto_attribs=True, frozen=True, repr=False)
+class MoleculeFields(object):
+    """A read-only view exposing the grid of each active molecule by name.
+
+    This mimics the record array returned in earlier versions: fields are
+    accessed as `fields['iron']` or `fields.iron` and the active molecule
+    names are available from `fields.dtype.names`.  Each field is a
+    C-contiguous view into the underlying storage.
+    """
+
+    _data: np.ndarray
+    _names: Tuple[str, ...]
+
+    @property
+    def names(self) -> Tuple[str, ...]:
+        return self._names
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype({'names': list(self._names), 'formats': [self._data.dtype] * len(self)})
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self._data.shape[1:]
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __repr__(self) -> str:
+        return f'MoleculeFields({list(self._names)})'
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self._names:
+            raise KeyError(f'Molecule {name} is not declared or is knocked out')
+        return self._data[self._names.index(name)]
+
+    def stack(self, names: Sequence[str]) -> np.ndarray:
+        """Return a view of the fields of consecutive molecules as a single array.
+
+        The view has shape `(len(names), nz, ny, nx)`, so operations on it apply
+        to every one of the molecules at once.
+        """
+        start = self._names.index(names[0]) if names and names[0] in self._names else -1
+        if start < 0 or tuple(names) != self._names[start : start + len(names)]:
+            raise KeyError(f'Molecules {", ".join(names)} are not declared consecutively')
+        return self._data[start : start + len(names)]
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        if name.startswith('_') or name not in self._names:
+            return super().__getattribute__(name)
+        return self[name]
+
+
 @attr.s(kw_only=True, frozen=True, repr=False)
 class MoleculeGrid(object):
-    """A class contains a list of grids for each molecule type."""
+    """A class contains a list of grids for each molecule type.
+
+    The concentrations and sources of the declared molecules are stored in a
+    single contiguous array of shape `(len(types), nz, ny, nx)` so that the
+    grid of every molecule is itself contiguous in memory.  Storage is only
+    allocated for molecules added with `append_molecule_type`.
+    """
 
     grid: RectangularGrid = attr.ib()
-    _concentrations = attr.ib()
-    _sources = attr.ib()
+    _concentrations: np.ndarray = attr.ib()
+    _sources: np.ndarray = attr.ib()
     _molecule_type: List[str] = attr.ib(factory=list)
 
     @_concentrations.default
     def __set_default_concentrations(self):
-        return np.empty(0)
+        return self._allocate(0)
 
     @_sources.default
     def __set_default_sources(self):
-        return np.empty(0)
-
-    def __attrs_post_init__(self):
-        grid = self.grid
-        object.__setattr__(
-            self,
-            '_concentrations',
-            grid.allocate_variable(
-                dtype={
-                    'names': [molecule.name for molecule in MoleculeTypes],
-                    'formats': ['f4'] * len(MoleculeTypes),
-                }
-            ),
-        )
-
-        object.__setattr__(
-            self,
-            '_sources',
-            grid.allocate_variable(
-                dtype={
-                    'names': [molecule.name for molecule in MoleculeTypes],
-                    'formats': ['f4'] * len(MoleculeTypes),
-                }
-            ),
-        )
+        return self._allocate(0)
 
     @property
-    def concentrations(self):
-        return self._concentrations[[name for name in self._molecule_type]].view(np.recarray)
+    def concentrations(self) -> MoleculeFields:
+        return MoleculeFields(self._concentrations, tuple(self._molecule_type))
 
     @property
-    def sources(self):
-        return self._sources[[name for name in self._molecule_type]].view(np.recarray)
+    def sources(self) -> MoleculeFields:
+        return MoleculeFields(self._sources, tuple(self._molecule_type))
 
     @property
     def types(self):
@@ -92,27 +127,37 @@ class MoleculeGrid(object):
             raise TypeError('Expected an str index representing the type of molecule')
         if index not in self._molecule_type:
             raise KeyError(f'Molecule {index} is not declared or is knocked out')
-        return self._concentrations[index]
+        return self._concentrations[self._molecule_type.index(index)]
 
     def append_molecule_type(self, molecule: str):
-        if molecule not in self._concentrations.dtype.names:
+        """Declare a molecule, allocating zeroed storage for it.
+
+        Arrays previously returned for other molecules refer to the old
+        storage after a new molecule is appended.
+        """
+        if molecule not in MoleculeTypes.__members__:
             raise KeyError(f'Molecule {molecule} is not declared')
+        if molecule in self._molecule_type:
+            return
+
+        for name in ('_concentrations', '_sources'):
+            planes = np.concatenate([getattr(self, name), self._allocate(1)])
+            object.__setattr__(self, name, planes)
         self._molecule_type.append(molecule)
 
     def incr(self):
-        concentrations = self._concentrations
-        sources = self._sources
-        for name in self._molecule_type:
-            concentrations[name] += sources[name]
+        np.add(self._concentrations, self._sources, out=self._concentrations)
 
     def shape(self):
-        return self._concentrations.shape
+        return self._concentrations.shape[1:]
 
     def save(self, group: Group, name: str, metadata: dict) -> Group:
         """Save the molecule grid.
 
         Save the list of grid as a new composite data structure inside
-        an HDF5 group.
+        an HDF5 group.  The concentrations and sources are stored as four
+        dimensional datasets with one plane per declared molecule, in the
+        order given by the `molecule_type` attribute.
         """
         concentrations = self._concentrations
         sources = self._sources
@@ -129,14 +174,16 @@ class MoleculeGrid(object):
 
     @classmethod
     def load(cls, global_state: State, group: Group, name: str, metadata: dict) -> 'MoleculeGrid':
-        """Load a molecule grid object."""
-        composite_dataset = group[name]
+        """Load a molecule grid object.
 
-        # TODO: load back the molecule types
+        Files storing every entry of `MoleculeTypes`, either as one plane each
+        or as one structured record per voxel, are also supported.
+        """
+        composite_dataset = group[name]
 
-        concentrations = composite_dataset['concentrations'][:]
-        sources = composite_dataset['sources'][:]
-        molecule_type = composite_dataset.attrs['molecule_type']
+        molecule_type = [str(molecule) for molecule in composite_dataset.attrs['molecule_type']]
+        concentrations = cls._load_planes(composite_dataset['concentrations'], molecule_type)
+        sources = cls._load_planes(composite_dataset['sources'], molecule_type)
 
         return cls(
             grid=global_state.grid,
@@ -144,3 +191,17 @@ class MoleculeGrid(object):
             sources=sources,
             molecule_type=molecule_type,
         )
+
+    def _allocate(self, count: int) -> np.ndarray:
+        return np.zeros((count,) + tuple(self.grid.shape), dtype='f4')
+
+    @classmethod
+    def _load_planes(cls, dataset, molecule_type: List[str]) -> np.ndarray:
+        data = dataset[()]
+        if data.dtype.names is not None:
+            planes = [data[molecule] for molecule in molecule_type]
+        elif len(data) != len(molecule_type):
+            planes = [data[MoleculeTypes[molecule].value] for molecule in molecule_type]
+        else:
+            planes = data
+        return np.array(planes, dtype='f4').reshape((len(molecule_type),) + dataset.shape[-3:])
@@ -0,0 +1,56 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class SlabPool(object):
+    """A pool of threads running grid kernels over slabs of the z axis.
+
+    NumPy ufuncs and the SciPy filters release the GIL, so kernels working on
+    disjoint slabs of a grid run concurrently.  With a single thread every call
+    runs serially in the calling thread and no threads are started.
+    """
+
+    def __init__(self, threads: int = 1):
+        if threads < 1:
+            raise ValueError('The number of threads must be positive')
+        self.threads = threads
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def map(self, func: Callable[[T], R], items: Iterable[T]) -> List[R]:
+        """Apply a function to every item, concurrently when possible."""
+        items = list(items)
+        if self.threads == 1 or len(items) < 2:
+            return [func(item) for item in items]
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='nlisim-slab')
+        return list(self._executor.map(func, items))
+
+    def slabs(self, size: int, radius: int = 0) -> List[slice]:
+        """Split a z axis of `size` voxels into at most one slab per thread.
+
+        Slabs are at least `2 * radius` voxels thick, so halos of `radius` voxels
+        around slabs that are not adjacent never overlap.
+        """
+        count = max(1, min(self.threads, size // max(2 * radius, 1)))
+        edges = [size * i // count for i in range(count + 1)]
+        return [slice(start, stop) for start, stop in zip(edges[:-1], edges[1:])]
+
+    def shutdown(self) -> None:
+        """Stop the threads of the pool, which are restarted on the next call."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+def split_blocks(blocks: Iterable[Tuple[slice, ...]], slab: slice) -> List[Tuple[slice, ...]]:
+    """Restrict blocks of a grid to a slab of the z axis, dropping empty ones."""
+    parts = []
+    for block in blocks:
+        start = max(block[0].start, slab.start)
+        stop = min(block[0].stop, slab.stop)
+        if start < stop:
+            parts.append((slice(start, stop),) + tuple(block[1:]))
+    return parts
@@ -82,8 +82,8 @@ def create_vtk_geometry(grid: RectangularGrid, geometry: GeometryState) -> vtkSt
 def create_vtk_molecules(grid: RectangularGrid, molecules: MoleculesState) -> vtkStructuredPoints:
     vtk_grid = create_vtk_volume(grid)
     point_data = vtk_grid.GetPointData()
-    for name in molecules.grid.concentrations.dtype.names:
-        data = numpy_to_vtk(molecules.grid.concentrations[name].ravel())
+    for name in molecules.grid.types:
+        data = numpy_to_vtk(molecules.grid.concentrations[name].flatten())
         data.SetName(name)
         point_data.AddArray(data)
 
@@ -0,0 +1,213 @@
+from contextlib import contextmanager, nullcontext
+import json
+from pathlib import PurePath
+import threading
+from time import perf_counter
+import tracemalloc
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import attr
+
+from nlisim import tracing
+
+if TYPE_CHECKING:  # prevent circular imports for type checking
+    from nlisim.config import SimulationConfig  # noqa
+
+# the profiler recording phases, shared by all threads
+_active: Optional['Profiler'] = None
+
+_null = nullcontext()
+
+
+@attr.s(auto_attribs=True, kw_only=True)
+class PhaseStats(object):
+    """Aggregate measurements of every run of a phase."""
+
+    calls: int = 0
+    seconds: float = 0.0
+    peak_bytes: Optional[int] = None
+
+
+@attr.s(auto_attribs=True)
+class _Frame(object):
+    start: float
+    start_bytes: int = 0
+    # the highest allocation peak seen before nested phases reset it
+    peak: int = 0
+
+
+class Profiler(object):
+    """Record the wall time of named, possibly nested, phases of a simulation.
+
+    Phases are identified by their path, the names of the enclosing phases of
+    the same thread joined by `/`, e.g. `macrophage/move`.  With `memory`,
+    the peak size of the memory allocated by Python during each phase, as
+    traced by `tracemalloc`, is recorded as well.  Tracing allocations slows
+    the simulation down considerably, and the peaks of phases running
+    concurrently in different threads include each other's allocations.
+    """
+
+    def __init__(self, memory: bool = False):
+        if memory and not hasattr(tracemalloc, 'reset_peak'):
+            raise RuntimeError('Profiling memory requires Python 3.9 or later')
+        self.memory = memory
+        self.phases: Dict[str, PhaseStats] = {}
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._start: Optional[float] = None
+
+    @classmethod
+    def from_config(cls, config: 'SimulationConfig') -> 'Profiler':
+        return cls(memory=config.getboolean('simulation', 'profile_memory', fallback=False))
+
+    @contextmanager
+    def activate(self) -> Iterator['Profiler']:
+        """Record the phases entered in this context with this profiler."""
+        global _active
+        if _active is not None:
+            raise RuntimeError('Another profiler is already active')
+        if self.memory:
+            tracemalloc.start()
+        _active = self
+        self._start = perf_counter()
+        try:
+            yield self
+        finally:
+            self.wall_time += perf_counter() - self._start
+            _active = None
+            if self.memory:
+                tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Record the run of a phase nested in the current phase of this thread."""
+        stack: List[Tuple[str, _Frame]] = self._stack()
+        path = f'{stack[-1][0]}/{name}' if stack else name
+        frame = _Frame(start=perf_counter())
+        if self.memory:
+            frame.start_bytes, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1][1].peak = max(stack[-1][1].peak, peak)
+            tracemalloc.reset_peak()
+        stack.append((path, frame))
+        try:
+            yield
+        finally:
+            stack.pop()
+            seconds = perf_counter() - frame.start
+            peak_bytes = None
+            if self.memory:
+                peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+                peak_bytes = peak - frame.start_bytes
+                if stack:
+                    stack[-1][1].peak = max(stack[-1][1].peak, peak)
+            self._record(path, seconds, peak_bytes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        wall_time = self.wall_time
+        if _active is self and self._start is not None:
+            wall_time += perf_counter() - self._start
+        with self._lock:
+            phases = {path: attr.asdict(stats) for path, stats in self.phases.items()}
+        return {'wall_time': wall_time, 'memory': self.memory, 'phases': phases}
+
+    def save(self, arg: Union[str, PurePath, IO[str]]) -> None:
+        """Write the recorded measurements as JSON to a path or a text file."""
+        if isinstance(arg, (str, PurePath)):
+            with open(arg, 'w') as f:
+                json.dump(self.to_dict(), f, indent=2)
+        else:
+            json.dump(self.to_dict(), arg, indent=2)
+
+    def _stack(self) -> List[Tuple[str, _Frame]]:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, path: str, seconds: float, peak_bytes: Optional[int]) -> None:
+        with self._lock:
+            stats = self.phases.get(path)
+            if stats is None:
+                stats = self.phases[path] = PhaseStats()
+            stats.calls += 1
+            stats.seconds += seconds
+            if peak_bytes is not None:
+                stats.peak_bytes = max(stats.peak_bytes or 0, peak_bytes)
+
+
+def phase(name: str, args: Optional[Dict[str, Any]] = None) -> ContextManager[None]:
+    """Return a context recording a phase with the active profiler and tracer, if any.
+
+    Without an active profiler or tracer the context does nothing, so that
+    modules can mark their phases unconditionally.  The `args` are only
+    attached to the span of the tracer.
+    """
+    profiler = _active
+    tracer = tracing.active()
+    if tracer is None:
+        return _null if profiler is None else profiler.phase(name)
+    if profiler is None:
+        return tracer.span(name, args=args)
+    return _traced_phase(profiler, tracer, name, args)
+
+
+@contextmanager
+def _traced_phase(
+    profiler: Profiler, tracer: tracing.Tracer, name: str, args: Optional[Dict[str, Any]]
+) -> Iterator[None]:
+    with tracer.span(name, args=args), profiler.phase(name):
+        yield
+
+
+def summarize(profile: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Return the phases of a saved profile as rows in depth first order.
+
+    Phases nested in the same phase are sorted by decreasing total time.  Each
+    row contains the path, name and depth of the phase, its measurements, the
+    mean time per call and its share of the wall time of the run.
+    """
+    phases: Dict[str, Dict[str, Any]] = profile['phases']
+    children: Dict[str, List[str]] = {}
+    for path in phases:
+        # phases still running when the profile was saved are not recorded
+        parent = path.rpartition('/')[0]
+        while parent and parent not in phases:
+            parent = parent.rpartition('/')[0]
+        children.setdefault(parent, []).append(path)
+
+    wall_time = profile['wall_time'] or 1.0
+    rows: List[Dict[str, Any]] = []
+
+    def visit(parent: str, depth: int) -> None:
+        paths = sorted(children.get(parent, []), key=lambda p: -phases[p]['seconds'])
+        for path in paths:
+            stats = phases[path]
+            rows.append(
+                {
+                    'path': path,
+                    'name': path[len(parent) + 1 :] if parent else path,
+                    'depth': depth,
+                    'calls': stats['calls'],
+                    'seconds': stats['seconds'],
+                    'seconds_per_call': stats['seconds'] / max(stats['calls'], 1),
+                    'fraction': stats['seconds'] / wall_time,
+                    'peak_bytes': stats.get('peak_bytes'),
+                }
+            )
+            visit(path, depth + 1)
+
+    visit('', 0)
+    return rows
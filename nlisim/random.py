@@ -1,4 +1,48 @@
-from numpy.random import default_rng
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterable, Iterator, Optional, cast
+
+from numpy.random import Generator, default_rng
 
 # Seeding with None pulls a random seed from the OS
-rg = default_rng(None)
+root = default_rng(None)
+
+# the generators of the modules, drawn from the root generator so that modules
+# advanced concurrently never share a generator
+_streams: Dict[str, Generator] = {}
+_current: ContextVar[Optional[Generator]] = ContextVar('nlisim_random_stream', default=None)
+
+
+class _CurrentGenerator(object):
+    """Forward to the generator of the module being advanced, or the root generator."""
+
+    def __getattr__(self, name: str):
+        return getattr(_current.get() or root, name)
+
+
+rg = cast(Generator, _CurrentGenerator())
+
+
+def spawn_streams(names: Iterable[str], reset: bool = False) -> None:
+    """Draw a generator for each named module from the root generator.
+
+    Modules that already have a generator keep it unless `reset` is set.  The
+    generators are drawn in the order of `names`, so seeding the root generator
+    makes every module's random numbers reproducible, independent of the order
+    in which concurrently advanced modules draw from them.
+    """
+    if reset:
+        _streams.clear()
+    for name in names:
+        if name not in _streams:
+            _streams[name] = default_rng(root.integers(2 ** 63))
+
+
+@contextmanager
+def stream(name: str) -> Iterator[None]:
+    """Draw the random numbers of `rg` from the generator of the named module."""
+    token = _current.set(_streams.get(name))
+    try:
+        yield
+    finally:
+        _current.reset(token)
@@ -1,14 +1,19 @@
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack
 from dataclasses import dataclass, field
 from enum import Enum
-from queue import PriorityQueue
-from typing import Iterator, Tuple
+import heapq
+from typing import Dict, Iterator, List, Optional, Sequence, Set, Tuple
 
 import attr
 
+from nlisim import tracing
 from nlisim.config import SimulationConfig
 from nlisim.module import ModuleModel
+from nlisim.profiling import Profiler, phase
+from nlisim.random import spawn_streams, stream as random_stream
 from nlisim.state import State
-from nlisim.validation import context as validation_context
+from nlisim.validation import StateValidator, context as validation_context
 
 
 class Status(Enum):
@@ -19,67 +24,168 @@ class Status(Enum):
 
 def initialize(state: State) -> State:
     """Initialize a simulation state."""
-    for m in state.config.modules:
-        with validation_context(f'{m.name} (initialization)'):
-            state = m.initialize(state)
-
-    # run validation after all initialization is done otherwise validation
-    # could fail on a module's private state before it can initialize itself
-    with validation_context('global initialization'):
-        attr.validate(state)
+    with phase('initialize'):
+        for m in state.config.modules:
+            with validation_context(f'{m.name} (initialization)'), phase(m.name):
+                state = m.initialize(state)
+
+        # run validation after all initialization is done otherwise validation
+        # could fail on a module's private state before it can initialize itself
+        with validation_context('global initialization'), phase('validate'):
+            StateValidator.from_config(state.config).validate_all(state)
+
+    spawn_streams((m.name for m in state.config.modules), reset=True)
+    state.freeze_static()
     return state
 
 
+@dataclass(order=True)
+class ModuleUpdateEvent:
+    event_time: float
+    previous_update: float
+    # modules updated at the same time run in the order of the configuration
+    order: int
+    module: ModuleModel = field(compare=False)
+
+
+def run_concurrently(
+    state: State, events: List[ModuleUpdateEvent], executor: Executor
+) -> List[State]:
+    """Advance the modules of events scheduled at the same time concurrently.
+
+    A module starts once every earlier module in `events` whose declared
+    `reads` and `writes` conflict with its own has finished, so the result is
+    the same as advancing them one after the other.
+    """
+    modules = [event.module for event in events]
+    dependencies = [
+        {j for j in range(i) if modules[j].conflicts(modules[i])} for i in range(len(modules))
+    ]
+
+    def run(i: int) -> State:
+        name = modules[i].name
+        with validation_context(name), phase(name, {'time': state.time}), random_stream(name):
+            return modules[i].advance(state, events[i].previous_update)
+
+    results: Dict[int, State] = {}
+    running: Dict[Future, int] = {}
+    started: Set[int] = set()
+    while len(results) < len(modules):
+        for i, dependency in enumerate(dependencies):
+            if i not in started and dependency <= results.keys():
+                started.add(i)
+                running[executor.submit(run, i)] = i
+        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in finished:
+            results[running.pop(future)] = future.result()
+    return [results[i] for i in range(len(modules))]
+
+
 def advance(state: State, target_time: float) -> Iterator[State]:
-    """Advance a simulation to the given target time."""
+    """Advance a simulation to the given target time.
+
+    Modules are updated in order of their event times, and modules updated at
+    the same time in the order of the configuration.  With more than one
+    `module_threads` in the `simulation` section, modules updated at the same
+    time whose declared state accesses do not conflict run concurrently.  Each
+    module draws its random numbers from its own generator, so the result does
+    not depend on the number of threads.
+    """
     initial_time = state.time
 
-    @dataclass(order=True)
-    class ModuleUpdateEvent:
-        event_time: float
-        previous_update: float
-        module: ModuleModel = field(compare=False)
+    # each module draws random numbers from its own generator, so that modules
+    # advanced concurrently do not share one
+    spawn_streams(m.name for m in state.config.modules)
 
     # Create and fill a queue of modules to run. This allows for modules to
     # operate on disparate time scales. Modules which do not have a time step
     # set will not be run.
-    queue: PriorityQueue[ModuleUpdateEvent] = PriorityQueue()
-    for module in state.config.modules:
+    queue: List[ModuleUpdateEvent] = []
+    for order, module in enumerate(state.config.modules):
         if module.time_step is not None and module.time_step > 0:
-            queue.put(
+            heapq.heappush(
+                queue,
                 ModuleUpdateEvent(
-                    event_time=initial_time, previous_update=initial_time, module=module
-                )
+                    event_time=initial_time,
+                    previous_update=initial_time,
+                    order=order,
+                    module=module,
+                ),
             )
 
+    # dead cells are periodically removed from the cell lists so that the
+    # per-step scans over cell data do not grow with the number of dead cells
+    compact_interval = state.config.getfloat('simulation', 'compact_interval', fallback=0.0)
+    next_compaction = initial_time + compact_interval
+
+    module_threads = state.config.getint('simulation', 'module_threads', fallback=1)
+    executor = ThreadPoolExecutor(module_threads) if module_threads > 1 else None
+
+    # only the state written by each module is validated after its update
+    validator = StateValidator.from_config(state.config)
+
     # run the simulation until we meet or surpass the desired time
     # while-loop conditional is on previous time so that all pending
     # modules are run on final iteration
     previous_time: float = initial_time
-    while previous_time < target_time and not queue.empty():
-        update_event = queue.get()
-
-        m: ModuleModel = update_event.module
-        previous_time = update_event.previous_update
-        state.time = update_event.event_time
-
-        with validation_context(m.name):
-            state = m.advance(state, previous_time)
-            attr.validate(state)
-
-        # reinsert module with updated time
-        queue.put(
-            ModuleUpdateEvent(
-                event_time=state.time + m.time_step, previous_update=state.time, module=m
-            )
-        )
-        yield state
+    try:
+        while previous_time < target_time and queue:
+            # collect the modules updated at the same time
+            batch = [heapq.heappop(queue)]
+            while (
+                queue
+                and queue[0].event_time == batch[0].event_time
+                and batch[-1].previous_update < target_time
+            ):
+                batch.append(heapq.heappop(queue))
+            state.time = batch[0].event_time
+            tracing.sample(state)
+
+            results: Sequence[Optional[State]] = [None] * len(batch)
+            if executor is not None and len(batch) > 1:
+                # attributes rebound by any module of the batch are validated
+                snapshot = validator.snapshot(state)
+                results = run_concurrently(state, batch, executor)
+
+            for update_event, result in zip(batch, results):
+                m: ModuleModel = update_event.module
+                previous_time = update_event.previous_update
+
+                with validation_context(m.name):
+                    if result is None:
+                        snapshot = validator.snapshot(state)
+                        with phase(m.name, {'time': state.time}), random_stream(m.name):
+                            result = m.advance(state, previous_time)
+                    state = result
+                    with phase('validate'):
+                        validator.validate(state, m, snapshot)
+
+                if compact_interval > 0 and state.time >= next_compaction:
+                    with phase('compact'):
+                        state.compact_cells()
+                    next_compaction = state.time + compact_interval
+
+                # reinsert module with updated time
+                heapq.heappush(
+                    queue,
+                    ModuleUpdateEvent(
+                        event_time=state.time + m.time_step,
+                        previous_update=state.time,
+                        order=update_event.order,
+                        module=m,
+                    ),
+                )
+                yield state
+    finally:
+        if executor is not None:
+            executor.shutdown()
 
 
 def finalize(state: State) -> State:
-    for m in state.config.modules:
-        with validation_context(m.name):
-            state = m.finalize(state)
+    with phase('finalize'):
+        for m in state.config.modules:
+            with validation_context(m.name), phase(m.name):
+                state = m.finalize(state)
 
     return state
 
@@ -94,8 +200,29 @@ def run_iterator(config: SimulationConfig, target_time: float) -> Iterator[Tuple
     2. Initialize the state object (yielding the result)
     3. Advance the simulation by single time steps (yielding the result)
     4. Finalize the simulation (yielding the result)
+
+    When `profile` is set in the simulation section of the config, the time
+    spent in each module and its phases is written to that path as JSON.
+    When `trace` is set, a timeline of the run in the Trace Event Format is
+    written to that path.
     """
     attr.set_run_validators(config.getboolean('simulation', 'validate'))
+    profile = config.get('simulation', 'profile', fallback='')
+    trace = config.get('simulation', 'trace', fallback='')
+
+    with ExitStack() as stack:
+        if profile:
+            profiler = Profiler.from_config(config)
+            stack.callback(profiler.save, profile)
+            stack.enter_context(profiler.activate())
+        if trace:
+            tracer = tracing.Tracer()
+            stack.callback(tracer.save, trace)
+            stack.enter_context(tracer.activate())
+        yield from _run_iterator(config, target_time)
+
+
+def _run_iterator(config: SimulationConfig, target_time: float) -> Iterator[Tuple[State, Status]]:
     state = initialize(State.create(config))
     yield state, Status.initialize
 
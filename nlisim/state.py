@@ -1,12 +1,15 @@
+import hashlib
 from io import BytesIO, StringIO
-from pathlib import PurePath
-from typing import IO, TYPE_CHECKING, Any, Dict, Type, Union, cast
+import os
+from pathlib import Path, PurePath
+from typing import IO, TYPE_CHECKING, Any, Dict, Optional, Set, Type, Union, cast
 
 import attr
 from h5py import File as H5File
 import numpy as np
 
 from nlisim.grid import RectangularGrid
+from nlisim.profiling import phase
 from nlisim.validation import context as validation_context
 
 if TYPE_CHECKING:  # prevent circular imports for type checking
@@ -17,6 +20,10 @@ if TYPE_CHECKING:  # prevent circular imports for type checking
 _dtype_float = np.dtype('float')
 _dtype_float64 = np.dtype('float64')
 
+# name of the file next to saved snapshots containing the static variables,
+# given the digest of their content
+STATIC_FILE_NAME = 'static-{digest}.hdf5'
+
 
 @attr.s(auto_attribs=True, repr=False)
 class State(object):
@@ -32,6 +39,13 @@ class State(object):
     # public API instead
     _extra: Dict[str, 'ModuleState'] = attr.ib(factory=dict)
 
+    # static files written by this state, which are not written again
+    _static_files: Set[Path] = attr.ib(factory=set, init=False, eq=False)
+
+    # the digest of the static variables, computed once they are frozen
+    _static_frozen: bool = attr.ib(default=False, init=False, eq=False)
+    _static_digest: Optional[str] = attr.ib(default=None, init=False, eq=False)
+
     @classmethod
     def load(cls, arg: Union[str, bytes, PurePath, IO[bytes]]) -> 'State':
         """Load a pickled state from either a path, a file, or blob of bytes."""
@@ -61,23 +75,130 @@ class State(object):
 
                 state._extra[module.name] = module_state
 
+        state.freeze_static()
         return state
 
     def save(self, arg: Union[str, PurePath, IO[bytes]]) -> None:
-        """Save the current state to the file system."""
-        with H5File(arg, 'w') as hf:
-            hf.attrs['time'] = self.time
-            hf.attrs['config'] = str(self.config)  # TODO: save this in a different format
-            self.grid.save(hf)
-
-            for module in self.config.modules:
-                module_state = cast('ModuleState', getattr(self, module.name))
-                group = hf.create_group(module.name)
-                try:
-                    module_state.save_state(group)
-                except Exception:
-                    print(f'Error serializing {module.name}')
-                    raise
+        """Save the current state to the file system.
+
+        Dead cells are compacted out of all cell lists first so that snapshots
+        only store living cells.  When saving to a path, static variables are
+        written once to a file in the same directory named after the digest of
+        their content, which the snapshot references through external links.
+        Snapshots with different static variables thus never share a file.
+        Snapshots saved to file objects contain the static variables themselves.
+        """
+        path = Path(arg) if isinstance(arg, (str, PurePath)) else None
+        with phase('save', {'path': str(path) if path is not None else None}):
+            self.compact_cells()
+            static_file = None
+            digest = self.static_digest() if path is not None else None
+            if path is not None and digest is not None:
+                static_file = STATIC_FILE_NAME.format(digest=digest)
+                static_path = path.resolve().parent / static_file
+                if static_path not in self._static_files and not static_path.exists():
+                    self.save_static(static_path)
+                self._static_files.add(static_path)
+
+            with H5File(arg, 'w') as hf:
+                hf.attrs['time'] = self.time
+                hf.attrs['config'] = str(self.config)  # TODO: save this in a different format
+                self.grid.save(hf)
+
+                for module in self.config.modules:
+                    module_state = cast('ModuleState', getattr(self, module.name))
+                    group = hf.create_group(module.name)
+                    try:
+                        module_state.save_state(group, static_file)
+                    except Exception:
+                        print(f'Error serializing {module.name}')
+                        raise
+
+    def save_static(self, path: Union[str, PurePath]) -> None:
+        """Save the static variables of all module states to a file.
+
+        The file is written under a temporary name first, so that an
+        interrupted save never leaves a partial file at `path`.
+        """
+        partial = Path(f'{path}.{os.getpid()}.partial')
+        try:
+            with H5File(partial, 'w') as hf:
+                self.grid.save(hf)
+                for module in self.config.modules:
+                    module_state = cast('ModuleState', getattr(self, module.name))
+                    group = hf.create_group(module.name)
+                    try:
+                        module_state.save_static(group)
+                    except Exception:
+                        print(f'Error serializing {module.name}')
+                        raise
+            os.replace(partial, path)
+        finally:
+            if partial.exists():
+                partial.unlink()
+
+    def freeze_static(self) -> None:
+        """Make the static variables of all module states read-only.
+
+        They may no longer change, so the digest naming their file is only
+        computed once from now on.
+        """
+        for module in self.config.modules:
+            cast('ModuleState', getattr(self, module.name)).freeze_static()
+        self._static_frozen = True
+        self._static_digest = None
+
+    def static_digest(self) -> Optional[str]:
+        """Return a digest of the grid and static variables, or None without static variables.
+
+        Once the static variables are frozen, the digest is cached.
+        """
+        if self._static_frozen:
+            if self._static_digest is None:
+                self._static_digest = self._compute_static_digest()
+            return self._static_digest
+        return self._compute_static_digest()
+
+    def _compute_static_digest(self) -> Optional[str]:
+        digest = hashlib.sha1()
+        for dim in ('x', 'xv', 'y', 'yv', 'z', 'zv'):
+            digest.update(np.ascontiguousarray(getattr(self.grid, dim)).tobytes())
+
+        found = False
+        for module in self.config.modules:
+            module_state = getattr(self, module.name)
+            for field in attr.fields(type(module_state)):
+                if not (field.metadata or {}).get('static'):
+                    continue
+                value = np.ascontiguousarray(getattr(module_state, field.name))
+                header = f'{module.name}/{field.name}:{value.dtype.str}:{value.shape}'
+                digest.update(header.encode())
+                digest.update(value.tobytes())
+                found = True
+        return digest.hexdigest() if found else None
+
+    def compact_cells(self) -> Dict[str, np.ndarray]:
+        """Remove dead cells from every cell list in the module states.
+
+        Returns the index maps produced by `CellList.compact` keyed by
+        `<module name>.<attribute name>`.  The maps are passed to each module's
+        `remap_cell_indices` hook so that stored cell indices remain valid.
+        """
+        from nlisim.cell import CellList  # prevent circular imports
+
+        index_maps: Dict[str, np.ndarray] = {}
+        for module in self.config.modules:
+            module_state = self._extra.get(module.name)
+            if module_state is None:
+                continue
+            for field in attr.fields(type(module_state)):
+                value = getattr(module_state, field.name)
+                if isinstance(value, CellList):
+                    index_maps[f'{module.name}.{field.name}'] = value.compact()
+
+        for module in self.config.modules:
+            module.remap_cell_indices(self, index_maps)
+        return index_maps
 
     def serialize(self) -> bytes:
         """Return a serialized representation of the current state."""
@@ -126,15 +247,17 @@ class State(object):
         return sorted(super().__dir__() + list(self._extra.keys()))
 
 
-def grid_variable(dtype: np.dtype = _dtype_float) -> np.ndarray:
+def grid_variable(dtype: np.dtype = _dtype_float, static: bool = False) -> np.ndarray:
     """Return an "attr.ib" object defining a gridded state variable.
 
     A "gridded" variable is one that is discretized on the primary grid.  The
     attribute returned by this method contains a factory function for
-    initialization and a default validation that checks for NaN's.
+    initialization and a default validation that checks for NaN's.  A `static`
+    variable is only written during initialization; it is made read-only
+    afterwards, validated once and saved once per output directory.
     """
     from nlisim.module import ModuleState  # noqa prevent circular imports
-    from nlisim.validation import ValidationError  # prevent circular imports
+    from nlisim.validation import ValidationError, sampled  # prevent circular imports
 
     def factory(self: 'ModuleState') -> np.ndarray:
         return self.global_state.grid.allocate_variable(dtype)
@@ -143,6 +266,7 @@ def grid_variable(dtype: np.dtype = _dtype_float) -> np.ndarray:
         grid = self.global_state.grid
         if value.shape != grid.shape:
             raise ValidationError(f'Invalid shape for gridded variable {attribute.name}')
+        value = sampled(value)
         if value.dtype.names:
             for name in value.dtype.names:
                 if not np.isfinite(value[name]).all():
@@ -151,7 +275,7 @@ def grid_variable(dtype: np.dtype = _dtype_float) -> np.ndarray:
             if not np.isfinite(value).all():
                 raise ValidationError(f'Invalid value in gridded variable {attribute.name}')
 
-    metadata = {'grid': True}
+    metadata = {'grid': True, 'static': static}
     return attr.ib(
         default=attr.Factory(factory, takes_self=True),
         validator=validate_numeric,
@@ -159,6 +283,25 @@ def grid_variable(dtype: np.dtype = _dtype_float) -> np.ndarray:
     )
 
 
+def scratch_variable(dtype: np.dtype = _dtype_float, planes: Optional[int] = None) -> np.ndarray:
+    """Return an "attr.ib" object defining a gridded scratch buffer.
+
+    Scratch buffers are allocated once with the module state so that modules can
+    reuse them every time step.  Their contents are meaningless between calls,
+    so they are neither validated nor saved.  With `planes`, the buffer is a
+    stack of that many grids.
+    """
+    from nlisim.module import ModuleState  # noqa prevent circular imports
+
+    def factory(self: 'ModuleState') -> np.ndarray:
+        if planes is None:
+            return self.global_state.grid.allocate_variable(dtype)
+        return np.zeros((planes,) + tuple(self.global_state.grid.shape), dtype=dtype)
+
+    metadata = {'transient': True}
+    return attr.ib(default=attr.Factory(factory, takes_self=True), eq=False, metadata=metadata)
+
+
 def cell_list(list_class: Type['CellList']) -> 'CellList':
     def factory(self: 'ModuleState'):
         return list_class(grid=self.global_state.grid)
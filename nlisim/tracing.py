@@ -0,0 +1,139 @@
+from contextlib import contextmanager
+import json
+import os
+from pathlib import PurePath
+import threading
+from time import perf_counter
+from typing import IO, TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Set, Union
+
+import attr
+
+if TYPE_CHECKING:  # prevent circular imports for type checking
+    from nlisim.state import State  # noqa
+
+# the tracer recording events, shared by all threads
+_active: Optional['Tracer'] = None
+
+
+class Tracer(object):
+    """Record a timeline of a simulation in the Trace Event Format.
+
+    Spans of the solver, module phases and state output become complete
+    events on the thread that ran them, and `sample` records counters of the
+    simulation state.  The saved JSON file opens in Perfetto
+    (https://ui.perfetto.dev) or in the `chrome://tracing` viewer.
+    """
+
+    def __init__(self):
+        self.events: List[Dict[str, Any]] = []
+        self._pid = os.getpid()
+        self._origin = perf_counter()
+        self._threads: Set[int] = set()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator['Tracer']:
+        """Record the spans entered in this context with this tracer."""
+        global _active
+        if _active is not None:
+            raise RuntimeError('Another tracer is already active')
+        _active = self
+        try:
+            yield self
+        finally:
+            _active = None
+
+    @contextmanager
+    def span(
+        self, name: str, category: str = 'phase', args: Optional[Dict[str, Any]] = None
+    ) -> Iterator[None]:
+        """Record the time spent in this context as a complete event."""
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            event = self._event(name, 'X', start)
+            event['cat'] = category
+            event['dur'] = (perf_counter() - start) * 1e6
+            if args:
+                event['args'] = args
+            self._append(event)
+
+    def counter(self, name: str, values: Dict[str, float]) -> None:
+        """Record the current values of a group of counters."""
+        event = self._event(name, 'C', perf_counter())
+        event['args'] = values
+        self._append(event)
+
+    def sample(self, state: 'State') -> None:
+        """Record the number of living cells and the molecule totals of a state."""
+        from nlisim.cell import CellList  # prevent circular imports
+        from nlisim.molecule import MoleculeGrid  # prevent circular imports
+
+        cells: Dict[str, float] = {}
+        molecules: Dict[str, float] = {}
+        for module in state.config.modules:
+            module_state = getattr(state, module.name, None)
+            if module_state is None:
+                continue
+            for field in attr.fields(type(module_state)):
+                value = getattr(module_state, field.name)
+                if isinstance(value, CellList):
+                    cells[f'{module.name}.{field.name}'] = len(value.alive())
+                elif isinstance(value, MoleculeGrid):
+                    for name in value.types:
+                        molecules[name] = float(value[name].sum(dtype=float))
+        if cells:
+            self.counter('cells', cells)
+        if molecules:
+            self.counter('molecules', molecules)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            events = list(self.events)
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, arg: Union[str, PurePath, IO[str]]) -> None:
+        """Write the recorded events as JSON to a path or a text file."""
+        if isinstance(arg, (str, PurePath)):
+            with open(arg, 'w') as f:
+                json.dump(self.to_dict(), f)
+        else:
+            json.dump(self.to_dict(), arg)
+
+    def _event(self, name: str, phase: str, time: float) -> Dict[str, Any]:
+        return {
+            'name': name,
+            'ph': phase,
+            'ts': (time - self._origin) * 1e6,
+            'pid': self._pid,
+            'tid': threading.get_ident(),
+        }
+
+    def _append(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            tid = event['tid']
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self.events.append(
+                    {
+                        'name': 'thread_name',
+                        'ph': 'M',
+                        'pid': self._pid,
+                        'tid': tid,
+                        'args': {'name': threading.current_thread().name},
+                    }
+                )
+            self.events.append(event)
+
+
+def active() -> Optional[Tracer]:
+    """Return the active tracer, if any."""
+    return _active
+
+
+def sample(state: 'State') -> None:
+    """Record the counters of a state with the active tracer, if any."""
+    tracer = _active
+    if tracer is not None:
+        tracer.sample(state)
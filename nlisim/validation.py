@@ -1,7 +1,14 @@
-from contextlib import contextmanager
-from typing import TYPE_CHECKING, Callable, Iterator, List
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import attr
+import numpy as np
 
 if TYPE_CHECKING:  # prevent circular imports for type checking
+    from nlisim.config import SimulationConfig  # noqa
+    from nlisim.module import ModuleModel, ModuleState  # noqa
     from nlisim.state import State  # noqa
 
 ValidatorMethod = Callable[['State'], None]
@@ -52,3 +59,127 @@ def context(name: str) -> Iterator[None]:
         # TODO: use simulation logger
         print(f'ERROR: Unhandled exception raised while executing "{name}"')
         raise
+
+
+# flat indices of the voxels checked by validators of gridded variables
+_sample: ContextVar[Optional[np.ndarray]] = ContextVar('validation_sample', default=None)
+
+
+@contextmanager
+def sampling(indices: Optional[np.ndarray]) -> Iterator[None]:
+    """Restrict validators of gridded variables to the voxels at the given flat indices."""
+    token = _sample.set(indices)
+    try:
+        yield
+    finally:
+        _sample.reset(token)
+
+
+def sampled(value: np.ndarray) -> np.ndarray:
+    """Return the voxels of a gridded variable selected by the active `sampling` context."""
+    indices = _sample.get()
+    if indices is None:
+        return value
+    return np.take(value, indices)
+
+
+Snapshot = Dict[Tuple[str, str], int]
+
+
+class StateValidator(object):
+    """Validate the module states written by module updates.
+
+    After a module is advanced, only the attributes of the module states it
+    declares in `writes` are validated, together with any attribute of another
+    module state that it rebound to a new object.  Modules without declared
+    writes validate every module state.  Static attributes are read-only after
+    initialization, so they are only validated when rebound.  Validation runs
+    on every `interval`-th update of each module, and when `sample` is positive,
+    validators of gridded variables only check a random subset of voxels:
+    the fraction `sample` of them when it is below one, and otherwise that
+    number of voxels.
+    """
+
+    def __init__(self, interval: int = 1, sample: float = 0.0, seed: Optional[int] = None):
+        if interval < 1:
+            raise ValueError('The validation interval must be positive')
+        if sample < 0:
+            raise ValueError('The validation sample must not be negative')
+        self.interval = interval
+        self.sample = sample
+        # a separate generator so that sampling does not change the simulation
+        self.rg = np.random.default_rng(seed)
+        self._updates: Dict[str, int] = defaultdict(int)
+
+    @classmethod
+    def from_config(cls, config: 'SimulationConfig') -> 'StateValidator':
+        return cls(
+            interval=config.getint('simulation', 'validate_interval', fallback=1),
+            sample=config.getfloat('simulation', 'validate_sample', fallback=0.0),
+        )
+
+    def snapshot(self, state: 'State') -> Snapshot:
+        """Record the identity of every module state attribute to detect rebinding."""
+        return {
+            (name, field.name): id(getattr(module_state, field.name))
+            for name, module_state in self._module_states(state)
+            for field in attr.fields(type(module_state))
+        }
+
+    def validate(
+        self, state: 'State', module: 'ModuleModel', snapshot: Optional[Snapshot] = None
+    ) -> None:
+        """Validate the state written by a module update."""
+        self._updates[module.name] += 1
+        if (self._updates[module.name] - 1) % self.interval or not attr.get_run_validators():
+            return
+
+        writes = module.writes
+        current = self.snapshot(state) if snapshot is not None else {}
+        dirty = [
+            (module_state, field)
+            for name, module_state in self._module_states(state)
+            for field in attr.fields(type(module_state))
+            if ((writes is None or name in writes) and not (field.metadata or {}).get('static'))
+            or (
+                snapshot is not None
+                and current[name, field.name] != snapshot.get((name, field.name))
+            )
+        ]
+        self._run(state, dirty)
+
+    def validate_all(self, state: 'State') -> None:
+        """Validate every attribute of every module state."""
+        if not attr.get_run_validators():
+            return
+        self._run(
+            state,
+            [
+                (module_state, field)
+                for _, module_state in self._module_states(state)
+                for field in attr.fields(type(module_state))
+            ],
+        )
+
+    def _run(self, state: 'State', fields: Iterable[Tuple['ModuleState', attr.Attribute]]) -> None:
+        indices = self._sample_indices(len(state.grid))
+        with sampling(indices) if indices is not None else nullcontext():
+            for module_state, field in fields:
+                if field.validator is not None:
+                    field.validator(module_state, field, getattr(module_state, field.name))
+
+    def _sample_indices(self, size: int) -> Optional[np.ndarray]:
+        if self.sample <= 0:
+            return None
+        count = int(self.sample * size) if self.sample < 1 else int(self.sample)
+        if count >= size:
+            return None
+        return self.rg.integers(0, size, max(count, 1))
+
+    @classmethod
+    def _module_states(cls, state: 'State') -> List[Tuple[str, 'ModuleState']]:
+        return [
+            (module.name, getattr(state, module.name))
+            for module in state.config.modules
+            if hasattr(state, module.name)
+        ]
@@ -24,7 +24,7 @@ setup(
     name='nlisim',
     packages=find_packages(exclude=['test', 'test.*']),
     package_data={'nlisim.modules': ['geometry.hdf5']},
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=[
         'attrs',
         'click',
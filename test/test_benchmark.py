@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from nlisim.benchmark import benchmark_diffusion
+from nlisim.config import SimulationConfig
+from nlisim.random import rg
+
+
+@pytest.fixture
+def config():
+    yield SimulationConfig(
+        {'simulation': {'nx': 6, 'ny': 5, 'nz': 4, 'dx': 10, 'dy': 10, 'dz': 10}}
+    )
+
+
+def test_benchmark_diffusion(config):
+    state = rg.bit_generator.state
+    rows = benchmark_diffusion(config, backends=['box', 'implicit'], repeat=1)
+
+    assert rg.bit_generator.state == state
+    assert [row['backend'] for row in rows] == ['box', 'implicit']
+    assert rows[1]['relative_error'] == 0
+    assert np.isfinite(rows[0]['relative_error'])
+
+
+def test_benchmark_diffusion_unknown_backend(config):
+    with pytest.raises(ValueError):
+        benchmark_diffusion(config, backends=['spectral'])
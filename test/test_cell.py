@@ -6,6 +6,7 @@ from pytest import fixture, raises
 from nlisim.cell import CellData, CellList
 from nlisim.coordinates import Point, Voxel
 from nlisim.grid import RectangularGrid
+from nlisim.state import State
 
 
 @fixture
@@ -37,6 +38,20 @@ def test_extend_cell_list(cell, cell_list):
     assert cell == cell_list[-2]
 
 
+def test_extend_cell_data(grid: RectangularGrid):
+    cells = CellList(grid=grid)
+    raw_cells = CellData([CellData.create_cell() for _ in range(40)])
+    raw_cells['point'] = [[z, z, z] for z in np.linspace(5, 95, 40)]
+    cells.extend(raw_cells)
+    cells.extend(CellData(0))
+
+    assert len(cells) == 40
+    assert_array_equal(cells.cell_data, raw_cells)
+    for index, point in enumerate(raw_cells['point']):
+        voxel = grid.get_voxel(point)
+        assert index in cells.get_cells_in_voxel(voxel)
+
+
 def test_serialize(cell_list: CellList, hdf5_group: Group):
     cell_list_group = cell_list.save(hdf5_group, 'test', {})
     assert cell_list_group['cell_data'].shape == (len(cell_list),)
@@ -100,9 +115,174 @@ def test_move_cell(grid: RectangularGrid):
     # updating an incorrect index will not update the cell at index 0
     cells.update_voxel_index([1, 3])
     assert_array_equal(cells.get_neighboring_cells(cells[2]), [0, 2, 3])
-    assert cells._reverse_voxel_index[0] == grid.get_voxel(point)
+    assert cells.voxel_index[0] == grid.get_flattened_index(grid.get_voxel(point))
 
     # this should correctly update the voxel index
     cells.update_voxel_index([0])
     assert_array_equal(cells.get_neighboring_cells(cells[0]), [0])
-    assert cells._reverse_voxel_index[0] == grid.get_voxel(cells[0]['point'])
+    assert cells.voxel_index[0] == grid.get_flattened_index(grid.get_voxel(cells[0]['point']))
+
+
+def test_patch_voxel_index(grid: RectangularGrid):
+    generator = np.random.default_rng(0)
+    upper = np.array([grid.zv[-1], grid.yv[-1], grid.xv[-1]])
+
+    def random_cells(count: int) -> CellData:
+        cells = CellData(count, initialize=True)
+        # some of the cells are outside of the grid
+        cells['point'] = generator.uniform(-5, upper + 5, (count, 3))
+        return cells
+
+    cells = CellList(grid=grid, cell_data=random_cells(200))
+    voxels = np.argwhere(np.ones(grid.shape, dtype=bool))
+    for _ in range(5):
+        cells.get_cells_in_voxels(voxels)
+        moved = generator.choice(len(cells), 5, replace=False)
+        cells.cell_data['point'][moved] = random_cells(5)['point']
+        cells.update_voxel_index(moved)
+        cells.append(random_cells(1)[0])
+        cells.extend(random_cells(2))
+
+        expected = CellList(grid=grid, cell_data=cells.cell_data)
+        for actual, reference in zip(
+            cells.get_cells_in_voxels(voxels), expected.get_cells_in_voxels(voxels)
+        ):
+            assert_array_equal(actual, reference)
+        assert_array_equal(cells.voxel_counts(), expected.voxel_counts())
+
+
+def test_grow_cell_list(grid: RectangularGrid, point: Point):
+    cells = CellList(grid=grid)
+    assert cells.capacity < 100
+
+    cells.extend([CellData.create_cell(point=point, dead=bool(i % 2)) for i in range(100)])
+    assert len(cells) == 100
+    assert cells.capacity >= 100
+    assert_array_equal(cells.alive(), np.arange(0, 100, 2))
+    assert_array_equal(cells.get_cells_in_voxel(grid.get_voxel(point)), np.arange(100))
+
+
+def test_grow_respects_max_cells(grid: RectangularGrid, cell: CellData):
+    cells = CellList(grid=grid, max_cells=20)
+    cells.extend([cell] * 20)
+    assert cells.capacity == 20
+
+    with raises(Exception, match='Not enough free space'):
+        cells.append(cell)
+
+
+def test_shrink_to_fit(grid: RectangularGrid, cell: CellData):
+    cells = CellList(grid=grid)
+    cells.reserve(1000)
+    assert cells.capacity >= 1000
+
+    cells.extend([cell] * 20)
+    cells.shrink_to_fit()
+    assert cells.capacity == 20
+    assert len(cells) == 20
+    assert cell == cells[-1]
+
+
+def test_neighborhood_counts(grid: RectangularGrid):
+    cells = CellList(grid=grid)
+    cells.extend([CellData.create_cell(point=Point(x=55, y=55, z=55)) for _ in range(3)])
+    cells.append(CellData.create_cell(point=Point(x=75, y=55, z=55), dead=True))
+
+    counts = cells.neighborhood_counts(1, cells.cell_data['dead'] == False)  # noqa: E712
+    assert counts[5, 5, 4] == 3
+    assert counts[5, 5, 7] == 0
+    assert counts.sum() == 3 * 27
+
+    voxels = cells.grid_indices([0, 3])
+    assert_array_equal(voxels, [[5, 5], [5, 5], [5, 7]])
+
+
+def test_move_up_gradient(grid: RectangularGrid):
+    cells = CellList(grid=grid)
+    cells.extend([CellData.create_cell(point=Point(x=51, y=52, z=53)) for _ in range(200)])
+    signal = np.zeros(grid.shape)
+    signal[6, 5, 5] = 2
+    signal[5, 4, 5] = 2
+    signal[5, 5, 6] = 1
+    passable = np.ones(grid.shape, dtype=bool)
+
+    cells.move_up_gradient(np.arange(200), signal, 1, passable)
+
+    voxels = grid.get_voxels(cells.cell_data['point'])
+    assert {tuple(v) for v in voxels} == {(6, 5, 5), (5, 4, 5)}
+    assert_array_equal(cells.cell_data['point'] % 10, np.tile([3, 2, 1], (200, 1)))
+    assert len(cells.get_cells_in_voxel(Voxel(x=5, y=5, z=6))) == (voxels[:, 0] == 6).sum()
+
+
+def test_move_up_gradient_fallback(grid: RectangularGrid):
+    cells = CellList(grid=grid)
+    cells.extend([CellData.create_cell(point=Point(x=5, y=5, z=5)) for _ in range(200)])
+    passable = np.zeros(grid.shape, dtype=bool)
+    passable[:2, :2, 1] = True
+
+    # the signal is below the threshold everywhere so cells move randomly
+    cells.move_up_gradient(np.arange(200), np.zeros(grid.shape), 1, passable)
+
+    voxels = grid.get_voxels(cells.cell_data['point'])
+    assert {tuple(v) for v in voxels} == {(0, 0, 1), (0, 1, 1), (1, 0, 1), (1, 1, 1)}
+
+    with raises(AssertionError):
+        cells.move_up_gradient([0], np.zeros(grid.shape), 1, np.zeros(grid.shape, dtype=bool))
+
+
+def test_compact(grid: RectangularGrid, point: Point):
+    cells = CellList(grid=grid)
+    cells.extend([CellData.create_cell(point=point, dead=i % 5 != 0) for i in range(100)])
+    index_map = cells.compact()
+
+    assert len(cells) == 20
+    assert not cells.cell_data['dead'].any()
+    assert_array_equal(index_map[::5], np.arange(20))
+    assert (np.delete(index_map, np.s_[::5]) == -1).all()
+    assert cells.capacity < 100
+    assert_array_equal(cells.get_cells_in_voxel(grid.get_voxel(point)), np.arange(20))
+
+
+def test_save_load_grown(state: State, hdf5_group: Group, point: Point):
+    cells = CellList(grid=state.grid, max_cells=500)
+    cells.extend([CellData.create_cell(point=point) for _ in range(100)])
+    cells.save(hdf5_group, 'test', {})
+
+    loaded = CellList.load(state, hdf5_group, 'test', {})
+    assert len(loaded) == 100
+    assert loaded.max_cells == 500
+    assert loaded.capacity < loaded.max_cells
+    assert_array_equal(loaded.cell_data, cells.cell_data)
+
+
+def test_get_cells_in_voxels(grid: RectangularGrid):
+    raw_cells = [CellData.create_cell(point=Point(x=4.5, y=4.5, z=4.5)) for _ in range(5)]
+    raw_cells[1]['point'] = Point(x=14.5, y=4.5, z=4.5)
+    raw_cells[3]['point'] = Point(x=4.5, y=4.5, z=-1)
+
+    cells = CellList(grid=grid)
+    cells.extend(raw_cells)
+
+    voxels = np.asarray([[0, 0, 1], [0, 0, 0], [5, 5, 5], [-1, 0, 0], [0, 0, 0]])
+    indices, counts = cells.get_cells_in_voxels(voxels)
+    assert_array_equal(counts, [1, 3, 0, 0, 3])
+    assert_array_equal(indices, [1, 0, 2, 4, 0, 2, 4])
+
+
+def test_voxel_counts(grid: RectangularGrid):
+    raw_cells = [CellData.create_cell(point=Point(x=4.5, y=4.5, z=4.5)) for _ in range(5)]
+    raw_cells[1]['point'] = Point(x=14.5, y=4.5, z=4.5)
+    raw_cells[3]['point'] = Point(x=4.5, y=4.5, z=-1)
+
+    cells = CellList(grid=grid)
+    cells.extend(raw_cells)
+
+    counts = cells.voxel_counts()
+    assert counts.shape == grid.shape
+    assert counts.sum() == 4
+    assert counts[0, 0, 0] == 3
+    assert counts[0, 0, 1] == 1
+
+    counts = cells.voxel_counts(np.arange(5) > 1)
+    assert counts.sum() == 2
+    assert counts[0, 0, 0] == 2
@@ -1,7 +1,19 @@
 import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
 import pytest
+from scipy.sparse import dok_matrix
 
-from nlisim.diffusion import discrete_laplacian
+from nlisim.coordinates import Voxel
+from nlisim.diffusion import (
+    ActiveTiles,
+    BoxDiffusion,
+    ImplicitDiffusion,
+    ImplicitDiffusionSolver,
+    MultigridSolver,
+    SeparableDiffusion,
+    discrete_laplacian,
+    get_diffusion_backend,
+)
 from nlisim.grid import RectangularGrid
 
 
@@ -46,3 +58,191 @@ def test_surface_laplacian(grid, mask):
     assert laplacian[1, 1, 1, 1, 1, 1] == -4
     assert (laplacian[:, :, 0, :, :, :] == 0).all()
     assert laplacian[0, 1, 1, 1, 1, 1] == 1
+
+
+def reference_laplacian(grid, mask):
+    laplacian = dok_matrix((len(grid), len(grid)))
+    for k, j, i in zip(*mask.nonzero()):
+        voxel = Voxel(x=i, y=j, z=k)
+        voxel_index = grid.get_flattened_index(voxel)
+        normalization = 0
+        for neighbor in grid.get_adjecent_voxels(voxel, corners=False):
+            if not mask[neighbor.z, neighbor.y, neighbor.x]:
+                continue
+            axis = [k != neighbor.z, j != neighbor.y, i != neighbor.x].index(True)
+            weight = 1 / grid.delta(axis)[k, j, i] ** 2
+            normalization -= weight
+            laplacian[voxel_index, grid.get_flattened_index(neighbor)] = weight
+        laplacian[voxel_index, voxel_index] = normalization
+    return laplacian.tocsr()
+
+
+def test_laplacian_matches_reference():
+    grid = RectangularGrid.construct_uniform(shape=(4, 5, 6), spacing=(1, 2, 3))
+    mask = np.random.default_rng(0).random(grid.shape) < 0.6
+    laplacian = discrete_laplacian(grid, mask)
+    expected = reference_laplacian(grid, mask)
+
+    assert_array_equal(laplacian.toarray(), expected.toarray())
+    assert laplacian.nnz == expected.nnz
+
+
+@pytest.fixture
+def field():
+    variable = np.zeros((5, 5, 5))
+    variable[2, 2, 2] = 27
+    yield variable
+
+
+def test_separable_matches_box(field):
+    grid = RectangularGrid.construct_uniform(shape=(5, 5, 5), spacing=(1, 1, 1))
+    mask = np.ones(grid.shape, dtype=bool)
+    box = field.copy()
+    BoxDiffusion(grid, mask).diffuse(box, None, 1)
+    SeparableDiffusion(grid, mask).diffuse(field, None, 1)
+
+    assert_allclose(field, box, atol=1e-12)
+    assert box[1, 1, 1] == 1
+
+
+@pytest.mark.parametrize('backend', ['box', 'separable', 'implicit', 'multigrid'])
+def test_backend_conserves_mass(field, backend):
+    grid = RectangularGrid.construct_uniform(shape=(5, 5, 5), spacing=(1, 1, 1))
+    mask = np.ones(grid.shape, dtype=bool)
+    get_diffusion_backend(backend)(grid, mask).diffuse(field, 0.1, 1)
+
+    assert field.sum() == pytest.approx(27, rel=1e-4)
+    assert field[2, 2, 2] < 27
+    assert field[2, 2, 3] > 0
+
+
+@pytest.mark.parametrize('backend', ['box', 'separable', 'implicit', 'multigrid'])
+def test_backend_diffusivity_units(field, backend):
+    # diffusivities are physical, so scaling the spacing by 10 and the
+    # diffusivity by 100 gives the same result
+    mask = np.ones(field.shape, dtype=bool)
+    unit = field.copy()
+    grid = RectangularGrid.construct_uniform(shape=field.shape, spacing=(1, 1, 1))
+    get_diffusion_backend(backend)(grid, mask).diffuse(unit, 0.1, 1)
+    grid = RectangularGrid.construct_uniform(shape=field.shape, spacing=(10, 10, 10))
+    get_diffusion_backend(backend)(grid, mask).diffuse(field, 10, 1)
+
+    assert_allclose(field, unit, rtol=1e-5, atol=1e-8)
+
+
+def test_box_diffusivity_units(field):
+    grid = RectangularGrid.construct_uniform(shape=field.shape, spacing=(10, 10, 10))
+    backend = BoxDiffusion(grid, np.ones(field.shape, dtype=bool))
+    full = field.copy()
+    backend.diffuse(full, None, 1)
+    slow = field.copy()
+    backend.diffuse(slow, 0.8, 1)
+
+    # a full box average takes a diffusivity of dx ** 2 / (3 * dt)
+    backend.diffuse(field, 100 / 3, 1)
+    assert_allclose(field, full)
+    assert slow[2, 2, 3] == pytest.approx(3 * 0.8 / 100)
+
+
+def test_implicit_diffusion_mask(field):
+    grid = RectangularGrid.construct_uniform(shape=(5, 5, 5), spacing=(1, 1, 1))
+    mask = np.zeros(grid.shape, dtype=bool)
+    mask[2] = True
+    ImplicitDiffusion(grid, mask).diffuse(field, 1, 1)
+
+    assert field[2].sum() == pytest.approx(27, rel=1e-4)
+    assert (field[1] == 0).all()
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        get_diffusion_backend('spectral')
+
+
+@pytest.mark.parametrize('preconditioner', ['jacobi', 'ilu', 'none'])
+def test_implicit_solver_preconditioners(grid, field, preconditioner):
+    laplacian = discrete_laplacian(grid, np.ones(grid.shape, dtype=bool))
+    variable = field[1:4, 1:4, 1:4]
+    expected = ImplicitDiffusionSolver(laplacian, preconditioner='none', tol=1e-10)
+    solver = ImplicitDiffusionSolver(laplacian, preconditioner=preconditioner, tol=1e-10)
+
+    assert_allclose(
+        solver.solve(variable, 0.5, 1), expected.solve(variable, 0.5, 1), rtol=1e-8, atol=1e-8
+    )
+    assert solver.residual < 1e-10
+    assert solver.solves == 1
+
+
+def test_implicit_solver_cache_and_warm_start(grid):
+    laplacian = discrete_laplacian(grid, np.ones(grid.shape, dtype=bool))
+    solver = ImplicitDiffusionSolver(laplacian)
+
+    # a uniform field is already a solution so the warm start converges immediately
+    uniform = np.full(grid.shape, 3.0)
+    assert_allclose(solver.solve(uniform, 1, 1), uniform)
+    assert solver.iterations <= 1
+
+    variable = np.random.default_rng(0).random(grid.shape)
+    operator, _ = solver.system(1, 1)
+    solver.solve(variable, 1, 1)
+    assert solver.system(1, 1)[0] is operator
+    assert solver.iterations > 0
+    assert solver.solves == 2
+
+
+def test_implicit_solver_unknown_preconditioner(grid):
+    laplacian = discrete_laplacian(grid, np.ones(grid.shape, dtype=bool))
+    with pytest.raises(ValueError):
+        ImplicitDiffusionSolver(laplacian, preconditioner='multigrid')
+
+
+def test_multigrid_solver():
+    grid = RectangularGrid.construct_uniform(shape=(9, 16, 10), spacing=(1, 1, 1))
+    mask = np.ones(grid.shape, dtype=bool)
+    mask[:, :4] = False
+    variable = np.random.default_rng(0).random(grid.shape)
+    expected = ImplicitDiffusionSolver(discrete_laplacian(grid, mask), tol=1e-10).solve(
+        variable, 10, 1
+    )
+
+    solver = MultigridSolver(grid, mask, 10, 1, coarse_size=64, tol=1e-8)
+    assert len(solver.levels) > 2
+    assert_allclose(solver.solve(variable), expected, atol=1e-6)
+    assert solver.iterations > 0
+    assert solver.residual < 1e-8
+
+
+def test_multigrid_preconditioner():
+    grid = RectangularGrid.construct_uniform(shape=(8, 8, 8), spacing=(1, 1, 1))
+    mask = np.ones(grid.shape, dtype=bool)
+    laplacian = discrete_laplacian(grid, mask)
+    variable = np.random.default_rng(0).random(grid.shape)
+    jacobi = ImplicitDiffusionSolver(laplacian)
+    multigrid = ImplicitDiffusionSolver(laplacian, preconditioner='multigrid', grid=grid, mask=mask)
+
+    assert_allclose(multigrid.solve(variable, 100, 1), jacobi.solve(variable, 100, 1), atol=1e-4)
+    assert multigrid.iterations < jacobi.iterations
+
+    with pytest.raises(ValueError):
+        ImplicitDiffusionSolver(laplacian, preconditioner='multigrid')
+
+
+def test_active_tiles():
+    mask = np.zeros((8, 8, 10), dtype=bool)
+    mask[:4, :4, :6] = True
+    tiles = ActiveTiles(mask, 2)
+    variable = np.zeros(mask.shape)
+    assert tiles.blocks(variable) == ([], [])
+
+    variable[0, 0, 2] = 1
+    variable[7, 7, 9] = 1
+    updates, clears = tiles.blocks(variable)
+    assert updates == [
+        (slice(0, 2), slice(0, 2), slice(0, 6)),
+        (slice(0, 2), slice(2, 4), slice(0, 6)),
+        (slice(2, 4), slice(0, 2), slice(0, 6)),
+        (slice(2, 4), slice(2, 4), slice(0, 6)),
+    ]
+    assert clears == [(slice(6, 8), slice(6, 8), slice(8, 10))]
+
+    assert tiles.blocks(variable, tolerance=1) == ([], clears)
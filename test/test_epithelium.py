@@ -96,8 +96,7 @@ def test_internalize_conidia_none(
     populated_epithelium.internalize_conidia(0, 10, 1, grid, fungus_list)
 
     assert populated_epithelium.len_phagosome(0) == 0
-    for v in cell['phagosome']:
-        assert v == -1
+    assert len(populated_epithelium.phagosome) == 0
 
 
 def test_internalize_conidia_1(
@@ -115,7 +114,7 @@ def test_internalize_conidia_1(
 
     assert grid.get_voxel(fungus_list[0]['point']) == vox
     assert epithelium_list.len_phagosome(0) == 1
-    assert 0 in epithelium_list[0]['phagosome']
+    assert 0 in epithelium_list.phagosome.pathogens_of(0)
 
 
 def test_internalize_conidia_2(
@@ -136,8 +135,8 @@ def test_internalize_conidia_2(
 
     assert grid.get_voxel(fungus_list[0]['point']) == vox
     assert epithelium_list.len_phagosome(0) == 2
-    assert 0 in epithelium_list[0]['phagosome']
-    assert 1 in epithelium_list[0]['phagosome']
+    assert 0 in epithelium_list.phagosome.pathogens_of(0)
+    assert 1 in epithelium_list.phagosome.pathogens_of(0)
 
 
 def test_internalize_conidia_2b(
@@ -159,8 +158,8 @@ def test_internalize_conidia_2b(
 
     assert grid.get_voxel(fungus_list[0]['point']) == vox
     assert epithelium_list.len_phagosome(0) == 1
-    assert 0 not in epithelium_list[0]['phagosome']
-    assert 1 in epithelium_list[0]['phagosome']
+    assert 0 not in epithelium_list.phagosome.pathogens_of(0)
+    assert 1 in epithelium_list.phagosome.pathogens_of(0)
 
 
 def test_internalize_conidia_max(
@@ -173,12 +172,13 @@ def test_internalize_conidia_max(
     )
 
     max_spores = 10
-    epithelium_list[0]['phagosome'][:max_spores] = 99  # artificially fill
+    for pathogen in range(100, 100 + max_spores):  # artificially fill
+        epithelium_list.append_to_phagosome(0, pathogen, max_spores)
 
     epithelium_list.internalize_conidia(0, max_spores, 1, grid, fungus_list)
 
     assert epithelium_list.len_phagosome(0) == max_spores
-    assert 0 not in epithelium_list[0]['phagosome']
+    assert 0 not in epithelium_list.phagosome.pathogens_of(0)
     assert not fungus_list[0]['internalized']
 
 
@@ -197,7 +197,7 @@ def test_dead_conidia_1(
     epithelium_list.remove_dead_fungus(fungus_list, grid)
 
     assert epithelium_list.len_phagosome(0) == 0
-    assert 0 not in epithelium_list[0]['phagosome']
+    assert 0 not in epithelium_list.phagosome.pathogens_of(0)
 
 
 def test_produce_cytokines_0(
@@ -374,7 +374,7 @@ def test_kill_epithelium(
     )
 
     fungus_list.cell_data['internalized'][0] = True
-    epithelium_list[0]['phagosome'][0] = 0  # internalized
+    epithelium_list.append_to_phagosome(0, 0, 10)  # internalized
 
     epithelium_list.die_by_germination(fungus_list)
     assert fungus_list.cell_data['internalized'][0]
@@ -146,6 +146,19 @@ def test_internal_change_state_zero_swallow(populated_fungus):
     assert cells['status'][1] == FungusCellData.Status.GERMINATED
 
 
+def test_change_state_dead_cells(populated_fungus):
+    cells = populated_fungus.cell_data
+    for _ in range(10):
+        populated_fungus.age()
+    cells['form'] = FungusCellData.Form.CONIDIA
+    cells['status'] = FungusCellData.Status.RESTING
+    cells['internalized'][3:] = True
+    cells['dead'][0:2] = True
+    populated_fungus.change_status(1, 10, 10)
+    assert (cells['status'][0:2] == FungusCellData.Status.RESTING).all()
+    assert (cells['status'][2:] == FungusCellData.Status.SWOLLEN).all()
+
+
 def test_grow_conidia(populated_fungus):
     cells = populated_fungus.cell_data
     cells['form'] = FungusCellData.Form.CONIDIA
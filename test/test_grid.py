@@ -1,3 +1,5 @@
+import numpy as np
+from numpy.testing import assert_array_equal
 import pytest
 
 from nlisim.coordinates import Point, Voxel
@@ -220,3 +222,85 @@ def test_get_voxels_in_large_range(grid: RectangularGrid):
 def test_get_flattened_index(voxel, index, grid: RectangularGrid):
     assert grid.get_flattened_index(voxel) == index
     assert grid.voxel_from_flattened_index(index) == voxel
+
+
+def test_get_voxels(grid: RectangularGrid):
+    points = np.asarray([[0.5, 0.5, 0.5], [1.5, 1.1, 1.9], [0.4, -0.4, -0.1], [10.5, 1.5, 1.5]])
+    assert_array_equal(grid.get_voxels(points), [[0, 0, 0], [1, 1, 1], [0, -1, -1], [-1, 1, 1]])
+
+
+def reference_voxel_index(vertices: np.ndarray, coordinate: float) -> int:
+    # the scalar lookup get_voxel used before it delegated to get_voxels
+    indices = (vertices >= coordinate).nonzero()[0]
+    if len(indices) == 0:
+        return -1
+    return indices[0] - 1
+
+
+def test_get_voxels_matches_reference(grid: RectangularGrid):
+    rng = np.random.default_rng(0)
+    points = rng.uniform(-2, 32, size=(200, 3))
+    # include coordinates lying exactly on vertices, on the domain boundary and
+    # outside of the domain
+    points[:50] = np.round(points[:50])
+    points[50:56] = [[0, 0, 0], [10, 20, 30], [-1, 5, 5], [5, 21, 5], [5, 5, 30.5], [11, -3, 31]]
+
+    voxels = grid.get_voxels(points)
+    for point, voxel in zip(points, voxels):
+        expected = [
+            reference_voxel_index(vertices, coordinate)
+            for vertices, coordinate in zip((grid.zv, grid.yv, grid.xv), point)
+        ]
+        assert voxel.tolist() == expected
+        assert grid.get_voxel(point) == Voxel(x=expected[2], y=expected[1], z=expected[0])
+    assert (voxels == -1).any()
+    assert (voxels == [9, 19, 29]).any(axis=0).all()
+
+
+def test_get_voxels_non_uniform():
+    xv = np.asarray([0.0, 1.0, 3.0, 7.0])
+    uniform = RectangularGrid.construct_uniform((3, 3, 3), (1, 1, 1))
+    grid = RectangularGrid(
+        x=(xv[1:] + xv[:-1]) / 2, y=uniform.y, z=uniform.z, xv=xv, yv=uniform.yv, zv=uniform.zv
+    )
+
+    points = np.asarray([[0.5, 0.5, x] for x in [-1.0, 0.0, 0.5, 1.0, 2.0, 3.0, 6.9, 7.0, 7.5]])
+    assert_array_equal(grid.get_voxels(points)[:, 2], [-1, -1, 0, 0, 1, 1, 2, 2, -1])
+
+
+def test_get_voxels_invalid_shape(grid: RectangularGrid):
+    with pytest.raises(ValueError):
+        grid.get_voxels(np.zeros((3, 2)))
+
+
+def test_get_voxels_non_finite(grid: RectangularGrid):
+    points = np.array([[np.nan, 0.5, 0.5], [0.5, np.inf, 0.5], [0.5, 0.5, -np.inf]])
+    assert_array_equal(grid.get_voxels(points).min(axis=1), [-1, -1, -1])
+
+
+@pytest.mark.parametrize('radius', [0, 1, 3])
+def test_box_sum(grid: RectangularGrid, radius):
+    values = np.zeros(grid.shape, dtype=int)
+    values[0, 0, 0] = 1
+    values[5, 10, 15] = 2
+
+    result = grid.box_sum(values, radius)
+    assert result.sum() == (radius + 1) ** 3 + 2 * (2 * radius + 1) ** 3
+    assert result[radius, radius, radius] == 1
+    assert result[5 + radius, 10 - radius, 15] == 2
+    assert result[5 + radius + 1, 10, 15] == 0
+
+
+def test_coarsen():
+    grid = RectangularGrid.construct_uniform(shape=(5, 4, 1), spacing=(1, 2, 3))
+    coarse = grid.coarsen()
+
+    assert coarse.shape == (3, 2, 1)
+    assert_array_equal(coarse.zv, [0, 2, 4, 5])
+    assert_array_equal(coarse.z, [1, 3, 4.5])
+    assert_array_equal(coarse.xv, grid.xv)
+
+    indices = grid.coarse_indices()
+    assert indices.shape == grid.shape
+    assert_array_equal(indices[:, 0, 0], [0, 0, 2, 2, 4])
+    assert_array_equal(indices[0, :, 0], [0, 0, 1, 1])
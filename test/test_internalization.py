@@ -0,0 +1,99 @@
+from h5py import Group
+import numpy as np
+from numpy.testing import assert_array_equal
+from pytest import fixture
+
+from nlisim.grid import RectangularGrid
+from nlisim.internalization import InternalizationTable
+from nlisim.modules.macrophage import MacrophageCellData, MacrophageCellList
+from nlisim.state import State
+
+
+@fixture
+def table():
+    table = InternalizationTable()
+    table.add_pairs([2, 0, 0, 1], [7, 5, 3, 4])
+    yield table
+
+
+def test_add(table: InternalizationTable):
+    assert table.add(1, 8)
+    assert not table.add(1, 8)
+    assert not table.add(1, 9, max_size=2)
+    assert table.count(1) == 2
+    assert_array_equal(table.pathogens_of(1), [4, 8])
+
+
+def test_add_pairs(table: InternalizationTable):
+    table.add_pairs([1, 3, 0, 1, 3], [8, 0, 5, 8, 1])
+    assert_array_equal(table.hosts, [0, 0, 1, 1, 2, 3, 3])
+    assert_array_equal(table.pathogens, [3, 5, 4, 8, 7, 0, 1])
+
+
+def test_insertion_order():
+    # the table does not remember the order in which pairs were added, so
+    # nothing reading it can depend on that order
+    hosts, pathogens = [2, 0, 0, 1, 0], [7, 5, 3, 4, 9]
+    added = InternalizationTable()
+    for host, pathogen in zip(hosts, pathogens):
+        added.add(host, pathogen)
+    reversed_table = InternalizationTable()
+    reversed_table.add_pairs(hosts[::-1], pathogens[::-1])
+
+    assert_array_equal(added.hosts, reversed_table.hosts)
+    assert_array_equal(added.pathogens, reversed_table.pathogens)
+    assert_array_equal(added.pathogens_of(0), [3, 5, 9])
+
+
+def test_sorted_pairs(table: InternalizationTable):
+    assert_array_equal(table.hosts, [0, 0, 1, 2])
+    assert_array_equal(table.pathogens, [3, 5, 4, 7])
+    assert_array_equal(table.counts(4), [2, 1, 1, 0])
+
+
+def test_remove(table: InternalizationTable):
+    assert table.remove(0, 3)
+    assert not table.remove(0, 3)
+    assert not table.contains(0, 3)
+    assert table.contains(0, 5)
+    assert len(table) == 3
+
+
+def test_clear(table: InternalizationTable):
+    assert_array_equal(table.clear([0, 2]), [3, 5, 7])
+    assert_array_equal(table.hosts, [1])
+
+
+def test_hosts_of(table: InternalizationTable):
+    dead = np.zeros(8, dtype=bool)
+    dead[[5, 7]] = True
+    assert_array_equal(table.hosts_of(dead), [0, 2])
+    assert_array_equal(table.remove_pathogens(dead), [0, 2])
+    assert_array_equal(table.pathogens, [3, 4])
+
+
+def test_remap(table: InternalizationTable):
+    table.remap(host_map=np.array([1, -1, 0]), pathogen_map=np.array([-1, -1, -1, 0, 1, 2, 3, 4]))
+    assert_array_equal(table.hosts, [0, 1, 1])
+    assert_array_equal(table.pathogens, [4, 0, 2])
+
+
+def test_compact_hosts(grid: RectangularGrid):
+    cells = MacrophageCellList(grid=grid)
+    cells.extend([MacrophageCellData.create_cell(dead=i == 0) for i in range(3)])
+    cells.phagosome.add_pairs([0, 1, 2], [0, 1, 2])
+
+    cells.compact()
+    assert_array_equal(cells.phagosome.hosts, [0, 1])
+    assert_array_equal(cells.phagosome.pathogens, [1, 2])
+
+
+def test_save_load(state: State, hdf5_group: Group):
+    cells = MacrophageCellList(grid=state.grid)
+    cells.extend([MacrophageCellData.create_cell() for _ in range(3)])
+    cells.phagosome.add_pairs([0, 2], [5, 6])
+
+    cells.save(hdf5_group, 'cells', {})
+    loaded = MacrophageCellList.load(state, hdf5_group, 'cells', {})
+    assert_array_equal(loaded.phagosome.hosts, [0, 2])
+    assert_array_equal(loaded.phagosome.pathogens, [5, 6])
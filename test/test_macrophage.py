@@ -284,8 +284,7 @@ def test_internalize_conidia_none(
     populated_macrophage.internalize_conidia(m_det, 50, 1, grid, populated_fungus)
 
     assert populated_macrophage.len_phagosome(0) == 0
-    for v in cell['phagosome']:
-        assert v == -1
+    assert len(populated_macrophage.phagosome) == 0
 
 
 def test_internalize_conidia_0(
@@ -506,3 +505,18 @@ def test_sporeless30(
 
     macrophage_list.remove_if_sporeless(0.3)
     assert len(macrophage_list.alive()) < 30
+
+
+def test_remap_phagosome_pathogens(
+    populated_macrophage: MacrophageCellList, populated_fungus: FungusCellList
+):
+    populated_macrophage.append_to_phagosome(0, 1, 10)
+    populated_macrophage.append_to_phagosome(0, 2, 10)
+    populated_macrophage.append_to_phagosome(0, 4, 10)
+    populated_fungus.cell_data['dead'][[0, 2]] = True
+
+    index_map = populated_fungus.compact()
+    populated_macrophage.phagosome.remap(pathogen_map=index_map)
+
+    assert populated_macrophage.len_phagosome(0) == 2
+    assert list(populated_macrophage.phagosome.pathogens_of(0)) == [0, 2]
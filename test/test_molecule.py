@@ -0,0 +1,96 @@
+from h5py import Group
+import numpy as np
+from numpy.testing import assert_array_equal
+from pytest import fixture, raises
+
+from nlisim.grid import RectangularGrid
+from nlisim.molecule import MoleculeGrid, MoleculeTypes
+from nlisim.state import State
+
+
+@fixture
+def molecule_grid(grid: RectangularGrid):
+    molecule_grid = MoleculeGrid(grid=grid)
+    molecule_grid.append_molecule_type('iron')
+    molecule_grid.append_molecule_type('m_cyto')
+    yield molecule_grid
+
+
+def test_contiguous_fields(molecule_grid: MoleculeGrid, grid: RectangularGrid):
+    iron = molecule_grid['iron']
+    assert iron.shape == grid.shape
+    assert iron.flags['C_CONTIGUOUS']
+    assert molecule_grid.concentrations['m_cyto'].flags['C_CONTIGUOUS']
+
+
+def test_concentrations(molecule_grid: MoleculeGrid):
+    molecule_grid.concentrations['iron'][1, 2, 3] = 5
+    assert molecule_grid['iron'][1, 2, 3] == 5
+    assert molecule_grid.concentrations.iron[1, 2, 3] == 5
+    assert molecule_grid.concentrations.dtype.names == ('iron', 'm_cyto')
+
+    with raises(KeyError):
+        _ = molecule_grid.concentrations['tf']
+    with raises(KeyError):
+        _ = molecule_grid['tf']
+
+
+def test_stack(molecule_grid: MoleculeGrid):
+    molecule_grid.append_molecule_type('n_cyto')
+    stack = molecule_grid.concentrations.stack(['m_cyto', 'n_cyto'])
+    stack[1, 1, 2, 3] = 5
+    assert stack.shape == (2,) + molecule_grid.shape()
+    assert molecule_grid['n_cyto'][1, 2, 3] == 5
+
+    with raises(KeyError):
+        molecule_grid.concentrations.stack(['iron', 'n_cyto'])
+
+
+def test_incr(molecule_grid: MoleculeGrid):
+    molecule_grid.sources['iron'][:] = 2
+    molecule_grid.incr()
+    molecule_grid.incr()
+    assert (molecule_grid['iron'] == 4).all()
+    assert (molecule_grid['m_cyto'] == 0).all()
+
+
+def test_save_load(state: State, hdf5_group: Group):
+    molecule_grid = MoleculeGrid(grid=state.grid)
+    molecule_grid.append_molecule_type('iron')
+    molecule_grid['iron'][1, 2, 3] = 7
+    molecule_grid.sources['iron'][3, 2, 1] = 1
+
+    molecule_grid.save(hdf5_group, 'molecules', {})
+    loaded = MoleculeGrid.load(state, hdf5_group, 'molecules', {})
+
+    assert loaded.types == ['iron']
+    assert_array_equal(loaded['iron'], molecule_grid['iron'])
+    assert_array_equal(loaded.sources['iron'], molecule_grid.sources['iron'])
+
+
+def test_load_structured(state: State, hdf5_group: Group):
+    dtype = np.dtype(
+        {'names': [m.name for m in MoleculeTypes], 'formats': ['f4'] * len(MoleculeTypes)}
+    )
+    concentrations = np.zeros(state.grid.shape, dtype=dtype)
+    concentrations['iron'][1, 2, 3] = 7
+    group = hdf5_group.create_group('molecules')
+    group.attrs['molecule_type'] = ['iron']
+    group.create_dataset('concentrations', data=concentrations)
+    group.create_dataset('sources', data=np.zeros(state.grid.shape, dtype=dtype))
+
+    loaded = MoleculeGrid.load(state, hdf5_group, 'molecules', {})
+    assert loaded['iron'][1, 2, 3] == 7
+    assert loaded['iron'].flags['C_CONTIGUOUS']
+
+
+def test_allocate_declared_only(grid: RectangularGrid, hdf5_group: Group):
+    molecule_grid = MoleculeGrid(grid=grid)
+    assert molecule_grid.concentrations.dtype.names == ()
+
+    molecule_grid.append_molecule_type('n_cyto')
+    molecule_grid.append_molecule_type('n_cyto')
+    assert molecule_grid.types == ['n_cyto']
+
+    group = molecule_grid.save(hdf5_group, 'molecules', {})
+    assert group['concentrations'].shape == (1,) + grid.shape
@@ -1,8 +1,19 @@
+import json
+from pathlib import Path
+import tracemalloc
+
 import numpy as np
-from pytest import fixture
+from numpy.testing import assert_array_equal
+import pytest
+from pytest import fixture, mark
+
+from nlisim.config import SimulationConfig
 
 # from nlisim.grid import RectangularGrid
+from nlisim.modules.geometry import TissueTypes
 from nlisim.modules.molecules import Molecules
+from nlisim.solver import initialize
+from nlisim.state import State
 
 
 @fixture
@@ -39,6 +50,53 @@ def air_tissue():
     yield t
 
 
+def molecules_state(
+    backend: str,
+    tile_size: int = 4,
+    substeps='3',
+    diffusivity=None,
+    shared: bool = False,
+    threads: int = 1,
+):
+    molecules = [
+        {'name': 'iron', 'init_val': 0, 'init_loc': ['BLOOD']},
+        {'name': 'm_cyto', 'init_val': 0, 'init_loc': ['EPITHELIUM'], 'diffusion': backend},
+        {'name': 'n_cyto', 'init_val': 0, 'init_loc': ['EPITHELIUM']},
+    ]
+    if shared:
+        for molecule in molecules:
+            molecule['diffusion'] = backend
+    if diffusivity is not None:
+        molecules[1]['diffusivity'] = diffusivity
+    config = SimulationConfig(
+        {
+            'simulation': {
+                'modules': 'nlisim.modules.geometry.Geometry\nnlisim.modules.molecules.Molecules',
+                'nx': 20,
+                'ny': 40,
+                'nz': 20,
+                'dx': 10,
+                'dy': 10,
+                'dz': 10,
+                'validate': True,
+                'threads': threads,
+            },
+            'molecules': {
+                'time_step': 1,
+                'diffusion_rate': 0.8,
+                'cyto_evap_m': 0.2,
+                'cyto_evap_n': 0.2,
+                'iron_max': 70,
+                'tile_size': tile_size,
+                'substeps': substeps,
+                'max_substeps': 10,
+                'molecules': json.dumps(molecules),
+            },
+        }
+    )
+    return initialize(State.create(config))
+
+
 # tests
 
 
@@ -86,6 +144,153 @@ def test_convolution_diffusion_air(air_tissue, cyto):
     assert cyto.sum() == 1
 
 
+@mark.parametrize('backend', ['box', 'separable'])
+def test_tiled_diffusion(backend):
+    state = molecules_state(backend)
+    model: Molecules = state.config.modules[1]
+    tissue = state.geometry.lung_tissue
+    m_cyto = state.molecules.grid['m_cyto']
+    m_cyto[2:5, 10:12, 3:9] = 5
+    m_cyto[0, 0, 0] = 1
+    m_cyto[tissue == TissueTypes.AIR.value] = 0
+    state.molecules.grid.sources['m_cyto'][15, 30, 10] = 1
+
+    untiled = molecules_state(backend, tile_size=0)
+    untiled_model: Molecules = untiled.config.modules[1]
+    untiled.molecules.grid['m_cyto'][:] = m_cyto
+    untiled.molecules.grid.sources['m_cyto'][:] = state.molecules.grid.sources['m_cyto']
+
+    for _ in range(3):
+        model.diffuse(state, ['m_cyto'], 1 / 3, threshold=[2], evap=[0.1])
+        untiled_model.diffuse(untiled, ['m_cyto'], 1 / 3, threshold=[2], evap=[0.1])
+
+    assert_array_equal(m_cyto, untiled.molecules.grid['m_cyto'])
+    assert m_cyto[15, 30, 10] > 0
+    updates, _ = model.active_tiles(state).blocks(m_cyto)
+    assert sum(m_cyto[block].size for block in updates) < m_cyto.size
+
+
+def test_fused_diffusion():
+    state = molecules_state('box', tile_size=0)
+    model: Molecules = state.config.modules[1]
+    tissue = state.geometry.lung_tissue
+    m_cyto = state.molecules.grid['m_cyto']
+    m_cyto[:] = np.random.default_rng(0).random(m_cyto.shape) * 4
+    state.molecules.grid.sources['m_cyto'][:] = 1
+
+    expected = (m_cyto + 1) * np.float32(0.9)
+    Molecules.convolution_diffusion(expected, tissue, 3)
+    model.diffuse(state, ['m_cyto'], 1 / 3, threshold=[3], evap=[0.1])
+    assert_array_equal(m_cyto, expected)
+
+    # scratch buffers are reused instead of allocating full size temporaries
+    tracemalloc.start()
+    model.diffuse(state, ['m_cyto'], 1 / 3, threshold=[3], evap=[0.1])
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert peak < m_cyto.nbytes / 2
+
+
+@mark.parametrize('backend', ['box', 'separable', 'implicit'])
+def test_batched_diffusion(backend):
+    names = ['iron', 'm_cyto', 'n_cyto']
+    threshold = [2, np.inf, np.inf]
+    evap = [0, 0.1, 0.2]
+    rng = np.random.default_rng(0)
+    state = molecules_state(backend, shared=True)
+    model: Molecules = state.config.modules[1]
+    for name in names:
+        state.molecules.grid[name][2:10, 5:20, 3:9] = rng.random((8, 15, 6)) * 4
+    state.molecules.grid.sources['n_cyto'][15, 30, 10] = 1
+
+    single = molecules_state(backend, shared=True)
+    single_model: Molecules = single.config.modules[1]
+    for name in names:
+        single.molecules.grid[name][:] = state.molecules.grid[name]
+        single.molecules.grid.sources[name][:] = state.molecules.grid.sources[name]
+
+    model.diffuse(state, names, 1 / 3, threshold=threshold, evap=evap)
+    for i, name in enumerate(names):
+        single_model.diffuse(
+            single, [name], 1 / 3, threshold=threshold[i : i + 1], evap=evap[i : i + 1]
+        )
+
+    for name in names:
+        assert_array_equal(state.molecules.grid[name], single.molecules.grid[name])
+    assert state.molecules.grid['iron'].max() <= 2
+
+
+@mark.parametrize('tile_size', [0, 4])
+@mark.parametrize('backend', ['box', 'separable'])
+def test_threaded_diffusion(backend, tile_size):
+    names = ['iron', 'm_cyto', 'n_cyto']
+    rng = np.random.default_rng(0)
+    serial = molecules_state(backend, tile_size=tile_size, shared=True)
+    threaded = molecules_state(backend, tile_size=tile_size, shared=True, threads=4)
+    for name in names:
+        serial.molecules.grid[name][2:15, 5:20, 3:9] = rng.random((13, 15, 6)) * 4
+        threaded.molecules.grid[name][:] = serial.molecules.grid[name]
+    serial.molecules.grid.sources['n_cyto'][15, 30, 10] = 1
+    threaded.molecules.grid.sources['n_cyto'][15, 30, 10] = 1
+
+    stats = []
+    for state in (serial, threaded):
+        model: Molecules = state.config.modules[1]
+        model.advance(state, 0)
+        model.advance(state, 1)
+        stats.append(model.summary_stats(state))
+
+    for name in names:
+        assert_array_equal(threaded.molecules.grid[name], serial.molecules.grid[name])
+    assert stats[0] == stats[1]
+
+
+@mark.parametrize(
+    'backend,substeps,diffusivity,plan',
+    [
+        ('box', '3', 100, (3, 'box')),
+        ('box', 'auto', None, (3, 'box')),
+        ('separable', 'auto', 50, (2, 'separable')),
+        ('separable', 'auto', 1000, (1, 'implicit')),
+        ('implicit', 'auto', 50, (1, 'implicit')),
+    ],
+)
+def test_substep_plan(backend, substeps, diffusivity, plan):
+    state = molecules_state(backend, substeps=substeps, diffusivity=diffusivity)
+    model: Molecules = state.config.modules[1]
+    assert model.substep_plan(state, 'm_cyto') == plan
+
+
+def test_shipped_config_diffusion():
+    # the shipped molecules have no diffusivity and diffuse by full box averages
+    config = SimulationConfig(
+        Path(__file__).parent.parent / 'config.ini',
+        {
+            'simulation': {
+                'modules': 'nlisim.modules.geometry.Geometry\nnlisim.modules.molecules.Molecules'
+            }
+        },
+    )
+    state = initialize(State.create(config))
+    model: Molecules = state.config.modules[1]
+    for name in state.molecules.grid.types:
+        assert model.diffusion[name] == ('box', None)
+        assert model.substep_plan(state, name) == (3, 'box')
+
+
+def test_substeps_recorded():
+    state = molecules_state('box', substeps='auto', diffusivity=10)
+    model: Molecules = state.config.modules[1]
+    state.molecules.grid.sources['m_cyto'][3, 5, 3] = 1
+    model.advance(state, 0)
+
+    assert_array_equal(state.molecules.substeps, [3, 1, 3])
+    assert model.summary_stats(state)['m_cyto_substeps'] == 1
+
+    # a single sub-step adds the source and decays by the amounts of three
+    assert state.molecules.grid['m_cyto'].sum() == pytest.approx(3 * 0.8**3, rel=1e-5)
+
+
 def test_degrade(cyto):
     cyto[1, 2, 3] = 10
 
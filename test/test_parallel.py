@@ -0,0 +1,25 @@
+from nlisim.parallel import SlabPool, split_blocks
+
+
+def test_slabs():
+    pool = SlabPool(4)
+    slabs = pool.slabs(10, radius=1)
+    assert slabs == [slice(0, 2), slice(2, 5), slice(5, 7), slice(7, 10)]
+    assert pool.slabs(5, radius=1) == [slice(0, 2), slice(2, 5)]
+    assert SlabPool().slabs(10) == [slice(0, 10)]
+
+
+def test_map():
+    pool = SlabPool(3)
+    assert pool.map(lambda x: x * 2, range(5)) == [0, 2, 4, 6, 8]
+    pool.shutdown()
+    assert pool.map(lambda x: x + 1, [1]) == [2]
+
+
+def test_split_blocks():
+    blocks = [(slice(0, 4), slice(1, 2)), (slice(6, 8), slice(0, 3))]
+    assert split_blocks(blocks, slice(3, 7)) == [
+        (slice(3, 4), slice(1, 2)),
+        (slice(6, 7), slice(0, 3)),
+    ]
+    assert split_blocks(blocks, slice(4, 6)) == []
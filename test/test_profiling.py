@@ -0,0 +1,88 @@
+from io import StringIO
+import json
+import threading
+
+import pytest
+
+from nlisim.profiling import Profiler, phase, summarize
+
+
+def test_inactive_phase():
+    with phase('idle'):
+        pass
+
+
+def test_nested_phases():
+    profiler = Profiler()
+    with profiler.activate():
+        for _ in range(2):
+            with phase('macrophage'):
+                with phase('move'):
+                    pass
+                with phase('recruit_new'):
+                    pass
+    with phase('idle'):
+        pass
+
+    assert set(profiler.phases) == {'macrophage', 'macrophage/move', 'macrophage/recruit_new'}
+    assert profiler.phases['macrophage/move'].calls == 2
+    assert profiler.phases['macrophage'].peak_bytes is None
+    assert profiler.wall_time >= profiler.phases['macrophage'].seconds
+
+
+def test_phases_per_thread():
+    profiler = Profiler()
+
+    def run():
+        with phase('fungus'):
+            pass
+
+    with profiler.activate(), phase('macrophage'):
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+
+    assert set(profiler.phases) == {'macrophage', 'fungus'}
+
+
+def test_single_profiler():
+    with Profiler().activate():
+        with pytest.raises(RuntimeError):
+            with Profiler().activate():
+                pass
+
+
+def test_memory():
+    profiler = Profiler(memory=True)
+    with profiler.activate():
+        with phase('outer'):
+            with phase('inner'):
+                data = bytearray(1 << 20)
+            del data
+            with phase('other'):
+                pass
+
+    assert profiler.phases['outer/inner'].peak_bytes >= 1 << 20
+    assert profiler.phases['outer'].peak_bytes >= 1 << 20
+    assert profiler.phases['outer/other'].peak_bytes < 1 << 20
+
+
+def test_save_summarize():
+    profiler = Profiler()
+    with profiler.activate():
+        with phase('fast'):
+            pass
+        with phase('slow'):
+            with phase('inner'):
+                pass
+
+    f = StringIO()
+    profiler.save(f)
+    profile = json.loads(f.getvalue())
+    profile['phases']['slow']['seconds'] = profile['phases']['fast']['seconds'] + 1
+    rows = summarize(profile)
+    assert [row['path'] for row in rows] == ['slow', 'slow/inner', 'fast']
+    assert [row['depth'] for row in rows] == [0, 1, 0]
+
+    del profile['phases']['slow']
+    assert [row['name'] for row in summarize(profile)] == ['fast', 'slow/inner']
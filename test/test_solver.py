@@ -0,0 +1,145 @@
+from threading import Barrier
+from typing import List
+
+import numpy as np
+from pytest import fixture
+
+from nlisim.config import SimulationConfig
+from nlisim.module import ModuleModel
+from nlisim.random import rg
+from nlisim.solver import advance, initialize
+from nlisim.state import State
+
+log: List[str] = []
+draws: List[float] = []
+barrier = Barrier(2, timeout=5)
+
+
+class Recorder(ModuleModel):
+    def advance(self, state: State, previous_time: float) -> State:
+        log.append(self.name)
+        return state
+
+
+class First(Recorder):
+    name = 'first'
+    reads = ()
+    writes = ('first',)
+
+
+class Second(Recorder):
+    name = 'second'
+    reads = ()
+    writes = ('second',)
+
+
+class Third(Recorder):
+    name = 'third'
+    reads = ('first',)
+    writes = ('third',)
+
+
+class WaitingFirst(First):
+    def advance(self, state: State, previous_time: float) -> State:
+        barrier.wait()
+        return super().advance(state, previous_time)
+
+
+class WaitingSecond(Second):
+    def advance(self, state: State, previous_time: float) -> State:
+        barrier.wait()
+        return super().advance(state, previous_time)
+
+
+class Drawing(Recorder):
+    def advance(self, state: State, previous_time: float) -> State:
+        # run at the same time as the other drawing module when concurrent
+        if state.config.getint('simulation', 'module_threads') > 1:
+            barrier.wait()
+        draws.append(rg.random())
+        return super().advance(state, previous_time)
+
+
+class DrawingFirst(Drawing, First):
+    pass
+
+
+class DrawingSecond(Drawing, Second):
+    pass
+
+
+@fixture
+def create_state():
+    def create(modules, module_threads: int = 1) -> State:
+        config = SimulationConfig(
+            {
+                'simulation': {
+                    'modules': '',
+                    'nx': 4,
+                    'ny': 4,
+                    'nz': 4,
+                    'dx': 1,
+                    'dy': 1,
+                    'dz': 1,
+                    'validate': True,
+                    'module_threads': module_threads,
+                },
+                'first': {'time_step': 1},
+                'second': {'time_step': 1},
+                'third': {'time_step': 1},
+            }
+        )
+        for module in modules:
+            config.add_module(module)
+        return State.create(config)
+
+    log.clear()
+    draws.clear()
+    barrier.reset()
+    yield create
+
+
+def test_conflicts():
+    config = SimulationConfig({'simulation': {'modules': ''}})
+    first, second, third = First(config), Second(config), Third(config)
+    assert not first.conflicts(second)
+    assert first.conflicts(third) and third.conflicts(first)
+    assert not second.conflicts(third)
+    assert ModuleModel(config).conflicts(third)
+
+
+def test_serial_modules(create_state):
+    state = create_state([Third, First, Second])
+    states = list(advance(state, 1))
+    assert len(states) == len(log)
+    # the last update is the first module of the step passing the target time
+    assert log == ['third', 'first', 'second', 'third', 'first', 'second', 'third']
+
+
+def test_concurrent_modules(create_state):
+    # the waiting modules deadlock unless they run at the same time
+    state = create_state([Third, WaitingFirst, WaitingSecond], module_threads=2)
+    states = list(advance(state, 1))
+    assert len(states) == len(log) == 7
+    for step in range(2):
+        updates = log[3 * step : 3 * step + 3]
+        assert sorted(updates) == ['first', 'second', 'third']
+        assert updates.index('third') < updates.index('first')
+
+
+def test_concurrent_random_modules(create_state):
+    # modules drawing random numbers do not conflict, each has its own generator
+    config = SimulationConfig({'simulation': {'modules': ''}})
+    assert not DrawingFirst(config).conflicts(DrawingSecond(config))
+
+    def run(module_threads: int) -> List[float]:
+        draws.clear()
+        rg.bit_generator.state = np.random.default_rng(0).bit_generator.state
+        state = initialize(create_state([Third, DrawingFirst, DrawingSecond], module_threads))
+        list(advance(state, 1))
+        return sorted(draws)
+
+    serial = run(1)
+    barrier.reset()
+    assert run(2) == serial
+    assert len(set(serial)) == len(serial) == 4
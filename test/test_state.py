@@ -1,6 +1,17 @@
+from pathlib import Path
+import random
 from tempfile import TemporaryFile
 
-from nlisim.state import State
+import h5py
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+
+from nlisim.config import SimulationConfig
+from nlisim.module import StaticArray
+from nlisim.random import rg
+from nlisim.solver import run_iterator
+from nlisim.state import STATIC_FILE_NAME, State
 
 
 def test_save_state(state: State):
@@ -18,3 +29,142 @@ def test_serialize_state(state: State):
 def test_load_state(state: State):
     new_state = state.load(state.serialize())
     assert new_state is not state
+
+
+def test_compact_cells(state: State):
+    cells = state.fungus.cells
+    cells.extend([cells.CellDataClass.create_cell(dead=bool(i % 2)) for i in range(10)])
+    index_maps = state.compact_cells()
+
+    assert list(index_maps['fungus.cells']) == [0, -1, 1, -1, 2, -1, 3, -1, 4, -1]
+    assert len(cells) == 5
+
+
+def test_save_compacts_cells(state: State):
+    cells = state.fungus.cells
+    cells.extend([cells.CellDataClass.create_cell(dead=bool(i % 2)) for i in range(10)])
+
+    new_state = state.load(state.serialize())
+    assert len(new_state.fungus.cells) == 5
+
+
+def test_compaction_preserves_results():
+    modules = ['geometry', 'molecules', 'fungus', 'epithelium', 'macrophage', 'neutrophil']
+
+    def run(compact_interval: float) -> State:
+        random.seed(0)
+        rg.bit_generator.state = np.random.default_rng(0).bit_generator.state
+        config = SimulationConfig(
+            Path(__file__).parent.parent / 'config.ini',
+            {
+                'simulation': {
+                    'compact_interval': compact_interval,
+                    'modules': '\n'.join(
+                        f'nlisim.modules.{name}.{name.capitalize()}' for name in modules
+                    ),
+                },
+                # keep the epithelium cheap, it loops over every cell in Python
+                'epithelium': {'s_det': 0},
+            },
+        )
+        *_, (state, _) = run_iterator(config, 12)
+        return state
+
+    expected, compacted = run(0), run(1)
+    compacted_lists = 0
+    for name in modules[2:]:
+        cells, compacted_cells = getattr(expected, name).cells, getattr(compacted, name).cells
+        assert_array_equal(
+            cells.cell_data[cells.alive()], compacted_cells.cell_data[compacted_cells.alive()]
+        )
+        compacted_lists += len(compacted_cells) < len(cells)
+    assert compacted_lists > 0
+    for name in expected.molecules.grid.types:
+        assert_array_equal(expected.molecules.grid[name], compacted.molecules.grid[name])
+
+
+def create_geometry_state(tissue: int) -> State:
+    config = SimulationConfig(
+        {
+            'simulation': {
+                'modules': 'nlisim.modules.geometry.Geometry',
+                'nx': 4,
+                'ny': 4,
+                'nz': 4,
+                'dx': 1,
+                'dy': 1,
+                'dz': 1,
+            }
+        }
+    )
+    state = State.create(config)
+    state.geometry.lung_tissue[1, 2, 3] = tissue
+    state.freeze_static()
+    return state
+
+
+@pytest.fixture
+def geometry_state():
+    yield create_geometry_state(3)
+
+
+def test_freeze_static(geometry_state: State):
+    with pytest.raises(ValueError):
+        geometry_state.geometry.lung_tissue[1, 2, 3] = 1
+
+
+def test_save_static(geometry_state: State, tmp_path):
+    static_file = STATIC_FILE_NAME.format(digest=geometry_state.static_digest())
+    geometry_state.save(tmp_path / 'first.hdf5')
+    mtime = (tmp_path / static_file).stat().st_mtime_ns
+    geometry_state.time = 1
+    geometry_state.save(tmp_path / 'second.hdf5')
+    assert (tmp_path / static_file).stat().st_mtime_ns == mtime
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        'first.hdf5',
+        'second.hdf5',
+        static_file,
+    ]
+
+    with h5py.File(tmp_path / 'second.hdf5', 'r') as hf:
+        link = hf['geometry'].get('lung_tissue', getlink=True)
+        assert isinstance(link, h5py.ExternalLink)
+        assert link.filename == static_file
+
+    first = State.load(tmp_path / 'first.hdf5')
+    second = State.load(tmp_path / 'second.hdf5')
+    assert second.time == 1
+    tissue = second.geometry.lung_tissue
+    assert isinstance(tissue, StaticArray) and not tissue.loaded
+    assert tissue[1, 2, 3] == 3
+    assert tissue.loaded
+    assert (tissue == 3).sum() == 1
+    assert tissue.load() is first.geometry.lung_tissue.load()
+    assert not tissue.flags.writeable
+
+
+def test_serialize_static(geometry_state: State):
+    state = State.load(geometry_state.serialize())
+    assert_array_equal(state.geometry.lung_tissue, geometry_state.geometry.lung_tissue)
+
+
+def test_save_static_runs(tmp_path):
+    first, second = create_geometry_state(3), create_geometry_state(1)
+    assert first.static_digest() != second.static_digest()
+    first.save(tmp_path / 'run1-0.hdf5')
+    second.save(tmp_path / 'run2-0.hdf5')
+    assert len(list(tmp_path.glob('static-*.hdf5'))) == 2
+
+    assert State.load(tmp_path / 'run1-0.hdf5').geometry.lung_tissue[1, 2, 3] == 3
+    assert State.load(tmp_path / 'run2-0.hdf5').geometry.lung_tissue[1, 2, 3] == 1
+
+    # a run with the same static variables reuses the existing file
+    third = create_geometry_state(3)
+    third.save(tmp_path / 'run3-0.hdf5')
+    assert len(list(tmp_path.glob('static-*.hdf5'))) == 2
+
+
+def test_static_digest_cached(geometry_state: State, monkeypatch):
+    digest = geometry_state.static_digest()
+    monkeypatch.setattr(geometry_state, '_compute_static_digest', None)
+    assert geometry_state.static_digest() == digest
@@ -0,0 +1,86 @@
+from io import BytesIO, StringIO
+import json
+
+import pytest
+
+from nlisim.config import SimulationConfig
+from nlisim.module import ModuleModel
+from nlisim.profiling import Profiler, phase
+from nlisim.solver import advance
+from nlisim.state import State
+from nlisim.tracing import Tracer
+
+
+class Stepper(ModuleModel):
+    name = 'stepper'
+
+    def advance(self, state: State, previous_time: float) -> State:
+        with phase('inner'):
+            return state
+
+
+def test_span():
+    tracer = Tracer()
+    with tracer.activate():
+        with phase('outer', {'time': 1.0}):
+            with phase('inner'):
+                pass
+    with phase('idle'):
+        pass
+
+    spans = [event for event in tracer.events if event['ph'] == 'X']
+    assert [event['name'] for event in spans] == ['inner', 'outer']
+    inner, outer = spans
+    assert outer['args'] == {'time': 1.0}
+    assert outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+    assert tracer.events[0]['ph'] == 'M'
+
+
+def test_single_tracer():
+    with Tracer().activate():
+        with pytest.raises(RuntimeError):
+            with Tracer().activate():
+                pass
+
+
+def test_profile_and_trace():
+    profiler, tracer = Profiler(), Tracer()
+    with profiler.activate(), tracer.activate():
+        with phase('outer'):
+            pass
+
+    assert profiler.phases['outer'].calls == 1
+    assert [event['name'] for event in tracer.events if event['ph'] == 'X'] == ['outer']
+
+
+def test_sample(state: State):
+    cells = state.fungus.cells
+    cells.extend([cells.CellDataClass.create_cell(dead=bool(i % 2)) for i in range(4)])
+    tracer = Tracer()
+    tracer.sample(state)
+
+    (counter,) = [event for event in tracer.events if event['ph'] == 'C']
+    assert counter['name'] == 'cells'
+    assert counter['args'] == {'fungus.cells': 2}
+
+
+def test_trace_solver():
+    config = SimulationConfig(
+        {
+            'simulation': {'modules': '', 'nx': 4, 'ny': 4, 'nz': 4, 'dx': 1, 'dy': 1, 'dz': 1},
+            'stepper': {'time_step': 1},
+        }
+    )
+    config.add_module(Stepper)
+    state = State.create(config)
+
+    tracer = Tracer()
+    with tracer.activate():
+        updates = len(list(advance(state, 2)))
+        state.save(BytesIO())
+
+    f = StringIO()
+    tracer.save(f)
+    names = [event['name'] for event in json.loads(f.getvalue())['traceEvents']]
+    assert names.count('stepper') == names.count('inner') == updates
+    assert 'save' in names
@@ -1,7 +1,11 @@
 import attr
+import numpy as np
 import pytest
 
-from nlisim.validation import ValidationError, context
+from nlisim.config import SimulationConfig
+from nlisim.module import ModuleModel, ModuleState
+from nlisim.state import State, grid_variable
+from nlisim.validation import StateValidator, ValidationError, context, sampled, sampling
 
 
 def test_validate_initial_state(config, state):
@@ -14,3 +18,91 @@ def test_validation_context(config):
 
     error = excinfo.value
     assert 'After execution of "test context":' in str(error)
+
+
+@attr.s(kw_only=True)
+class FieldState(ModuleState):
+    value = grid_variable()
+
+
+class Field(ModuleModel):
+    name = 'field'
+    StateClass = FieldState
+
+
+@pytest.fixture
+def geometry_state():
+    config = SimulationConfig(
+        {
+            'simulation': {
+                'modules': 'nlisim.modules.geometry.Geometry',
+                'nx': 4,
+                'ny': 4,
+                'nz': 4,
+                'dx': 1,
+                'dy': 1,
+                'dz': 1,
+            }
+        }
+    )
+    config.add_module(Field)
+    yield State.create(config)
+
+
+class Reader(ModuleModel):
+    name = 'reader'
+    reads = ('geometry',)
+    writes = ()
+
+
+class Writer(ModuleModel):
+    name = 'writer'
+    writes = ('geometry', 'field')
+
+
+def test_validate_written(geometry_state: State):
+    validator = StateValidator()
+    geometry_state.field.value[1, 2, 3] = np.nan
+    validator.validate(geometry_state, Reader(geometry_state.config))
+    with pytest.raises(ValidationError):
+        validator.validate(geometry_state, Writer(geometry_state.config))
+
+
+def test_validate_static(geometry_state: State):
+    validator = StateValidator()
+    geometry_state.geometry.lung_tissue[1, 2, 3] = 9
+    validator.validate(geometry_state, Writer(geometry_state.config))
+    with pytest.raises(ValidationError):
+        validator.validate_all(geometry_state)
+
+
+def test_validate_rebound(geometry_state: State):
+    validator = StateValidator()
+    snapshot = validator.snapshot(geometry_state)
+    geometry_state.geometry.lung_tissue = np.full((4, 4, 4), 9)
+    with pytest.raises(ValidationError):
+        validator.validate(geometry_state, Reader(geometry_state.config), snapshot)
+
+
+def test_validate_interval(geometry_state: State):
+    validator = StateValidator(interval=2)
+    writer = Writer(geometry_state.config)
+    validator.validate(geometry_state, writer)
+    geometry_state.field.value[1, 2, 3] = np.nan
+    validator.validate(geometry_state, writer)
+    with pytest.raises(ValidationError):
+        validator.validate(geometry_state, writer)
+
+
+def test_validate_sample(geometry_state: State):
+    geometry_state.geometry.lung_tissue[1, 2, 3] = 9
+    assert sampled(geometry_state.geometry.lung_tissue).size == 64
+    with sampling(np.arange(10)):
+        assert sampled(geometry_state.geometry.lung_tissue).size == 10
+        validator = StateValidator()
+        validator.validate_all(geometry_state)
+
+    validator = StateValidator(sample=0.5, seed=0)
+    indices = validator._sample_indices(64)
+    assert indices is not None
+    assert len(indices) == 32